@@ -0,0 +1,42 @@
+# Convert the GeneID (NCBI RefSeq) and RepeatMasker dictionaries (gzipped pickles) of IgCaller reference files into memory-mapped columnar stores
+# python3 IgCaller_convert_dictionaries.py -I path/to/IgCaller/IgCaller_reference_files/ [-V hg19 hg38]
+
+# Modules
+import argparse
+import glob
+import os
+import pickle
+import gzip
+import sys
+
+# Manage inputs
+parser  = argparse.ArgumentParser(prog='IgCaller_convert_dictionaries', description='''Converts IgCaller GeneID and RepeatMasker dictionaries (*_dictionary.pkl.gz) into columnar stores (*_dictionary_arrays) read by IgCaller through memory mapping''')
+
+parser.add_argument('-I', '--inputsFolder',
+					dest = "inputsFolder",
+					action = "store",
+					required=True,
+					help = "Path to folder containing IgCaller reference files")
+
+parser.add_argument('-V', '--genomeVersion',
+					dest = "genomeVersion",
+					action = "store",
+					nargs = "+",
+					choices=['hg19', 'hg38'],
+					default = ['hg19', 'hg38'],
+					help = "Reference genome versions to convert [default = hg19 hg38]")
+
+args = parser.parse_args()
+
+inputsFolder = os.path.abspath(args.inputsFolder)
+sys.path.insert(0, inputsFolder)
+from IgCaller_functions_v1_1 import annotationIndex, writeAnnotationStore, annotationStoreFolder
+
+# Convert
+for genomeVersion in args.genomeVersion:
+	dictFiles = sorted(glob.glob(os.path.join(inputsFolder, genomeVersion, "dicts", "*_dictionary.pkl.gz")))
+	if len(dictFiles) == 0:
+		print("IgCaller_convert_dictionaries: no dictionaries found in %s" %os.path.join(inputsFolder, genomeVersion, "dicts"))
+	for dictFile in dictFiles:
+		print("IgCaller_convert_dictionaries: %s..." %os.path.basename(dictFile))
+		writeAnnotationStore(annotationIndex(pickle.load(gzip.open(dictFile, 'rb'))), annotationStoreFolder(dictFile))
@@ -1,17 +1,72 @@
 # Modules
 import subprocess
 import os
+import sys
+import glob
 import regex as re
 import numpy as np
-import itertools
 import operator
 from collections import Counter
 from scipy import stats
 from statistics import mean
 import gzip
 import pickle
+import bisect
+import functools
+import itertools
+import multiprocessing
+import hashlib
+import time
+import socket
+import json
+import resource
+import threading
+import inspect
+import types
+from concurrent.futures import ThreadPoolExecutor
+try:
+	import pysam
+except ImportError:
+	pysam = None # BAM files are then read by samtools (-ae samtools)
 
 # dicts
+alleleIndex = {'A': 0, 'C': 1, 'G': 2, 'T': 3} # columns of the allele count arrays (see alleleCounts)
+
+flagReverse = 0x10 # SAM flag bits (read reverse strand, mate reverse strand, first in pair)
+flagMateReverse = 0x20
+flagFirstInPair = 0x40
+
+# columns of the evidence rows (see convertSamToAnnotatedTable and findJandVgenes): SAM fields of the read and its SA tag ("NA" if none, see alignmentRecords), 
+# evidence type ("split", "insertSize", "split-insertSize" or "NA"), 1st/2nd split and insertSize positions, J/V gene at each of them and rearrangement type (Deletion, Inversion1, Inversion2, NotComplete or NA)
+evidenceName, evidenceFlag, evidenceChrom, evidencePos, evidenceMapq, evidenceCigar, evidenceMateChrom, evidenceMatePos, evidenceInsertSize, evidenceSeq, evidenceSA = range(11)
+evidenceType, evidenceSplit1, evidenceSplit2, evidenceInsert1, evidenceInsert2 = range(11, 16)
+evidenceSplitGene1, evidenceSplitGene2, evidenceInsertGene1, evidenceInsertGene2, evidenceSV = range(16, 21) # genes at the positions 4 columns to the left
+
+dGeneSeed = 7 # k-mer length of the D gene seed index (see bestDgene)
+
+igLociRegions = {"hg19": ["14:106052774-107288051", "22:22380000-23264000", "2:89131589-90274600"], # IGH, IGL and IGK regions subset from the BAM files (without chromosome prefix)
+				"hg38": ["14:105583730-106879900", "22:22025700-22921700", "2:88832000-90235600"]}
+
+referenceBundleVersion = "2" # format of the reference bundles written by IgCaller index (see buildReferenceBundle)
+
+summaryHeader = "Analysis\tAnnotation\tMechanism\tScore\tMQ\tV-gene_pct_identity_to_germline\tLength_considered_identity\tFunctionality\tJunction_amino_acid_sequence\tSequence\n" # header of the main output file (see analyseSample)
+
+sweepParameters = ["vafCutoff", "tumorPurity", "mntoncoPass", "mnnonco", "minReductionCSR", "maxPvalueCSR"] # settings IgCaller sweep takes several values of (see sweepSample)
+stageParameters = {"IGH": ["vafCutoff", "tumorPurity"], "IGK": ["vafCutoff", "tumorPurity"], "IGL": ["vafCutoff", "tumorPurity"], "CSR": ["tumorPurity", "minReductionCSR", "maxPvalueCSR"], # sweep settings each stage depends on (see sampleStages)
+				"oncogenic": ["tumorPurity", "mntoncoPass", "mnnonco"]}
+
+metricsState = {"enabled": False, "start": None, "steps": [], "reads": 0, "samtools": 0} # -met yes: steps recorded by this process, reads streamed and samtools processes spawned so far (see metricsStep)
+metricsLock = threading.Lock() # reads and samtools counters are updated by the tumor and normal threads (see metricsCount)
+
+traceState = {"enabled": False, "events": []} # -trace yes: Chrome trace events recorded by this process (see traceEvent)
+untracedFunctions = ["parseSA", "parseCigar", "alignmentSpan", "overlapsIntervals", "readAlleleEvents", "pileupAlleles", "bedGeneAt", "candidatesAt", "smithwaterman", "seedlessScoreBound", # called per read, pileup position or sequence pair
+					"traceEvent", "tracedFunction", "enableTracing", "writeTrace", "measuredStage", "metricsMark", "metricsRecord", "metricsStep", "metricsCount", "ioCounters"] # not traced (see enableTracing)
+
+checkpointVersion = "1" # format of the stage checkpoints (see checkpoint), part of all checkpoint keys
+checkpointState = {"folder": None, "keys": {}} # checkpoint folder of the sample being analysed (None = -ckp no) and checkpoint keys of its IG and mini BAM files (see analyseSample)
+
+pileupDigit = re.compile("[0-9]") # indel lengths and ^N mapping qualities in mpileup base strings (see pileupAlleles)
+
 complement = {'A': 'T', 'C': 'G', 'G': 'C', 'T': 'A', 'N': 'N', 'R': 'R', '[': ']', ']': '[', '(': ')', ')': '('}
 
 tripletsToAA = {'ATA':'I', 'ATC':'I', 'ATT':'I', 'ATG':'M',
@@ -34,18 +89,25 @@ tripletsToAA = {'ATA':'I', 'ATC':'I', 'ATT':'I', 'ATG':'M',
 
 # functions
 def smithwaterman(x, y, match_score=5, mismatch_cost=4, gap_cost=8):
-    # scoring matrix
-	M = np.zeros((len(x) + 1, len(y) + 1), np.int) # +1 because of the zero column and zero row
-	for i, j in itertools.product(range(1, M.shape[0]), range(1, M.shape[1])): 
-		match = M[i - 1, j - 1] + (match_score if x[i - 1] == y[j - 1] else - mismatch_cost)
-		delete = M[i - 1, j] - gap_cost
-		insert = M[i, j - 1] - gap_cost
-		M[i, j] = max(match, delete, insert, 0)
-	# Get maximum score
-	M_flip = np.flip(np.flip(M, 0), 1)
-	i_, j_ = np.unravel_index(M_flip.argmax(), M_flip.shape)
-	i, j = np.subtract(M.shape, (i_ + 1, j_ + 1))
-	return M[i,j]
+	# best local alignment score of x and y
+	return(smithwatermanScores(x, [y], match_score, mismatch_cost, gap_cost)[0])
+
+def smithwatermanScores(x, ys, match_score=5, mismatch_cost=4, gap_cost=8):
+	# best local alignment score of x against each sequence in ys, all of them at once (NumPy array): the scoring matrices are filled one row (base of x) at a time for all ys,
+	# the gaps within a row being a running maximum: M[i, j] = max over k <= j of (max(match, delete, 0) at k) - (j-k)*gap_cost
+	scores = np.zeros(len(ys), dtype=np.int64)
+	n = max([len(y) for y in ys]+[0])
+	if n == 0: return(scores)
+	Y = np.zeros((len(ys), n), dtype=np.uint8) # 0 = padding, never matches
+	for b, y in enumerate(ys): Y[b, :len(y)] = np.frombuffer(y.encode(), dtype=np.uint8)
+	inY = np.arange(n) < np.array([len(y) for y in ys])[:, None]
+	gaps = gap_cost*np.arange(1, n+1)
+	M = np.zeros((len(ys), n+1), dtype=np.int64) # previous row, +1 because of the zero column
+	for base in x.encode():
+		matchOrDelete = np.maximum(M[:, :-1] + np.where(Y == base, match_score, -mismatch_cost), M[:, 1:] - gap_cost)
+		M[:, 1:] = np.maximum.accumulate(np.maximum(matchOrDelete, 0) + gaps, axis=1) - gaps # insert
+		scores = np.maximum(scores, np.where(inY, M[:, 1:], 0).max(axis=1))
+	return(scores)
 
 def getGeneralInfo(GENE, chrom, genomeVersion, inputsFolder, chrAnnot):
 	Dseqs = "NA"
@@ -75,80 +137,683 @@ def getGeneralInfo(GENE, chrom, genomeVersion, inputsFolder, chrAnnot):
 	
 	return(chromGene, bedFile, Dseqs)
 
-def flagToCustomBinary (flag):
-	binary = format(int(flag), "b")
-	binary = ("0"*(12-len(binary)))+binary
-	return(binary[::-1])
+def annotationFiles(inputsFolder, genomeVersion):
+	# GeneID (NCBI RefSeq) and RepeatMasker dictionaries of a genome version (gzipped pickles, see loadAnnotation)
+	return({"RepeatMasker": inputsFolder+"/"+genomeVersion+"/dicts/RepeatMasker_rmsk_"+genomeVersion+"_dictionary.pkl.gz", "GeneID": inputsFolder+"/"+genomeVersion+"/dicts/NCBI_RefSeq_All_"+genomeVersion+"_dictionary.pkl.gz"})
+
+def compileReference(inputsFolder, genomeVersion, chrAnnot):
+	# reference of a genome version and chromosome annotation: IG regions subset from the BAM files and, for each locus, its chromosome, BED index (with the orientation windows, see geneBedIndex), merged BED intervals (see locusIntervals) and D genes (IGH)
+	chrom = "" if chrAnnot == "ensembl" else "chr"
+	reference = {"version": referenceBundleVersion, "genomeVersion": genomeVersion, "chrAnnot": chrAnnot, "coordsToSubset": " ".join([chrom+region for region in igLociRegions[genomeVersion]]), "loci": {}}
+	for GENE in ["IGH", "IGK", "IGL", "CSR"]:
+		chromGene, bedFile, Dseqs = getGeneralInfo(GENE, chrom, genomeVersion, inputsFolder, chrAnnot)
+		reference["loci"][GENE] = {"chromGene": chromGene, "bedIndex": geneBedIndex(bedFile, GENE), "intervals": locusIntervals(bedFile), "dGenes": None if Dseqs == "NA" else readDgenes(Dseqs)}
+	return(reference)
+
+def validateReference(inputsFolder, genomeVersion, chrAnnot):
+	# checks the reference files of a genome version and chromosome annotation (done once, by IgCaller index): BED files on the chromosome of their locus with valid coordinates, D genes as DNA sequences and GeneID/RepeatMasker dictionaries available
+	chrom = "" if chrAnnot == "ensembl" else "chr"
+	for GENE in ["IGH", "IGK", "IGL", "CSR"]:
+		chromGene, bedFile, Dseqs = getGeneralInfo(GENE, chrom, genomeVersion, inputsFolder, chrAnnot)
+		for refFile in [bedFile] if Dseqs == "NA" else [bedFile, Dseqs]:
+			if not os.path.isfile(refFile): sys.exit("IgCaller: error message... reference file "+refFile+" not found.")
+		
+		BED = open(bedFile, "r")
+		for n, k in enumerate(BED):
+			v = k.rstrip("\n").split("\t")
+			if len(v) < 4 or v[0] != chromGene or not v[1].isdigit() or not v[2].isdigit() or int(v[1]) > int(v[2]):
+				sys.exit("IgCaller: error message... line "+str(n+1)+" of "+bedFile+" is not a BED line of the "+GENE+" locus (chromosome "+chromGene+").")
+		BED.close()
+		
+		if Dseqs != "NA":
+			sqs = open(Dseqs, "r")
+			for n, k in enumerate(sqs):
+				w = k.rstrip("\n").split("\t")
+				if len(w) < 2 or w[1] == "" or set(w[1]) - set("ACGT"):
+					sys.exit("IgCaller: error message... line "+str(n+1)+" of "+Dseqs+" is not a D gene name and sequence.")
+			sqs.close()
 	
-def convertSamToAnnotatedTable(miniSamT, chromGene, GENE):
+	for dictFile in annotationFiles(inputsFolder, genomeVersion).values():
+		if not os.path.isfile(dictFile) and not os.path.isfile(os.path.join(annotationStoreFolder(dictFile), "chroms.tsv")):
+			sys.exit("IgCaller: error message... annotation dictionary "+dictFile+" not found.")
+
+def referenceBundleFolder(inputsFolder, genomeVersion, chrAnnot):
+	return(inputsFolder+"/"+genomeVersion+"/"+chrAnnot+"/IgCaller_bundle")
+
+def fileChecksum(path):
+	checksum = hashlib.sha256()
+	with open(path, "rb") as f:
+		for block in iter(lambda: f.read(1 << 20), b""): checksum.update(block)
+	return(checksum.hexdigest())
+
+def buildReferenceBundle(inputsFolder, genomeVersion, chrAnnot):
+	# IgCaller index: validates the reference files once and writes the bundle of a genome version and chromosome annotation: the compiled reference (reference.pkl, see compileReference) and a manifest with the bundle version, 
+	# the SHA-256 of the compiled reference and the SHA-256, size and modification time of the files it was built from (see staleBundleSource). GeneID/RepeatMasker dictionaries are (re)converted into memory-mapped stores, shared by both chromosome annotations (see openAnnotationStore)
+	validateReference(inputsFolder, genomeVersion, chrAnnot)
+	bundle = referenceBundleFolder(inputsFolder, genomeVersion, chrAnnot)
+	if not os.path.exists(bundle): os.mkdir(bundle)
 	
-	samfile = open(miniSamT, "r")
+	sources = []
+	for dictFile in annotationFiles(inputsFolder, genomeVersion).values():
+		if os.path.isfile(dictFile):
+			writeAnnotationStore(annotationIndex(pickle.load(gzip.open(dictFile, 'rb'))), annotationStoreFolder(dictFile))
+			sources.append(dictFile)
+		sources.extend(sorted(glob.glob(os.path.join(annotationStoreFolder(dictFile), "*"))))
+	for GENE in ["IGH", "IGK", "IGL", "CSR"]:
+		chromGene, bedFile, Dseqs = getGeneralInfo(GENE, "" if chrAnnot == "ensembl" else "chr", genomeVersion, inputsFolder, chrAnnot)
+		sources.extend([bedFile] if Dseqs == "NA" else [bedFile, Dseqs])
 	
-	store = {}
+	REF = open(bundle+"/reference.pkl", "wb")
+	pickle.dump(compileReference(inputsFolder, genomeVersion, chrAnnot), REF)
+	REF.close()
+	
+	MANIFEST = open(bundle+"/manifest.tsv", "w")
+	MANIFEST.write("version\t%s\ngenomeVersion\t%s\nchrAnnot\t%s\nreference.pkl\t%s\n" %(referenceBundleVersion, genomeVersion, chrAnnot, fileChecksum(bundle+"/reference.pkl")))
+	for source in sources: MANIFEST.write("source\t%s\t%s\t%s\t%s\n" %(os.path.relpath(source, inputsFolder), fileChecksum(source), os.stat(source).st_size, os.stat(source).st_mtime_ns))
+	MANIFEST.close()
+	return(bundle)
+
+def staleBundleSource(inputsFolder, source, checksum, size, mtime):
+	# True if a file a bundle was built from (manifest line, see buildReferenceBundle) was removed or changed since IgCaller index: checksummed again only if its size is the same but not its modification time
+	path = os.path.join(inputsFolder, source)
+	if not os.path.isfile(path): return(True)
+	stat = os.stat(path)
+	if str(stat.st_size) != size: return(True)
+	return(str(stat.st_mtime_ns) != mtime and fileChecksum(path) != checksum)
+
+@functools.lru_cache(maxsize=None)
+def loadReference(inputsFolder, genomeVersion, chrAnnot):
+	# reference of the run: from the bundle written by IgCaller index if any (checking its version, the checksum of the compiled reference and that the files it was built from did not change), else compiled from the reference files
+	bundle = referenceBundleFolder(inputsFolder, genomeVersion, chrAnnot)
+	if not os.path.isfile(bundle+"/manifest.tsv"): return(compileReference(inputsFolder, genomeVersion, chrAnnot))
+	
+	manifest = {}
+	sources = []
+	MANIFEST = open(bundle+"/manifest.tsv", "r")
+	for line in MANIFEST:
+		w = line.rstrip("\n").split("\t")
+		if w[0] != "source": manifest[w[0]] = w[1]
+		else: sources.append(w[1:])
+	MANIFEST.close()
+	if manifest.get("version") != referenceBundleVersion:
+		sys.exit("IgCaller: error message... reference bundle "+bundle+" was written by another version of IgCaller, run IgCaller index again.")
+	if not os.path.isfile(bundle+"/reference.pkl") or fileChecksum(bundle+"/reference.pkl") != manifest.get("reference.pkl"):
+		sys.exit("IgCaller: error message... reference bundle "+bundle+" is incomplete or corrupted, run IgCaller index again.")
+	for source in sources:
+		if len(source) != 4 or staleBundleSource(inputsFolder, *source):
+			sys.exit("IgCaller: error message... reference file "+os.path.join(inputsFolder, source[0])+" changed since reference bundle "+bundle+" was written, run IgCaller index again.")
+	
+	REF = open(bundle+"/reference.pkl", "rb")
+	reference = pickle.load(REF)
+	REF.close()
+	return(reference)
+
+def runConcurrently(calls):
+	# run [function, arg1, arg2...] calls in threads (ie tumor and normal I/O overlap) and return their results in the same order
+	if len(calls) == 1: return([calls[0][0](*calls[0][1:])])
+	with ThreadPoolExecutor(max_workers=len(calls)) as EXECUTOR:
+		running = [EXECUTOR.submit(call[0], *call[1:]) for call in calls]
+		return([r.result() for r in running])
+
+def ioCounters():
+	# bytes read from and written to storage by this process and its finished subprocesses (Linux /proc/self/io, page cache hits are not read from storage), [None, None] if not available
+	try:
+		IO = open("/proc/self/io", "r")
+		io = dict(line.rstrip("\n").split(": ") for line in IO if ": " in line)
+		IO.close()
+		return([int(io["read_bytes"]), int(io["write_bytes"])])
+	except (OSError, KeyError, ValueError):
+		return([None, None])
+
+def metricsMark():
+	# resources used so far by this process (threads included) and its finished subprocesses (see metricsStep), None if -met no
+	if not metricsState["enabled"]: return(None)
+	own = resource.getrusage(resource.RUSAGE_SELF)
+	children = resource.getrusage(resource.RUSAGE_CHILDREN)
+	diskRead, diskWritten = ioCounters()
+	return({"wall": time.time(), "cpu": own.ru_utime+own.ru_stime+children.ru_utime+children.ru_stime, "rss": own.ru_maxrss, "reads": metricsState["reads"], "samtools": metricsState["samtools"], "diskRead": diskRead, "diskWritten": diskWritten})
+
+def metricsCount(counter, n):
+	# add n to the reads or samtools counter of metricsState, from any of the threads of runConcurrently
+	with metricsLock:
+		metricsState[counter] += n
+
+def metricsRecord(mark, now):
+	# usage between two marks (see metricsMark): peak RSS is the high-water mark of the process so far (subprocesses not included, their RSS is inherited from the process until exec)
+	return({"wall_seconds": round(now["wall"]-mark["wall"], 3), "cpu_seconds": round(now["cpu"]-mark["cpu"], 3), "peak_rss_mb": round(now["rss"]/1024, 1), 
+		"reads": now["reads"]-mark["reads"], "samtools_processes": now["samtools"]-mark["samtools"], "disk_bytes_read": None if mark["diskRead"] is None else now["diskRead"]-mark["diskRead"], "disk_bytes_written": None if mark["diskWritten"] is None else now["diskWritten"]-mark["diskWritten"]})
+
+def metricsStep(stage, step, name, mark, counts=None):
+	# -met yes: records the resources used by a step since mark (see metricsMark) and its counts (ie evidence rows, candidates), returns the mark of the next step
+	if mark is None: return(None)
+	if counts is None: counts = {}
+	now = metricsMark()
+	record = {"stage": stage, "step": step, "name": name, "process": os.getpid()}
+	record.update(metricsRecord(mark, now))
+	record.update(counts)
+	metricsState["steps"].append(record)
+	return(now)
+
+def traceEvent(name, category, start, args=None):
+	# -trace yes: complete event (Chrome trace event format) from start (time.perf_counter(), same clock in all processes) to now, in this process and thread
+	event = {"name": name, "cat": category, "ph": "X", "ts": round(start*1000000, 1), "dur": round((time.perf_counter()-start)*1000000, 1), "pid": os.getpid(), "tid": threading.get_ident()}
+	if args is not None: event["args"] = args
+	traceState["events"].append(event)
+
+def tracedFunction(function):
+	# function recording a trace event for each call (generators: from the first item to the last)
+	if inspect.isgeneratorfunction(function):
+		@functools.wraps(function)
+		def traced(*args, **kwargs):
+			start = time.perf_counter()
+			yield from function(*args, **kwargs)
+			traceEvent(function.__name__, "function", start)
+	else:
+		@functools.wraps(function)
+		def traced(*args, **kwargs):
+			start = time.perf_counter()
+			try:
+				return(function(*args, **kwargs))
+			finally:
+				traceEvent(function.__name__, "function", start)
+	return(traced)
+
+def enableTracing():
+	# -trace yes: the functions of this module (but untracedFunctions) are replaced by their traced versions (see tracedFunction), so that the calls between them are traced too. 
+	# Without -trace yes nothing is replaced and tracing costs nothing
+	traceState["events"] = []
+	if traceState["enabled"]: return
+	traceState["enabled"] = True
+	module = sys.modules[__name__]
+	for name, value in list(vars(module).items()):
+		if name in untracedFunctions: continue
+		if isinstance(value, types.FunctionType) and value.__module__ == __name__: setattr(module, name, tracedFunction(value))
+		elif hasattr(value, "cache_info") and getattr(value.__wrapped__, "__module__", None) == __name__: setattr(module, name, tracedFunction(value)) # lru_cache functions
+	print("IgCaller: tracing...")
+
+def writeTrace(traceFile, events):
+	# -trace yes: events (see traceEvent) as a Chrome trace event file (chrome://tracing, Perfetto), processes named after their role
+	names = []
+	for pid in sorted(set([event["pid"] for event in events])):
+		names.append({"name": "process_name", "ph": "M", "pid": pid, "args": {"name": "IgCaller" if pid == os.getpid() else "IgCaller -j process "+str(pid)}})
+	TRACE = open(traceFile, "w")
+	json.dump({"traceEvents": names+events, "displayTimeUnit": "ms"}, TRACE)
+	TRACE.write("\n")
+	TRACE.close()
+
+def measuredStage(name, function, *args):
+	# run a stage (see runStages) as a trace span named after it and return [its result, the steps (see metricsStep) and trace events (see traceEvent) it recorded], so that they are collected from the -j processes
+	before = [len(metricsState["steps"]), len(traceState["events"])]
+	start = time.perf_counter()
+	result = function(*args)
+	if traceState["enabled"]: traceEvent(name, "stage", start)
+	steps = metricsState["steps"][before[0]:]
+	events = traceState["events"][before[1]:]
+	del metricsState["steps"][before[0]:]
+	del traceState["events"][before[1]:]
+	return([result, steps, events])
+
+def writeMetrics(metricsFile, originalBamT, originalBamN, settings, steps):
+	# -met yes: JSON report of the run (totals since prepareSample, settings and steps, see metricsStep)
+	report = {"tumor_bam": originalBamT, "normal_bam": originalBamN, "alignment_engine": settings["alignmentEngine"], "jobs": settings["jobs"]}
+	report.update(metricsRecord(metricsState["start"], metricsMark()))
+	report["samtools_processes"] = sum([step["samtools_processes"] for step in steps])
+	report["reads"] = sum([step["reads"] for step in steps])
+	report["steps"] = steps
+	METRICS = open(metricsFile, "w")
+	json.dump(report, METRICS, indent=1)
+	METRICS.write("\n")
+	METRICS.close()
+
+def fileIdentity(path):
+	# input file as part of a checkpoint key: absolute path, size and modification time (None if no file)
+	if path is None: return(None)
+	return([os.path.abspath(path), os.path.getsize(path), os.path.getmtime(path)])
 
-	for i in samfile:
+def checkpointKey(*parts):
+	return(hashlib.sha1(repr([checkpointVersion]+list(parts)).encode()).hexdigest())
+
+def bamKey(bam):
+	# checkpoint key of an IG or mini BAM file: the input BAM and the parameters it was extracted with (see analyseSample)
+	return(None if bam is None else checkpointState["keys"].get(bam))
+
+def checkpoint(stage, parts, function, *args):
+	# function(*args) with its output saved in the checkpoint folder (-ckp yes) under a key made from the inputs and parameters the stage depends on (parts), 
+	# so that a rerun with the same key reads it back instead of computing it again. Checkpoints not used by a run are removed at its end (see cleanCheckpoints)
+	if checkpointState["folder"] is None: return(function(*args))
+	ckpt = checkpointState["folder"]+"/"+stage+"_"+checkpointKey(stage, parts)+".pkl"
+	if os.path.isfile(ckpt):
+		try:
+			CKPT = open(ckpt, "rb")
+			value = pickle.load(CKPT)
+			CKPT.close()
+			os.utime(ckpt) # used by this run
+			return(value)
+		except (EOFError, pickle.UnpicklingError):
+			pass # unreadable checkpoint, computed again
+	value = function(*args)
+	CKPT = open(ckpt+"."+str(os.getpid()), "wb")
+	pickle.dump(value, CKPT)
+	CKPT.close()
+	os.replace(ckpt+"."+str(os.getpid()), ckpt) # written at once: an interrupted run leaves no partial checkpoint
+	return(value)
+
+def cleanCheckpoints(folder, runStart):
+	# remove the checkpoints not written or read since runStart (ie outdated by a parameter or input change)
+	for ckpt in glob.glob(folder+"/*.pkl"):
+		if os.path.getmtime(ckpt) < runStart: os.remove(ckpt)
+
+def extractionCurrent(bam, loci, key):
+	# IG and mini BAM files of a previous run extracted with the same key (-ckp yes), see analyseSample
+	if checkpointState["folder"] is None or not os.path.isfile(checkpointState["folder"]+"/"+os.path.basename(bam)+".key"): return(False)
+	KEY = open(checkpointState["folder"]+"/"+os.path.basename(bam)+".key", "r")
+	current = KEY.read().strip() == key
+	KEY.close()
+	for f in [bam]+[loci[GENE][1] for GENE in loci]:
+		if not os.path.isfile(f) or not os.path.isfile(f+".bai"): current = False
+	return(current)
+
+def mergeIntervals(intervals):
+	# sort and merge [chrom, start, end] intervals (0-based, half-open)
+	merged = []
+	for chromI, start, end in sorted(intervals):
+		if len(merged) > 0 and merged[-1][0] == chromI and start <= merged[-1][2]:
+			merged[-1][2] = max(merged[-1][2], end)
+		else:
+			merged.append([chromI, start, end])
+	return(merged)
+
+def parseRegions(regions):
+	# "chr:start-end chr:start-end" (1-based, inclusive) to [chrom, start, end] intervals (0-based, half-open)
+	intervals = []
+	for region in regions.split():
+		chromR, coords = region.rsplit(":", 1)
+		intervals.append([chromR, int(coords.split("-")[0])-1, int(coords.split("-")[1])])
+	return(intervals)
+
+def readBedIntervals(bedFile):
+	intervals = []
+	BED = open(bedFile, "r")
+	for k in BED:
+		v = k.rstrip("\n").split("\t")
+		intervals.append([v[0], int(v[1]), int(v[2])])
+	BED.close()
+	return(intervals)
+
+def fetchAlignments(BAM, regions):
+	# reads overlapping the regions, in file order and reported once (as samtools view does)
+	intervals = [x for x in mergeIntervals(parseRegions(regions)) if BAM.get_tid(x[0]) >= 0]
+	prevChrom = None
+	prevEnd = 0
+	for chromI, start, end in sorted(intervals, key=lambda x: (BAM.get_tid(x[0]), x[1])):
+		for read in BAM.fetch(chromI, start, end):
+			if chromI == prevChrom and read.reference_start < prevEnd: continue # already reported by the previous interval
+			yield read
+		prevChrom = chromI
+		prevEnd = end
+
+def alignmentRecords(bam, alignmentEngine, pathToSamtools, threadsForSamtools, mapq="0"):
+	# stream the reads of a BAM file (samtools view [-q mapq] bam) as lists with the SAM fields 1-10 and the SA tag ("SA:Z:..." or "NA"), without writing SAM files
+	if alignmentEngine == "samtools":
+		command = pathToSamtools+"samtools view -@ "+threadsForSamtools+" -q "+mapq+" "+bam
+		traceStart = time.perf_counter()
+		READER = subprocess.Popen(command, shell=True, stdout=subprocess.PIPE, universal_newlines=True)
+		metricsCount("samtools", 1)
+		n = 0
+		try: # reads counted even if the consumer stops early
+			for line in READER.stdout:
+				w = line.rstrip("\n").split("\t")
+				sa = "NA"
+				for x in (w[11:]): # get SA:... after qualities
+					if x.startswith("SA:Z"):
+						sa = x
+						break
+				n += 1
+				yield(w[:10]+[sa])
+			READER.wait()
+			if traceState["enabled"]: traceEvent("samtools view", "samtools", traceStart, {"command": command})
+		finally:
+			metricsCount("reads", n)
+		return
+	
+	BAM = pysam.AlignmentFile(bam, "rb", threads=int(threadsForSamtools))
+	n = 0
+	try: # reads counted even if the consumer stops early
+		for read in BAM.fetch(until_eof=True):
+			if read.mapping_quality < int(mapq): continue
+			n += 1
+			if read.next_reference_id < 0: rnext = "*"
+			elif read.next_reference_id == read.reference_id: rnext = "="
+			else: rnext = read.next_reference_name
+			yield([read.query_name, str(read.flag), read.reference_name if read.reference_id >= 0 else "*", str(read.reference_start+1), str(read.mapping_quality), read.cigarstring or "*", rnext, str(read.next_reference_start+1), str(read.template_length), read.query_sequence or "*", "SA:Z:"+read.get_tag("SA") if read.has_tag("SA") else "NA"])
+	finally:
+		metricsCount("reads", n)
+	BAM.close()
+
+def indexBam(bam, alignmentEngine, pathToSamtools, threadsForSamtools):
+	if alignmentEngine == "samtools":
+		command = pathToSamtools+"samtools index -@ "+threadsForSamtools+" "+bam
+		traceStart = time.perf_counter()
+		subprocess.call(command, shell=True)
+		metricsCount("samtools", 1)
+		if traceState["enabled"]: traceEvent("samtools index", "samtools", traceStart, {"command": command})
+	else:
+		pysam.index("-@", threadsForSamtools, bam)
+
+def locusIntervals(bedFile):
+	# merged BED intervals as {chrom: [starts, ends]}, for overlap queries with bisect
+	intervals = {}
+	for chromI, start, end in mergeIntervals(readBedIntervals(bedFile)):
+		if chromI not in intervals: intervals[chromI] = [[], []]
+		intervals[chromI][0].append(start)
+		intervals[chromI][1].append(end)
+	return(intervals)
+
+def overlapsIntervals(intervals, chromR, start, end):
+	if chromR not in intervals: return(False)
+	starts, ends = intervals[chromR]
+	idx = bisect.bisect_right(ends, start) # first interval ending after the read start
+	return(idx < len(ends) and starts[idx] < end)
+
+def alignmentSpan(flag, pos, cigar):
+	# 0-based [start, end) covered by a SAM record, as htslib bam_endpos (unmapped or no reference bases = 1 base)
+	rlen = 0
+	if not flag & 4 and cigar != "*":
+		rlen = parseCigar(cigar)["refSpan"]
+	return(pos-1, pos-1+max(rlen, 1))
+
+def extractIgLoci(originalBam, bamOut, loci, coordsToSubset, mapq, alignmentEngine, pathToSamtools, threadsForSamtools):
+	# single pass over the input BAM writing the IG BAM (-F 3328 -q mapq coordsToSubset) and, for each locus in loci = {GENE: [BED intervals (see locusIntervals), miniBam]}, 
+	# the reads overlapping its BED intervals (as samtools view -L), so that each file is written and indexed once
+	intervals = {}
+	for GENE in loci: intervals[GENE] = loci[GENE][0]
+	
+	if alignmentEngine == "samtools":
+		traceStart = time.perf_counter()
+		READER = subprocess.Popen(pathToSamtools+"samtools view -@ "+threadsForSamtools+" -h -F 3328 -q "+mapq+" "+originalBam+" "+coordsToSubset, shell=True, stdout=subprocess.PIPE, universal_newlines=True)
+		OUT = subprocess.Popen(pathToSamtools+"samtools view -@ "+threadsForSamtools+" -b -o "+bamOut+" -", shell=True, stdin=subprocess.PIPE, universal_newlines=True)
+		MINI = {}
+		for GENE in loci: MINI[GENE] = subprocess.Popen(pathToSamtools+"samtools view -@ "+threadsForSamtools+" -b -o "+loci[GENE][1]+" -", shell=True, stdin=subprocess.PIPE, universal_newlines=True)
+		metricsCount("samtools", 2+len(loci))
+		n = 0
+		for line in READER.stdout:
+			OUT.stdin.write(line)
+			if line[0] == "@": # header
+				for GENE in loci: MINI[GENE].stdin.write(line)
+				continue
+			n += 1
+			v = line.split("\t", 6)
+			start, end = alignmentSpan(int(v[1]), int(v[3]), v[5])
+			for GENE in loci:
+				if overlapsIntervals(intervals[GENE], v[2], start, end): MINI[GENE].stdin.write(line)
+		READER.wait()
+		if traceState["enabled"]: traceEvent("samtools view", "samtools", traceStart, {"command": READER.args})
+		for P in [OUT]+list(MINI.values()):
+			P.stdin.close()
+			P.wait()
+			if traceState["enabled"]: traceEvent("samtools view", "samtools", traceStart, {"command": P.args})
+	
+	else:
+		BAMIN = pysam.AlignmentFile(originalBam, "rb", threads=int(threadsForSamtools))
+		OUT = pysam.AlignmentFile(bamOut, "wb", template=BAMIN, threads=int(threadsForSamtools))
+		MINI = {}
+		for GENE in loci: MINI[GENE] = pysam.AlignmentFile(loci[GENE][1], "wb", template=BAMIN)
+		n = 0
+		for read in fetchAlignments(BAMIN, coordsToSubset):
+			if read.flag & 3328 or read.mapping_quality < int(mapq): continue
+			OUT.write(read)
+			n += 1
+			start = read.reference_start
+			end = read.reference_end if read.reference_end is not None else start+1
+			for GENE in loci:
+				if overlapsIntervals(intervals[GENE], read.reference_name, start, end): MINI[GENE].write(read)
+		for F in [OUT]+list(MINI.values()): F.close()
+		BAMIN.close()
+	
+	for bam in [bamOut]+[loci[GENE][1] for GENE in loci]:
+		indexBam(bam, alignmentEngine, pathToSamtools, threadsForSamtools)
+	metricsCount("reads", n) # reads of the IG BAM
+
+def pileupRegion(bam, chromGene, start, end, baseq, refGenome, anomalous, outFile, alignmentEngine, pathToSamtools):
+	# samtools mpileup -B [-A] -Q baseq [-f refGenome] -r chromGene:start-end bam, as a list of [chrom, pos, ref, depth, bases]
+	columns = pileupRegions(bam, chromGene, [[start, end]], baseq, refGenome, anomalous, outFile, alignmentEngine, pathToSamtools)
+	return([columns[pos] for pos in sorted(columns)])
+
+def pileupRegions(bam, chromGene, regions, baseq, refGenome, anomalous, outFile, alignmentEngine, pathToSamtools):
+	# samtools mpileup -B [-A] -Q baseq [-f refGenome] over all [start, end] regions (1-based) of chromGene in a single call, as {pos: [chrom, pos, ref, depth, bases]}
+	merged = mergeIntervals([[chromGene, int(start)-1, int(end)] for start, end in regions])
+	columns = {}
+	if len(merged) == 0: return(columns)
+	
+	if alignmentEngine == "samtools":
+		fr = "" if refGenome is None else " -f "+refGenome
+		if len(merged) == 1:
+			fr = fr+" -r "+chromGene+":"+str(merged[0][1]+1)+"-"+str(merged[0][2])
+		else: # region list
+			BED = open(outFile.replace(".tsv", ".bed"), "w")
+			for m in merged: BED.write("%s\t%s\t%s\n" %(m[0], m[1], m[2]))
+			BED.close()
+			fr = fr+" -l "+outFile.replace(".tsv", ".bed")
+		command = pathToSamtools+"samtools mpileup -B "+("-A " if anomalous else "")+"-Q "+baseq+fr+" "+bam+" > "+outFile
+		traceStart = time.perf_counter()
+		subprocess.call(command, shell=True)
+		metricsCount("samtools", 1)
+		if traceState["enabled"]: traceEvent("samtools mpileup", "samtools", traceStart, {"command": command})
+		PILEUP = open(outFile, "r")
+		for line in PILEUP: 
+			v = line.rstrip("\n").split("\t")[:5]
+			columns[int(v[1])] = v
+		PILEUP.close()
+		return(columns)
+	
+	# in-process pileup, bases formatted as in samtools mpileup
+	for pos, refBase, reads in pileupColumns(bam, chromGene, merged, baseq, refGenome, anomalous):
+		bases = "".join([("" if r[0] is None else "^"+chr(min(r[0], 93)+33))+r[1]+("" if r[2] == 0 else ("+" if r[2] > 0 else "")+str(r[2])+r[3])+("$" if r[4] else "") for r in reads])
+		columns[pos] = [chromGene, str(pos), refBase, str(len(reads)), bases if len(reads) > 0 else "*"]
+	
+	return(columns)
+
+def pileupColumns(bam, chromGene, merged, baseq, refGenome, anomalous):
+	# in-process pileup (as samtools mpileup -B [-A] -Q baseq [-f refGenome]) of merged [chrom, start, end] intervals, yielding (pos, ref, reads) for each covered position
+	# reads (those passing baseq) = [mapping quality if read starts here (else None), base as printed by mpileup (./,/A/a/*/>/<...), indel length (+ins/-del), indel bases, read ends here]
+	BAM = pysam.AlignmentFile(bam, "rb")
+	FASTA = None if refGenome is None else pysam.FastaFile(refGenome)
+	for chromI, refStart, end in merged:
+		ref = ""
+		if FASTA is not None: ref = FASTA.fetch(chromGene, refStart, end+10000) # +10000 to cover deletions starting at the end of the region
 		
-		w = i.rstrip("\n").split("\t")
+		for column in BAM.pileup(chromGene, refStart, end, truncate=True, stepper="samtools", ignore_overlaps=True, ignore_orphans=not anomalous, min_base_quality=0, compute_baq=False, max_depth=8000):
+			pos = column.reference_pos
+			refBase = ref[pos-refStart] if pos-refStart < len(ref) else "N"
+			reads = []
+			for p in column.pileups:
+				read = p.alignment
+				qpos = p.query_position_or_next
+				if qpos < read.query_length: qual = read.query_qualities[qpos] if read.query_qualities is not None else 255
+				else: qual = 0
+				if qual < int(baseq): continue
+				
+				rev = read.is_reverse
+				if p.is_refskip: b = "<" if rev else ">"
+				elif p.is_del: b = "*"
+				else:
+					b = read.query_sequence[qpos] if qpos < read.query_length else "N"
+					if b == "=" or ( ref != "" and b.upper() == refBase.upper() ): b = "," if rev else "."
+					else: b = b.lower() if rev else b.upper()
+				indelSeq = ""
+				if p.indel > 0:
+					indelSeq = read.query_sequence[qpos+1:qpos+1+p.indel]
+				elif p.indel < 0:
+					indelSeq = "".join([ref[pos-refStart+j] if ref != "" and pos-refStart+j < len(ref) else "N" for j in range(1, -p.indel+1)])
+				reads.append([read.mapping_quality if p.is_head else None, b, p.indel, indelSeq.lower() if rev else indelSeq.upper(), p.is_tail])
+			
+			yield(pos+1, refBase, reads)
+	if FASTA is not None: FASTA.close()
+	BAM.close()
+
+def pileupAlleles(bases, ref):
+	# count the alleles of a samtools mpileup base string: {allele: count} in order of first appearance, alleles being A/C/G/T, insertions (ie A[TT]) and deletions (ie A(TT))
+	# only digits (indel lengths and ^N mapping qualities) need the step by step scan: the plain stretches between them are counted with str.find/str.count
+	dna = {}
+	bases = bases.replace(",", ref).replace(".", ref) # we change reference nucleotide
+	bases = bases.upper() # convert all nucleotides to uppercase
+	g = 0
+	while g < len(bases):
+		d = pileupDigit.search(bases, g)
+		stretch = bases[g:d.start()] if d is not None else bases[g:]
+		for _, x in sorted((stretch.find(x), x) for x in ("A", "C", "G", "T") if x in stretch): # look for ACGT, new alleles in order of first appearance
+			dna[x] = dna.get(x, 0) + stretch.count(x)
+		if d is None: break
 		
-		if w[5] != "*" and w[6] == "=":
-			
-			sa = []
-			for x in (w[11:]): # analyse values after qualities, starting with SA...
-				if x.startswith("SA:Z"):
-					sa.append(x)
-			if len(sa) != 0: # takes values from position 0 to 9th and appends SA... in the 10th
-				w = w[:10]+[sa[0]]
+		g = d.start()
+		if bases[g+1].isdigit(): s = 2 # insertion/deletion of > 9 bases
+		else: s = 1 # insertion/deletion of < 10 bases
+		
+		prev = bases[g-1] # previous shows + for insertions or - for deletions
+		if prev in ("+", "-"):
+			now = int(bases[g:g+s]) # current number of nucleotides being added or removed
+			indel = bases[g-2]+("[" if prev == "+" else "(")+bases[g+s:g+s+now]+("]" if prev == "+" else ")") # nucleotides being added or removed
+			dna[indel] = dna.get(indel, 0) + 1
+			dna[bases[g-2]] -= 1
+			g += now + 1 # we jump as many positions as number shows (for > 9 bases the last nucleotide is read again as a base)
+		else: # workaround to exclude bases like ^6A (H/S/N in cigar)
+			g += 2
+	
+	return(dna)
+
+@functools.lru_cache(maxsize=None)
+def readAlleleEvents(head, base, indel, indelSeq, ref):
+	# allele count changes [(allele, +1/-1)] of one read at one position, in order: the same as counting its mpileup entry ("^"+head, base, indel, "$") with pileupAlleles
+	# (mapping quality characters are read as bases (or skip the base if a digit) and indels > 9 bases also count their last base, as in pileupAlleles)
+	head = head.replace(",", ref).replace(".", ref).upper()
+	base = base.replace(",", ref).replace(".", ref).upper()
+	events = []
+	if head in alleleIndex: events.append((head, 1))
+	if base in alleleIndex and not head.isdigit(): events.append((base, 1))
+	if indel != 0:
+		token = str(abs(indel))+indelSeq.upper()
+		s = 2 if token[1].isdigit() else 1
+		now = int(token[:s])
+		events.append((base+("[" if indel > 0 else "(")+token[s:s+now]+("]" if indel > 0 else ")"), 1))
+		events.append((base, -1))
+		for x in token[now+1:]:
+			if x in alleleIndex: events.append((x, 1))
+	return(events)
+
+def alleleCounts(bam, chromGene, regions, baseq, refGenome, anomalous, outFile, alignmentEngine, pathToSamtools):
+	# allele counts over all [start, end] regions (1-based) of chromGene, as NumPy arrays over the covered positions (rows): pos, ref and depth per row; 
+	# counts and first (order of first appearance in the pileup, to break ties) per row and A/C/G/T (see alleleIndex); and indels {row: [[allele, count, first], ...]}
+	columns = []
+	if alignmentEngine == "samtools":
+		for pos, column in sorted(pileupRegions(bam, chromGene, regions, baseq, refGenome, anomalous, outFile, alignmentEngine, pathToSamtools).items()):
+			columns.append([pos, column[2], int(column[3]), pileupAlleles(column[4], column[2])])
+	else:
+		merged = mergeIntervals([[chromGene, int(start)-1, int(end)] for start, end in regions])
+		for pos, refBase, reads in pileupColumns(bam, chromGene, merged, baseq, refGenome, anomalous):
+			dna = {}
+			for r in reads:
+				for allele, n in readAlleleEvents("" if r[0] is None else chr(min(r[0], 93)+33), r[1], r[2], r[3], refBase):
+					if allele in dna: dna[allele] += n
+					elif n > 0: dna[allele] = n
+			columns.append([pos, refBase, len(reads), dna])
+	
+	counts = {"pos": np.array([c[0] for c in columns], dtype=np.int64), "ref": [c[1] for c in columns], "depth": np.array([c[2] for c in columns], dtype=np.int64), 
+		"counts": np.zeros((len(columns), 4), dtype=np.int64), "first": np.full((len(columns), 4), np.iinfo(np.int64).max, dtype=np.int64), "indels": {}}
+	for row, c in enumerate(columns):
+		for first, (allele, n) in enumerate(c[3].items()):
+			if allele in alleleIndex:
+				counts["counts"][row, alleleIndex[allele]] = n
+				counts["first"][row, alleleIndex[allele]] = first
 			else:
-				w = w[:10]+["NA"]
-				
+				counts["indels"].setdefault(row, []).append([allele, n, first])
+	return(counts)
+
+def passingAlleles(counts, start, end, depth, altDepth, vafCutoff, tumorPurity):
+	# for each covered position between start and end: [pos, ref, alleles passing depth > depth, count > altDepth and VAF/tumorPurity > vafCutoff, sorted by count (ties by first appearance)]
+	lo = np.searchsorted(counts["pos"], int(start), "left")
+	hi = np.searchsorted(counts["pos"], int(end), "right")
+	dp = counts["depth"][lo:hi, None]
+	n = counts["counts"][lo:hi]
+	with np.errstate(divide="ignore", invalid="ignore"):
+		passing = (dp > depth) & (n > altDepth) & (n/dp/tumorPurity > vafCutoff) & (counts["first"][lo:hi] != np.iinfo(np.int64).max) # vectorized for A/C/G/T
+	
+	alleles = []
+	for row in range(lo, hi):
+		found = [[-counts["counts"][row, k], counts["first"][row, k], a] for a, k in alleleIndex.items() if passing[row-lo, k]]
+		for allele, c, first in counts["indels"].get(row, []):
+			if counts["depth"][row] > depth and c > altDepth and (c/counts["depth"][row]/tumorPurity) > vafCutoff: found.append([-c, first, allele])
+		alleles.append([int(counts["pos"][row]), counts["ref"][row], [x[2] for x in sorted(found)]])
+	return(alleles)
+
+@functools.lru_cache(maxsize=65536)
+def parseCigar(cigar):
+	# CIGAR string decoded once (read-length CIGARs repeat a lot): ops [(length, op)], lengths {op: total length}, aligned (M+D), clipped (S), queryAligned (M+I), 
+	# refSpan (M/D/N/=/X) and matchFirst (no soft clip, or the first M comes before the first S ie 100M50S, as opposed to 50S100M)
+	ops = [(int(n), op) for n, op in re.findall(r"([0-9]+)([A-Za-z=])", cigar)]
+	lengths = Counter()
+	for n, op in ops: lengths[op] += n
+	firstM = min([k for k, x in enumerate(ops) if x[1] == "M"] or [len(ops)])
+	firstS = min([k for k, x in enumerate(ops) if x[1] == "S"] or [len(ops)])
+	return({"ops": ops, "lengths": lengths, "aligned": lengths["M"]+lengths["D"], "clipped": lengths["S"], "queryAligned": lengths["M"]+lengths["I"], 
+		"refSpan": sum([lengths[op] for op in "MDN=X"]), "matchFirst": lengths["S"] == 0 or firstM < firstS})
+
+def parseSA(sa):
+	# first alignment of an SA tag ("SA:Z:chrom,pos,strand,CIGAR,mapQ,NM;...") as {chrom, pos, strand, cigar}, None if there is no SA tag ("NA", see alignmentRecords)
+	if not sa.startswith("SA:Z"): return(None)
+	fields = sa.split(":")[2].split(",")
+	return({"chrom": fields[0], "pos": int(fields[1]), "strand": fields[2], "cigar": fields[3]})
+
+
+def convertSamToAnnotatedTable(reads, chromGene, GENE):
+	
+	store = {}
+
+	for w in reads: # values from position 0 to 9th and SA... (or NA) in the 10th, see alignmentRecords
+		
+		if w[evidenceCigar] != "*" and w[evidenceMateChrom] == "=":
+			
+			w[evidenceFlag], w[evidencePos], w[evidenceMapq], w[evidenceMatePos], w[evidenceInsertSize] = int(w[evidenceFlag]), int(w[evidencePos]), int(w[evidenceMapq]), int(w[evidenceMatePos]), int(w[evidenceInsertSize]) # typed once for all the steps using the evidence table (flag, pos, mapq, pnext and insert size)
 			w.append("NA") # temporal NA to add later "split" or "insertSize" on 11th position
 			
 			
-			split1 = re.findall(r'[A-Za-z]|[0-9]+', w[5])
-			two1 = [split1[x:x+2] for x in range(0, len(split1),2)]
-			split2 = w[10].split(',') # split SA...
+			cigar1 = parseCigar(w[evidenceCigar])
+			sa = parseSA(w[evidenceSA])
 			
 		
-			if GENE != "CSR" and (w[10].startswith("SA:Z") or sum([int(i[0]) for i in two1 if "S" in i]) > 20): # split if SA or S > 20 in cigar
-				if abs(int(w[8])) > 10000:  w[11] = "split-insertSize"
-				else: w[11] = "split"
+			if GENE != "CSR" and (sa is not None or cigar1["clipped"] > 20): # split if SA or S > 20 in cigar
+				if abs(w[evidenceInsertSize]) > 10000:  w[evidenceType] = "split-insertSize"
+				else: w[evidenceType] = "split"
 				
-			elif abs(int(w[8])) > 10000:  # insertSize if insert size > 10000 [ J-V = 70000bp aprox ]
-				w[11] = "insertSize"
+			elif abs(w[evidenceInsertSize]) > 10000:  # insertSize if insert size > 10000 [ J-V = 70000bp aprox ]
+				w[evidenceType] = "insertSize"
 			
 			
-			if 	w[11] == "split" or w[11] == "split-insertSize": # add 2 columns
+			if 	w[evidenceType] == "split" or w[evidenceType] == "split-insertSize": # add 2 columns
 				
 				# 1st_pos
-				two1 = [split1[x:x+2] for x in range(0, len(split1),2)]
-				if len([count for count, item in enumerate(two1) if "S" in item]) == 0:
-					firstpos = sum([int(i[0]) for i in two1 if "M" in i or "D" in i]) - 1
-				elif min([count for count, item in enumerate(two1) if "M" in item]) < min([count for count, item in enumerate(two1) if "S" in item]):
-					firstpos = sum([int(i[0]) for i in two1 if "M" in i or "D" in i]) - 1
+				if cigar1["matchFirst"]: # no S or MS cigar
+					firstpos = cigar1["aligned"] - 1
 				else:
 					firstpos = 0
 				
 				# first PosSplit
-				a = int(w[3]) + firstpos  
+				a = w[evidencePos] + firstpos  
 				w.append(a)
 				
 				# second PosSplit
-				if w[10].startswith("SA:Z") and split2[0].split(':')[2] == chromGene:
+				if sa is not None and sa["chrom"] == chromGene:
 					
-					split3 = re.findall(r'[A-Za-z]|[0-9]+', split2[3])
-					two2 = [split3[x:x+2] for x in range(0, len(split3),2)]
+					cigar2 = parseCigar(sa["cigar"])
 					
 					# get if overlapping same base/s at each break point... we substract this overlapping bases on the first break below
-					diffMappingBases = sum([int(i[0]) for i in two2 if "M" in i or "D" in i]) - sum([int(i[0]) for i in two1 if "S" in i]) 
+					diffMappingBases = cigar2["aligned"] - cigar1["clipped"]
 					
-					if len([count for count, item in enumerate(two2) if "S" in item]) == 0: 
-						secpos = sum([int(i[0]) for i in two2 if "M" in i or "D" in i]) - 1 
-					elif min([count for count, item in enumerate(two2) if "M" in item]) < min([count for count, item in enumerate(two2) if "S" in item]):
-						secpos = sum([int(i[0]) for i in two2 if "M" in i or "D" in i]) - 1 
+					if cigar2["matchFirst"]: # no S or MS cigar
+						secpos = cigar2["aligned"] - 1 
 					else:
 						secpos = 0
 						
-					b = int(split2[1]) + secpos  # second PosSplit
+					b = sa["pos"] + secpos  # second PosSplit
 					w.append(b)
 					
 					# sort (smaller first)
@@ -156,12 +821,12 @@ def convertSamToAnnotatedTable(miniSamT, chromGene, GENE):
 					
 					if diffMappingBases > 0: 
 						
-						if int(flagToCustomBinary(w[1])[4]) == 0: strand = "+"
+						if not w[evidenceFlag] & flagReverse: strand = "+"
 						else: strand = "-"
-						strandSA = w[10].split(",")[2]
+						strandSA = sa["strand"]
 						
 						# reads <- <-  (Inversion1) => sum diffMappingBases at first read soft clipped position
-						if ( int(flagToCustomBinary(w[1])[4]) == 0 and strand == "-" and strandSA == "+" ) or ( int(flagToCustomBinary(w[1])[4]) == 1 and strand == "+" and strandSA == "-" ):
+						if ( not w[evidenceFlag] & flagReverse and strand == "-" and strandSA == "+" ) or ( w[evidenceFlag] & flagReverse and strand == "+" and strandSA == "-" ):
 							w[-2] = w[-2] + diffMappingBases
 						
 						else:  # reads -> <- or -> -> => substract diffMappingBases at first read soft clipped position
@@ -172,125 +837,152 @@ def convertSamToAnnotatedTable(miniSamT, chromGene, GENE):
 				else:
 					w.append("NA")
 				
-				if w[11] == "split": w.extend(["NA"]* 2) # no insertSize info
+				if w[evidenceType] == "split": w.extend(["NA"]* 2) # no insertSize info
 				
 
-			if w[11] == "insertSize" or w[11] == "split-insertSize": 
+			if w[evidenceType] == "insertSize" or w[evidenceType] == "split-insertSize": 
 				
-				if w[11] == "insertSize": w.extend(["NA"]* 2) # no split info
+				if w[evidenceType] == "insertSize": w.extend(["NA"]* 2) # no split info
 				
-				if int(flagToCustomBinary(w[1])[4]) == 0: # positive strand 
-					two = [split1[x:x+2] for x in range(0, len(split1),2)]
-					converted = sum([int(i[0]) for i in two if  "I" not in i and "S" not in i]) - 1 
-					d = int(w[3]) + converted
+				if not w[evidenceFlag] & flagReverse: # positive strand 
+					converted = sum(cigar1["lengths"].values()) - cigar1["lengths"]["I"] - cigar1["lengths"]["S"] - 1 
+					d = w[evidencePos] + converted
 				else: # negative strand  
-					d = int(w[3]) 
+					d = w[evidencePos] 
 				
-				if 	int(flagToCustomBinary(w[1])[6]) == 1 and int(flagToCustomBinary(w[1])[4]) == 0 and int(w[8]) > 0: # first in pair and positive strand and insertSize > 0 (97 -> del) (65 -> inv)
+				if 	w[evidenceFlag] & flagFirstInPair and not w[evidenceFlag] & flagReverse and w[evidenceInsertSize] > 0: # first in pair and positive strand and insertSize > 0 (97 -> del) (65 -> inv)
 					w.append(d)
 					w.append("NA")
-				elif int(flagToCustomBinary(w[1])[6]) == 0 and int(flagToCustomBinary(w[1])[4]) == 1 and int(w[8]) < 0: # second in pair and negative strand and insertSize < 0 (145 <- del) (177 <- inv)
+				elif not w[evidenceFlag] & flagFirstInPair and w[evidenceFlag] & flagReverse and w[evidenceInsertSize] < 0: # second in pair and negative strand and insertSize < 0 (145 <- del) (177 <- inv)
 					w.append("NA")
 					w.append(d)
-				elif int(flagToCustomBinary(w[1])[6]) == 1 and int(flagToCustomBinary(w[1])[4]) == 1 and int(w[8]) < 0: # first in pair and negative strand and insertSize < 0 (81 <- del)
+				elif w[evidenceFlag] & flagFirstInPair and w[evidenceFlag] & flagReverse and w[evidenceInsertSize] < 0: # first in pair and negative strand and insertSize < 0 (81 <- del)
 					w.append("NA")
 					w.append(d)
-				elif int(flagToCustomBinary(w[1])[6]) == 0 and int(flagToCustomBinary(w[1])[4]) == 0 and int(w[8]) > 0: # second in pair and positive strand and insertSize > 0 (161 -> del)
+				elif not w[evidenceFlag] & flagFirstInPair and not w[evidenceFlag] & flagReverse and w[evidenceInsertSize] > 0: # second in pair and positive strand and insertSize > 0 (161 -> del)
 					w.append(d)
 					w.append("NA")
-				elif int(flagToCustomBinary(w[1])[6]) == 0 and int(flagToCustomBinary(w[1])[4]) == 0 and int(w[8]) < 0: # second in pair and positive strand and insertSize < 0 (129 -> inv)
+				elif not w[evidenceFlag] & flagFirstInPair and not w[evidenceFlag] & flagReverse and w[evidenceInsertSize] < 0: # second in pair and positive strand and insertSize < 0 (129 -> inv)
 					w.append("NA")
 					w.append(d)
-				elif int(flagToCustomBinary(w[1])[6]) == 1 and int(flagToCustomBinary(w[1])[4]) == 1 and int(w[8]) > 0: # first in pair and negative strand and insertSize > 0 (113 <- inv)
+				elif w[evidenceFlag] & flagFirstInPair and w[evidenceFlag] & flagReverse and w[evidenceInsertSize] > 0: # first in pair and negative strand and insertSize > 0 (113 <- inv)
 					w.append(d)
 					w.append("NA")
 				else:
 					w.append("NA")
 					w.append("NA")
-					if w[11] == "insertSize": w[11] = "NA" # if no deletion or inversions considered above, remove info if no split				
+					if w[evidenceType] == "insertSize": w[evidenceType] = "NA" # if no deletion or inversions considered above, remove info if no split				
 			
-			if w[11] == "NA":
+			if w[evidenceType] == "NA":
 				w.extend(["NA"]* 4) # if it is neither insertSize nor split we add the five empty columns for it
 			
 			
 			# dict store:
-			if w[0] not in store: # w[0] is read name
-				if w[11] == "split" or w[11] == "insertSize" or w[11] == "split-insertSize":
-					store[w[0]] = w
+			if w[evidenceName] not in store: # by read name
+				if w[evidenceType] == "split" or w[evidenceType] == "insertSize" or w[evidenceType] == "split-insertSize":
+					store[w[evidenceName]] = w
 			
 			else:
-				if w[11] == "split" or w[11] == "split-insertSize":
-					if store[w[0]][11] == "insertSize":
-						if store[w[0]][14] != "NA":
-							w[14] = store[w[0]][14] 
+				if w[evidenceType] == "split" or w[evidenceType] == "split-insertSize":
+					if store[w[evidenceName]][evidenceType] == "insertSize":
+						if store[w[evidenceName]][evidenceInsert1] != "NA":
+							w[evidenceInsert1] = store[w[evidenceName]][evidenceInsert1] 
 						else:
-							w[15] = store[w[0]][15]
+							w[evidenceInsert2] = store[w[evidenceName]][evidenceInsert2]
 						
-						store[w[0]] = w
+						store[w[evidenceName]] = w
 				
-				if (w[11] == "insertSize" and store[w[0]][11] == "insertSize") or (w[11] == "insertSize" and store[w[0]][11] == "split-insertSize"): # or (w[11] == "split-insertSize" and store[w[0]][11] == "split-insertSize"): no pot ser mai split-insertSize and split-insertSize
-					if w[14] != "NA":
-						store[w[0]][14] = w[14]
+				if (w[evidenceType] == "insertSize" and store[w[evidenceName]][evidenceType] == "insertSize") or (w[evidenceType] == "insertSize" and store[w[evidenceName]][evidenceType] == "split-insertSize"): # or (w[evidenceType] == "split-insertSize" and store[w[evidenceName]][evidenceType] == "split-insertSize"): no pot ser mai split-insertSize and split-insertSize
+					if w[evidenceInsert1] != "NA":
+						store[w[evidenceName]][evidenceInsert1] = w[evidenceInsert1]
 					else:
-						store[w[0]][15] = w[15]
+						store[w[evidenceName]][evidenceInsert2] = w[evidenceInsert2]
 	
 	return(store)
 	
-def findJandVgenes(annot_table, bedFile, GENE):
-	insertsplit = open(annot_table, "r")
+def writeEvidenceTable(annot_table, tsv):
+	# debug dump of an evidence table (-det yes)
+	TSV = open(tsv, "w")
+	for w in annot_table: TSV.write("%s\n" %"\t".join([str(x) for x in w]))
+	TSV.close()
+
+def geneBedIndex(bedFile, GENE):
+	# V/J/CSR BED file read once: intervals sorted by start with the orientation windows of each gene applied (for bisect, see bedGeneAt) and {gene: [start, end]} (first line of each gene)
+	bedIndex = {"starts": [], "intervals": [], "maxWidth": 0, "genes": {}}
+	VDJ = open(bedFile, "r")
+	for order, k in enumerate(VDJ):
+		v = k.rstrip("\n").split("\t")
+		if GENE == "IGH": # orientation J - V
+			if v[3].startswith("IGHJ"):
+				window1 = 0
+				window2 = 10
+			else:
+				window1 = 10
+				window2 = 0
+		elif GENE == "IGK": # orientation J - V
+			if v[3].startswith("IGKJ"):
+				window1 = 0
+				window2 = 10
+			else:
+				window1 = 10
+				window2 = 5 # 5bp added for inversions just after V
+		elif GENE == "IGL": # orientation V - J
+			if v[3].startswith("IGLJ"):
+				window1 = 10
+				window2 = 0
+			else:
+				window1 = 0
+				window2 = 10
+		else: # class switch
+			window1 = 0
+			window2 = 0
+		
+		bedIndex["intervals"].append([int(v[1])-window1, int(v[2])+window2, order, v[3]])
+		bedIndex["maxWidth"] = max(bedIndex["maxWidth"], bedIndex["intervals"][-1][1]-bedIndex["intervals"][-1][0])
+		if v[3] not in bedIndex["genes"]: bedIndex["genes"][v[3]] = [v[1], v[2]]
+	VDJ.close()
+	
+	bedIndex["intervals"].sort()
+	bedIndex["starts"] = [x[0] for x in bedIndex["intervals"]]
+	return(bedIndex)
+
+def bedGeneAt(bedIndex, pos):
+	# V or J (or switch region) including the position, considering the defined windows: the first one in the BED file if several, "NA" if none
+	found = None
+	idx = bisect.bisect_right(bedIndex["starts"], pos) # intervals starting after pos can not include it
+	while idx > 0 and bedIndex["starts"][idx-1] >= pos-bedIndex["maxWidth"]: # nor those starting more than the widest interval before it
+		idx -= 1
+		start, end, order, gene = bedIndex["intervals"][idx]
+		if end >= pos and (found is None or order < found[0]): found = [order, gene]
+	return("NA" if found is None else found[1])
+
+def findJandVgenes(annot_table, bedIndex, GENE):
+	# annot_table: evidence rows of convertSamToAnnotatedTable, extended in place with the J/V gene of each position and the rearrangement type
+	# we check in which V or J is each split/insert size position included, once per position
+	genesAt = {}
+	for w in annot_table:
+		for j in range(evidenceSplit1, evidenceInsert2+1):
+			if w[j] != "NA" and w[j] not in genesAt: genesAt[w[j]] = bedGeneAt(bedIndex, w[j])
 	
 	JV_list = []
 
-	for i in insertsplit:
-		w = i.rstrip("\n").split("\t")
+	for w in annot_table:
 		w.extend(["NA"]* 4) # we add 4 new columns where we will add new information
-		for j in range(12,16):
-			if w[j] != "NA": 
-				VDJ = open(bedFile, "r") # bed file for V/J genes
-				for k in VDJ:
-					v = k.rstrip("\n").split("\t")
-					if GENE == "IGH": # orientation J - V
-						if v[3].startswith("IGHJ"):
-							window1 = 0
-							window2 = 10
-						else:
-							window1 = 10
-							window2 = 0
-					elif GENE == "IGK": # orientation J - V
-						if v[3].startswith("IGKJ"):
-							window1 = 0
-							window2 = 10
-						else:
-							window1 = 10
-							window2 = 5 # 5bp added for inversions just after V
-					elif GENE == "IGL": # orientation V - J
-						if v[3].startswith("IGLJ"):
-							window1 = 10
-							window2 = 0
-						else:
-							window1 = 0
-							window2 = 10
-					else: # class switch
-						window1 = 0
-						window2 = 0
-					
-					if int(w[j]) >= int(v[1])-window1 and int(w[j]) <= int(v[2])+window2: # we check in which V or J is the position included, considering the defined windows
-						w[j+4] = v[3] # we append the corresponding V or J, 4 positions to the right to our table
-						break
-				VDJ.close()	
+		for j in range(evidenceSplit1, evidenceInsert2+1):
+			if w[j] != "NA": w[j+evidenceSplitGene1-evidenceSplit1] = genesAt[w[j]] # we append the corresponding V or J, 4 positions to the right to our table
 
 		# We classify reads according to their orientation (flags) and insert size:
-		if w[11] == "insertSize" or w[11] == "split-insertSize":
+		if w[evidenceType] == "insertSize" or w[evidenceType] == "split-insertSize":
 			
 			# reads: -> <-
-			if int(w[1]) in [97, 161] and int(w[8]) > 0: w.append("Deletion")
-			elif int(w[1]) in [145, 81] and int(w[8]) < 0: w.append("Deletion")
+			if w[evidenceFlag] in [97, 161] and w[evidenceInsertSize] > 0: w.append("Deletion")
+			elif w[evidenceFlag] in [145, 81] and w[evidenceInsertSize] < 0: w.append("Deletion")
 			
 			# reads -> ->
-			elif int(w[1]) == 65 or int(w[1]) == 129: w.append("Inversion2")
+			elif w[evidenceFlag] == 65 or w[evidenceFlag] == 129: w.append("Inversion2")
 		
 			# reads <- <-
-			elif int(w[1]) == 113 or int(w[1]) == 177: w.append("Inversion1")
+			elif w[evidenceFlag] == 113 or w[evidenceFlag] == 177: w.append("Inversion1")
 			
 			# other potential SV not considered:
 			else: w.append("NA")
@@ -298,218 +990,150 @@ def findJandVgenes(annot_table, bedFile, GENE):
 		
 		else:
 			# no information of soft clipped map:
-			if w[10] == "NA": w.append("NotComplete") 
+			if w[evidenceSA] == "NA": w.append("NotComplete") 
 			
 			else: # split			
 				# get strands
-				if int(flagToCustomBinary(w[1])[4]) == 0: strand = "+"
+				if not w[evidenceFlag] & flagReverse: strand = "+"
 				else: strand = "-"
-				strandSA = w[10].split(",")[2]
+				strandSA = parseSA(w[evidenceSA])["strand"]
 				
 				# reads: -> <-
-				if strand == "+" and strandSA == "+" and int(w[8]) > 0: w.append("Deletion")
-				elif strand == "-" and strandSA == "-" and int(w[8]) < 0: w.append("Deletion")
+				if strand == "+" and strandSA == "+" and w[evidenceInsertSize] > 0: w.append("Deletion")
+				elif strand == "-" and strandSA == "-" and w[evidenceInsertSize] < 0: w.append("Deletion")
 				
 				# reads -> ->
-				elif int(flagToCustomBinary(w[1])[4]) == 0 and strand == "+" and strandSA == "-": w.append("Inversion2")
-				elif int(flagToCustomBinary(w[1])[4]) == 1 and strand == "-" and strandSA == "+": w.append("Inversion2")
+				elif not w[evidenceFlag] & flagReverse and strand == "+" and strandSA == "-": w.append("Inversion2")
+				elif w[evidenceFlag] & flagReverse and strand == "-" and strandSA == "+": w.append("Inversion2")
 				
 				# reads <- <-
-				elif int(flagToCustomBinary(w[1])[4]) == 0 and strand == "-" and strandSA == "+": w.append("Inversion1")
-				elif int(flagToCustomBinary(w[1])[4]) == 1 and strand == "+" and strandSA == "-": w.append("Inversion1")
+				elif not w[evidenceFlag] & flagReverse and strand == "-" and strandSA == "+": w.append("Inversion1")
+				elif w[evidenceFlag] & flagReverse and strand == "+" and strandSA == "-": w.append("Inversion1")
 				
 				# other potential SV not considered:
 				else: w.append("NA")
 		
 		
-		if len(set(w[-5:-1])) > 1 and w[-1] != "NA": # not NA only and DELETION/INVERSION specification
-			JV_list.append("%s\n" %"\t".join([str(x) for x in w]))
-
-
-	insertsplit.close() # we have a table with ID (1 column), insertsize or split positions (4 columns), corresponding VDJ genes (4 columns)
+		if len(set(w[evidenceSplitGene1:evidenceSV])) > 1 and w[evidenceSV] != "NA": # not NA only and DELETION/INVERSION specification
+			JV_list.append(w)
 	
-	return(JV_list)
+	return(JV_list) # we have a table with ID (1 column), insertsize or split positions (4 columns), corresponding VDJ genes (4 columns)
 
 def findCombinationsJandV(annot_table_JV, GENE):
-	ANNOT_TABLE_JV = open(annot_table_JV, "r") # we use previous output file as input file
-
 	l = list()
-	for i in ANNOT_TABLE_JV:
-		w=i.rstrip("\n").split("\t")
+	inL = set() # pairs already in l
+	for w in annot_table_JV: # we use previous evidence table
 		
 		r = []
 		s = []
 		
-		for j in w[-5:-1]: # we take the four columns corresponding to V and J types for each insertSize and split positions
+		for j in w[evidenceSplitGene1:evidenceSV]: # we take the four columns corresponding to V and J types for each insertSize and split positions
 			if j != "NA": # if there exists information
 				if j[3] not in r:
 					r.append(j[3]) # we save letters corresponding to V and J ex: IGHV1-3 -> V, IGHJ2P -> J
-					s.append([j, w[-5:-1].index(j)]) # we create sublists with V and J variants and the column number they belong
+					s.append([j, w[evidenceSplitGene1:evidenceSV].index(j)]) # we create sublists with V and J variants and the column number they belong
 				else: # if list already contains the letter we are analysing (ex: s = [[V, 1],[J, 2]] and we are analysing V),
 					  # we eliminate all information, as V can only match J and viceversa
 					r = []
 					s = []
 			
-			if w[-5:-1].index(j) == 1 or w[-5:-1].index(j) == 3: # second split or second insertSize
+			if w[evidenceSplitGene1:evidenceSV].index(j) == 1 or w[evidenceSplitGene1:evidenceSV].index(j) == 3: # second split or second insertSize
 				if len(s) == 2: # if we find any type VJ, JV
 					
 					if GENE != "CSR":
-						if [s[0][0]+" - "+s[1][0], w[-1]] not in l: # if not in list of pairs, add..
-							l.append([s[0][0]+" - "+s[1][0], w[-1]])
+						if (s[0][0]+" - "+s[1][0], w[evidenceSV]) not in inL: # if not in list of pairs, add..
+							l.append([s[0][0]+" - "+s[1][0], w[evidenceSV]])
+							inL.add((s[0][0]+" - "+s[1][0], w[evidenceSV]))
 					else:
-						if "M" in r and [s[0][0]+" - "+s[1][0], w[-1]] not in l: # if it is class switch it must contain M
-							l.append([s[0][0]+" - "+s[1][0], w[-1]])
+						if "M" in r and (s[0][0]+" - "+s[1][0], w[evidenceSV]) not in inL: # if it is class switch it must contain M
+							l.append([s[0][0]+" - "+s[1][0], w[evidenceSV]])
+							inL.add((s[0][0]+" - "+s[1][0], w[evidenceSV]))
 				s = []
 				r = []
 	
-	ANNOT_TABLE_JV.close()
-	
 	return(l)
 
-def assignPositionsToJandV(l, annot_table_JV):
+def indexEvidenceTable(annot_table_JV):
+	# one pass over the J/V evidence rows (see findJandVgenes), for the lookups of steps 6, 9 and 12 (lists keep the order of the rows):
+	# pairs: {(J - V genes, read type): [[J - V positions, "split"/"insertSize", read type], ...]}; splitBreaks: {(1st, 2nd split position (0 if NA)): [split rows]};
+	# insertPairs: {(1st, 2nd insertSize gene): [rows]}; splitGenes: {gene at the 1st split position: [[position, read type], ...]}; genes: {gene: [[column, position, read type], ...]}
+	evidenceIndex = {"rows": annot_table_JV, "pairs": {}, "splitBreaks": {}, "insertPairs": {}, "splitGenes": {}, "genes": {}}
+	for row, w in enumerate(annot_table_JV):
+		for idx in [evidenceSplit1, evidenceInsert1]:
+			if w[idx] == "NA" or w[idx+1] == "NA": continue
+			evidenceIndex["pairs"].setdefault((w[idx+evidenceSplitGene1-evidenceSplit1]+" - "+w[idx+evidenceSplitGene2-evidenceSplit1], w[evidenceSV]), []).append([str(w[idx])+" - "+str(w[idx+1]), "split" if idx == evidenceSplit1 else "insertSize", w[evidenceSV]])
+		
+		if w[evidenceType].startswith("split"):
+			evidenceIndex["splitBreaks"].setdefault((0 if w[evidenceSplit1] == "NA" else w[evidenceSplit1], 0 if w[evidenceSplit2] == "NA" else w[evidenceSplit2]), []).append(row)
+			evidenceIndex["splitGenes"].setdefault(w[evidenceSplitGene1], []).append([str(w[evidenceSplit1]), w[evidenceSV]])
+		evidenceIndex["insertPairs"].setdefault((w[evidenceInsertGene1], w[evidenceInsertGene2]), []).append(row)
+		for c in [evidenceSplitGene1, evidenceInsertGene1, evidenceInsertGene2]:
+			if w[c] != "NA": evidenceIndex["genes"].setdefault(w[c], []).append([c, str(w[c-evidenceSplitGene1+evidenceSplit1]), w[evidenceSV]])
+	
+	return(evidenceIndex)
+
+def uniquePositions(positions, svClassInsert):
+	# positions [[position, read type], ...] with the same read orientation (or NotComplete), once and in order
+	unique = []
+	seen = set()
+	for x in positions:
+		if (x[1] == "NotComplete" or x[1] == svClassInsert) and x[0] not in seen:
+			unique.append(x[0])
+			seen.add(x[0])
+	return(unique)
+
+def assignPositionsToJandV(l, evidenceIndex):
 	
 	VJ_positions = {} # we store pairs J-V positions and if they come from split/insertsize or both in some cases
 	data = {} # we store count of pairs and individuals J/V by positions (from split) and by gene names (by insertSize) 
 	pos = {}
 	
-	for k12 in l: # iterates over every sublist of pairs in list
-		
-		ANNOT_TABLE_JV = open(annot_table_JV, "r")
-		for j in ANNOT_TABLE_JV:
-			w=j.rstrip("\n").split("\t")
-			
-			for idx in [12, 14]:
-				a = idx # first pos split/insert
-				b = idx+1 # second pos split/insert
-				
-				if w[a] == "NA" or w[b] == "NA": continue
-				
-				srt = w[a+4]+" - "+w[b+4]
-				srtPos = w[a]+" - "+w[b]
-				readtype = w[20]
-				
-				if srt == k12[0] and readtype == k12[1]: # k12[0] = each pair, k12[1] = Deletion, Inversion1, Inversion2
-					if srt not in VJ_positions:
-						VJ_positions[k12[0]] = [[srtPos, "split" if idx == 12 else "insertSize", readtype]] 
-					else:
-						VJ_positions[k12[0]].append([srtPos, "split" if idx == 12 else "insertSize", readtype])
-					
-					if idx == 12:
-						if srtPos+" - "+k12[1] not in data:
-							data[srtPos+" - "+readtype] = 1
-						else:
-							data[srtPos+" - "+readtype] += 1
-							
-					else:
-						if srt+" - "+readtype not in data:
-							data[srt+" - "+readtype] = 1
-						else:
-							data[srt+" - "+readtype] += 1
+	for k12 in l: # iterates over every sublist of pairs in list (k12[0] = each pair, k12[1] = Deletion, Inversion1, Inversion2)
+		for m in evidenceIndex["pairs"].get((k12[0], k12[1]), []):
+			VJ_positions.setdefault(k12[0], []).append(m)
+			if m[1] == "split": 
+				data[m[0]+" - "+m[2]] = data.get(m[0]+" - "+m[2], 0) + 1
+			else:
+				data[k12[0]+" - "+m[2]] = data.get(k12[0]+" - "+m[2], 0) + 1
+	
+	
+	for key in VJ_positions: # dictionary of IGH from V and J position of start and end (specific for each rearrangement)
+		keyJ = key.split(" - ")[0]
+		keyV = key.split(" - ")[1]
+		spl = [] # save split position
 		
-		ANNOT_TABLE_JV.close()
+		for m in VJ_positions[key]:
+			if m[1] == "split":
+				spl.append((m[0], m[2])) # if info comes from split we save it
 		
+		# info from paired-split
+		if len(spl) != 0:
+			pos[key] = [list(x) for x in dict.fromkeys(spl)] # unique, in order
 		
-		for key in VJ_positions: # dictionary of IGH from V and J position of start and end (specific for each rearrangement)
-			spl = [] # save split position
-			ins = [] # save insertSize position
+		# info from single-split (make all possible combinations)
+		else: 
+			Jpos = evidenceIndex["splitGenes"].get(keyJ, []) # all possible J positions comming individual splits
+			Vpos = evidenceIndex["splitGenes"].get(keyV, []) if keyV != keyJ else [] # all possible V positions comming from individual splits
 			
-			for m in VJ_positions[key]:
-				if m[1] == "split":
-					spl.append([m[0], m[2]]) # if info comes from split we save it on one list
-				else:
-					ins.append([m[0], m[2]]) # if info comes from insertSize we save it on another list
+			svClassInsert = [evidenceIndex["rows"][row][evidenceSV] for row in evidenceIndex["insertPairs"].get((keyJ, keyV), [])] # key by insertSize reads to get SV class
+			svClassInsert = Counter(svClassInsert).most_common(1)[0][0] # Simplify to most common sv class
 			
-			# info from paired-split
-			if len(spl) != 0:
-				UNIQUEspl = []
-				for s in spl:
-					if s not in UNIQUEspl:
-						UNIQUEspl.append(s) 
-				pos[key] = UNIQUEspl
+			JV = [[x+" - "+y, svClassInsert] for x in uniquePositions(Jpos, svClassInsert) for y in uniquePositions(Vpos, svClassInsert)] # we create all possible combinations if they have equal read orientation
 			
-			# info from single-split (make all possible combinations)
-			else: 
-				ANNOT_TABLE_JV = open(annot_table_JV, "r")
-				Jpos = []
-				Vpos = []
+			pos[key] = JV
+			
+			# info still no info, get info from paired-insertSize, unpaired insertSize and unpaired split
+			if pos[key] == []:
+				Jpos = [[x[1], x[2]] for x in evidenceIndex["genes"].get(keyJ, []) if x[0] != evidenceInsertGene2]
+				Vpos = [[x[1], x[2]] for x in evidenceIndex["genes"].get(keyV, []) if keyV != keyJ or x[0] == evidenceInsertGene2]
 				
-				svClassInsert = [] # to get sv class from inserSize pairs
-				for j in ANNOT_TABLE_JV:
-					w=j.rstrip("\n").split("\t")
-					if w[11].startswith("split") and key.split(" - ")[0] == w[16]:
-						Jpos.append([w[12], w[20]]) # save all possible J positions comming individual splits
-					elif w[11].startswith("split") and key.split(" - ")[1] == w[16]:
-						Vpos.append([w[12], w[20]]) # save all possible V positions comming from individual splits
-					
-					if w[18] == key.split(" - ")[0] and w[19] == key.split(" - ")[1]: # key by insertSize reads to get SV class
-						svClassInsert.append(w[20])
-						
-				ANNOT_TABLE_JV.close()
+				JV = [[x+" - "+y, svClassInsert] for x in uniquePositions(Jpos, svClassInsert) for y in uniquePositions(Vpos, svClassInsert)] # we create all possible combinations if they have equal read orientation
 				
-				svClassInsert = Counter(svClassInsert).most_common(1)[0][0] # Simplify to most common sv class
-
-				UNIQUEjpos = []
-				for x in Jpos:
-					if x[1] == "NotComplete" or x[1] == svClassInsert:
-						if x[0] not in UNIQUEjpos:
-							UNIQUEjpos.append(x[0])
-
-				UNIQUEvpos = []
-				for y in Vpos:
-					if y[1] == "NotComplete" or y[1] == svClassInsert:
-						if y[0] not in UNIQUEvpos:
-							UNIQUEvpos.append(y[0])
-
-				JV = [[x+" - "+y, svClassInsert] for x in UNIQUEjpos for y in UNIQUEvpos] # we create all possible combinations if they have equal read orientation
-
 				pos[key] = JV
-				
-				# info still no info, get info from paired-insertSize, unpaired insertSize and unpaired split
-				if pos[key] == []:
-					ANNOT_TABLE_JV = open(annot_table_JV, "r")
-					Jpos = []
-					Vpos = []
-				
-					svClassInsert = [] # to get sv class from inserSize pairs
-					for j in ANNOT_TABLE_JV:
-						w=j.rstrip("\n").split("\t")
-						if key.split(" - ")[0] == w[16]:
-							Jpos.append([w[12], w[20]]) 
-						elif key.split(" - ")[1] == w[16]:
-							Vpos.append([w[12], w[20]]) 
-						if key.split(" - ")[0] == w[18]:
-							Jpos.append([w[14], w[20]]) 
-						elif key.split(" - ")[1] == w[18]:
-							Vpos.append([w[14], w[20]]) 
-						if key.split(" - ")[1] == w[19]:
-							Vpos.append([w[15], w[20]]) 
-					
-						if w[18] == key.split(" - ")[0] and w[19] == key.split(" - ")[1]: # key by insertSize reads to get SV class
-							svClassInsert.append(w[20])
-						
-					ANNOT_TABLE_JV.close()
-					
-					svClassInsert = Counter(svClassInsert).most_common(1)[0][0] # Simplify to most common sv class
-
-					UNIQUEjpos = []
-					for x in Jpos:
-						if x[1] == "NotComplete" or x[1] == svClassInsert:
-							if x[0] not in UNIQUEjpos:
-								UNIQUEjpos.append(x[0])
-
-					UNIQUEvpos = []
-					for y in Vpos:
-						if y[1] == "NotComplete" or y[1] == svClassInsert:
-							if y[0] not in UNIQUEvpos:
-								UNIQUEvpos.append(y[0])
-					
-					JV = [[x+" - "+y, svClassInsert] for x in UNIQUEjpos for y in UNIQUEvpos] # we create all possible combinations if they have equal read orientation
-					
-					pos[key] = JV
 	
 	return(VJ_positions, data, pos)
 
-def addPositionsAndOccurrences(pos, bedFile, data):
+def addPositionsAndOccurrences(pos, bedIndex, data):
 	information = [] # list of sublists with pairs and information about them
 	
 	for key in pos:
@@ -533,21 +1157,12 @@ def addPositionsAndOccurrences(pos, bedFile, data):
 			
 			# find position in bed file (J)   
 			c = "NA" 
-			VDJ = open(bedFile, "r")
-			for k in VDJ:
-				v = k.rstrip("\n").split("\t")
-				if keyJ == v[3]:
-					if pos[key][i][1] == "Deletion":
-						c = v[1]
-						break
-					elif pos[key][i][1] == "Inversion1":
-						c = v[2]
-						break
-					elif pos[key][i][1] == "Inversion2":
-						c = v[1]
-						break
+			if keyJ in bedIndex["genes"]:
+				v = bedIndex["genes"][keyJ]
+				if pos[key][i][1] == "Deletion": c = v[0]
+				elif pos[key][i][1] == "Inversion1": c = v[1]
+				elif pos[key][i][1] == "Inversion2": c = v[0]
 			row.extend(sorted([int(c), keyPosJ]))
-			VDJ.close()	
 			if row[-1] - row[-2] < 5: continue	
 			
 			# add 0 for split reads in J used in section 8
@@ -556,21 +1171,11 @@ def addPositionsAndOccurrences(pos, bedFile, data):
 			
 			# find position in bed file (V) 
 			h = "NA" 
-			VDJ = open(bedFile, "r")
-			for k in VDJ:
-				v = k.rstrip("\n").split("\t")
-				if keyV == v[3]:
-					if pos[key][i][1] == "Deletion":
-						h = v[2] 
-						break
-					elif pos[key][i][1] == "Inversion1":
-						h = v[2] 
-						break
-					elif pos[key][i][1] == "Inversion2":
-						h = v[1]
-						break
-
-			VDJ.close()		
+			if keyV in bedIndex["genes"]:
+				v = bedIndex["genes"][keyV]
+				if pos[key][i][1] == "Deletion": h = v[1]
+				elif pos[key][i][1] == "Inversion1": h = v[1]
+				elif pos[key][i][1] == "Inversion2": h = v[0]
 			row.extend(sorted([int(h), keyPosV]))
 			if row[-1] - row[-2] < 10: continue
 			
@@ -581,7 +1186,7 @@ def addPositionsAndOccurrences(pos, bedFile, data):
 			
 	return(information)
 
-def getJandVsequences(information, GENE, refGenome, baseq, chromGene, bamN, miniBamT, miniBamN, depth, altDepth, tumorPurity, vafCutoff, vafCutoffNormal, pathToSamtools):
+def getJandVsequences(information, GENE, refGenome, baseq, chromGene, bamN, miniBamT, miniBamN, depth, altDepth, tumorPurity, vafCutoff, vafCutoffNormal, pathToSamtools, alignmentEngine):
 	
 	if GENE == "IGL": # if IGL, switch V <-> J info
 		for i in information:
@@ -593,7 +1198,18 @@ def getJandVsequences(information, GENE, refGenome, baseq, chromGene, bamN, mini
 			i[7] = i4
 			i[8] = i5
 	
+	# allele counts of all J and V intervals of the locus at once (tumor and normal at the same time), sliced per interval below
+	regions = []
+	for i in information:
+		for z in [-6, -3]:
+			if "Kde" not in i[0] and "RSS" not in i[0] and i[z] != "NA" and i[z+1] != "NA": regions.append([i[z], i[z+1]])
+	calls = [[checkpoint, "alleleCounts_"+GENE+"_T", [bamKey(miniBamT), chromGene, regions, baseq, fileIdentity(refGenome), True], alleleCounts, miniBamT, chromGene, regions, baseq, refGenome, True, miniBamT.replace(".bam", "_output_mpileup.tsv"), alignmentEngine, pathToSamtools]] # allow -A (anomalous read pairs) in tumor sample only
+	if bamN is not None: calls.append([checkpoint, "alleleCounts_"+GENE+"_N", [bamKey(miniBamN), chromGene, regions, baseq, fileIdentity(refGenome), False], alleleCounts, miniBamN, chromGene, regions, baseq, refGenome, False, miniBamN.replace(".bam", "_output_mpileup.tsv"), alignmentEngine, pathToSamtools])
+	counts = runConcurrently(calls)
+	
+	tracing = traceState["enabled"]
 	for i in information:
+		if tracing: traceStart = time.perf_counter() # -trace yes: one span per candidate
 		temporary = []
 		z = -6 # to iterate over positions for V,J
 		while z < 0:
@@ -603,94 +1219,33 @@ def getJandVsequences(information, GENE, refGenome, baseq, chromGene, bamN, mini
 				
 			elif i[z] != "NA" and i[z+1] != "NA":
 				
-				if refGenome is None:
-					fr = " -r "
-				else:
-					fr = " -f "+refGenome+" -r "
-				
-				subprocess.call(pathToSamtools+"samtools mpileup -B -A -Q "+baseq+fr+chromGene+":"+str(i[z])+"-"+str(i[z+1])+" "+miniBamT+ " > "+miniBamT.replace(".bam", "_output_mpileup.tsv"), shell=True) # allow -A (anomalous read pairs) in tumor sample only
+				pileupT = passingAlleles(counts[0], i[z], i[z+1], depth, altDepth, vafCutoff, tumorPurity) # [pos, ref, alleles] (min coverage > depth [default = 1], mut count > altDepth [default = 1] min VAF corrected by tumorPurity (if available) > vafCutoff [default = 0.10])
 				
-				if os.stat(miniBamT.replace(".bam", "_output_mpileup.tsv")).st_size != 0:
+				if len(pileupT) != 0:
 					
 					# Normal seq:
 					if bamN is not None:
-						subprocess.call(pathToSamtools+"samtools mpileup -B -Q "+baseq+fr+chromGene+":"+str(i[z])+"-"+str(i[z+1])+" "+miniBamN+ " > "+miniBamN.replace(".bam", "_output_mpileup.tsv"), shell=True)
+						pileupN = passingAlleles(counts[1], i[z], i[z+1], depth, altDepth, vafCutoffNormal, 1) # consider base if position depth > depth [default = 1], mut count > altDepth [default = 1] and vaf mutation > vafCutoffNormal [default = 0.20]
 						
-						normal = open(miniBamN.replace(".bam", "_output_mpileup.tsv"), "r")
 						wild = {} # normal patient sequence
 						
 						sq = int(i[z]) # starts at 1st position interval
 						
 						passar = 0
 
-						for h in normal:
-							w = h.rstrip("\n").split("\t")
+						for w in pileupN:
 							if passar == 0:
-								g = 0 # saves possible snps in patient
-								dna = {} # save possible snps 
-								w[4] = w[4].replace(",", w[2]).replace(".", w[2]) # we change reference nucleotide
-								w[4] = w[4].upper() # convert all nucleotides to uppercase 
-								
-								while g < len(w[4]): # look for ACGT in each position
-									if w[4][g].isdigit():
-										if w[4][g+1].isdigit(): s = 2 # insertion/deletion of > 9 bases
-										else: s = 1 # insertion/deletion of < 10 bases
-											
-										prev = w[4][g-1] # previous shows + for insertions or - for deletions
-										now = int(w[4][g:g+s]) # current number of nucleotides being added or removed
-										indels = (w[4][g+s:g+s+now]) # nucleotides being added or removed
-										
-										if prev == "+": # insertion
-											ins = w[4][g-2]+"["+indels+"]"
-											if ins not in dna: # appends inserted region to dictionary
-												dna[ins] = 1  
-												dna[w[4][g-2]] -= 1
-											else: # adds an occurrence in dictionary
-												dna[ins] += 1
-												dna[w[4][g-2]] -= 1
-											g += now + 1  # we jump as many positions as number shows (number shows nucleotides inserted)
-											
-										elif prev == "-": # deletion
-											dele = w[4][g-2]+"("+indels+")"
-											if dele not in dna: # appends deleted region to dictionary
-												dna[dele] = 1
-												dna[w[4][g-2]] -= 1
-											else: # adds an occurrence in dictionary
-												dna[dele] += 1
-												dna[w[4][g-2]] -= 1
-											g += now + 1 # we jump as many positions as number shows (number shows nucleotides deleted)
-											
-										else: # workaround to exclude bases like ^6A (H/S/N in cigar)
-											g += 2
-											
-									elif w[4][g] in ("A", "C", "G", "T"):
-										if w[4][g] not in dna: # appends mutation to dictionary
-											dna[w[4][g]] = 1
-										else: # adds an occurrence in dictionary
-											dna[w[4][g]] += 1
-										g += 1
-									
-									else: # N, etc.
-										g += 1
-									
-								
-								dna = sorted(dna.items(), key=lambda dna: dna[1], reverse = True) # from high to low, the possible mutations
-								
-								tp = []
-								if len(dna) > 0:
-									for c in dna:
-										if int(w[3]) > depth and c[1] > altDepth and (c[1]/int(w[3])) > vafCutoffNormal: # consider base if position depth > depth [default = 1], mut count > altDepth [default = 1] and vaf mutation > vafCutoffNormal [default = 0.20]
-											tp.append(c[0])
+								tp = list(w[2]) # possible snps in patient, from high to low
 								
 								if len(tp) == 0:
-									tp.append(w[2]) 
+									tp.append(w[1]) 
 
 								
-								if sq == int(w[1]): # positions in interval with info
+								if sq == w[0]: # positions in interval with info
 									wild[sq] = tp # we append mutation to sequence instead of reference nucleotide
 									
 								else: # non existing positions
-									while sq < int(w[1]):
+									while sq < w[0]:
 										wild[sq] = ["N"]
 										sq += 1
 									wild[sq] = tp
@@ -708,8 +1263,6 @@ def getJandVsequences(information, GENE, refGenome, baseq, chromGene, bamN, mini
 						while sq <= int(i[z+1]):
 							wild[sq] = ["N"]
 							sq += 1
-							
-						normal.close()
 					
 					else:
 						wild = {}
@@ -719,22 +1272,16 @@ def getJandVsequences(information, GENE, refGenome, baseq, chromGene, bamN, mini
 					
 					
 					# Tumor seq:				
-					current = open(miniBamT.replace(".bam", "_output_mpileup.tsv"), "r")
 					tumSeq = []
 					normSeq = []
 					
 					passar = 0 # used to jump sequences if there is a deletion in tumor sequence
 					sq = int(i[z])
 					
-					for j in current:
-						
-						v=j.rstrip("\n").split("\t")
-						
-						v[4] = v[4].replace(",", v[2]).replace(".", v[2]) # we change reference nucleotide
-						v[4] = v[4].upper() # convert all nucleotides to uppercase
+					for v in pileupT:
 						
 						# check if missing positions
-						while sq < int(v[1]):
+						while sq < v[0]:
 							if passar == 0:
 								# if indel in normal, we consider the indel independently of the tumor seq
 								if len([True for x in wild[sq] if "(" in x or "[" in x]) > 0:
@@ -755,69 +1302,20 @@ def getJandVsequences(information, GENE, refGenome, baseq, chromGene, bamN, mini
 								
 						if passar == 0:
 							
-							newmut = {} # diccionary with nucleotide:n.ocurrences
-							k = 0 # shows the number of sequences which have to be jumped
-							
-							while k < len(v[4]): # look for ACGT in each position
-								if v[4][k].isdigit():
-									if v[4][k+1].isdigit(): s = 2 # insertion/deletion of > 9 bases
-									else: s = 1 # insertion/deletion of < 10 bases
-									
-									prev = v[4][k-1] # previous shows + for insertions or - for deletions
-									now = int(v[4][k:k+s]) # current number of nucleotides being added or removed
-									indels = (v[4][k+s:k+s+now]) # nucleotides being added or removed
-									
-									if prev == "+": # if it is insertion
-										ins = v[4][k-2]+"["+indels+"]"
-										if ins not in newmut: # appends inserted region to dictionary
-											newmut[ins] = 1  
-											newmut[v[4][k-2]] -= 1
-										else: # adds an occurrence in dictionary
-											newmut[ins] += 1
-											newmut[v[4][k-2]] -= 1
-										k += now + 1  # we jump as many positions as number shows (number shows nucleotides inserted)
-										
-									elif prev == "-": # if it is deletion
-										dele = v[4][k-2]+"("+indels+")"
-										if dele not in newmut: # appends deleted region to dictionary
-											newmut[dele] = 1
-											newmut[v[4][k-2]] -= 1
-										else: # adds an occurrence in dictionary
-											newmut[dele] += 1
-											newmut[v[4][k-2]] -= 1
-										k += now + 1 # we jump as many positions as number shows (number shows nucleotides deleted)
-										
-									else: # workaround to exclude bases like ^6A (H/S/N in cigar)
-										k += 2
-										
-								elif v[4][k] in ("A", "C", "G", "T"):
-									if v[4][k] not in newmut: # appends mutation to dictionary
-										newmut[v[4][k]] = 1
-									else: # adds an occurrence in dictionary
-										newmut[v[4][k]] += 1
-									k += 1
-								
-								else:
-									k += 1
-							
-							
-							newmut = sorted(newmut.items(), key=lambda newmut: newmut[1], reverse = True) # from high to low, the possible mutations
-							
 							snps = []
 							other = []
 							
 							# check if nucleotide in normal seq, if not add the one from reference
 							if wild[sq] == ["N"]:							
-								wild[sq] = [v[2]]
+								wild[sq] = [v[1]]
 							
-							# if nucleotides in tumor newmut:
-							if len(newmut) > 0: 
-								for c in newmut:
-									if int(v[3]) > depth and c[1] > altDepth and (c[1]/int(v[3])/tumorPurity) > vafCutoff: # min coverage > depth [default = 1], mut count > altDepth [default = 1] min VAF corrected by tumorPurity (if available) > vafCutoff [default = 0.10]
-										if c[0] in wild[sq]:
-											snps.append(c[0])
-										else:
-											other.append(c[0])
+							# if nucleotides in tumor passing the cut offs:
+							if len(v[2]) > 0: 
+								for c in v[2]:
+									if c in wild[sq]:
+										snps.append(c)
+									else:
+										other.append(c)
 								
 								# if indel in normal, we consider the indel independently of the tumor seq
 								if len([True for x in wild[sq] if "(" in x or "[" in x]) > 0:
@@ -849,7 +1347,7 @@ def getJandVsequences(information, GENE, refGenome, baseq, chromGene, bamN, mini
 									tumSeq.append("N")
 									normSeq.append(wild[sq][0])
 							
-							# in case no newmut... 
+							# in case no alleles... 
 							else:
 								if len([True for x in wild[sq] if "(" in x or "[" in x]) > 0:
 									if len([True for x in wild[sq] if "(" in x]) > 0:
@@ -869,8 +1367,6 @@ def getJandVsequences(information, GENE, refGenome, baseq, chromGene, bamN, mini
 						
 						sq = int(sq) + 1
 					
-					current.close()
-					
 					# Adjust length tumor and normal if nucleotides missing:
 					if sq-1 < int(i[z+1]):
 						tumSeq.extend("N" * (int(i[z+1])-sq-1))
@@ -904,10 +1400,62 @@ def getJandVsequences(information, GENE, refGenome, baseq, chromGene, bamN, mini
 		elif i[1] == "Inversion2":
 			i[12] = ''.join(complement[base] for base in reversed(i[12]))
 			i[13] = ''.join(complement[base] for base in reversed(i[13]))
+		
+		if tracing: traceEvent(i[0], "candidate", traceStart, {"function": "getJandVsequences", "mechanism": i[1], "J": str(i[4])+"-"+str(i[5]), "V": str(i[7])+"-"+str(i[8])})
 
 	return(information)
 	
-def createConcensusD(DseqTemp, GENE, i, Dseqs):
+@functools.lru_cache(maxsize=None)
+def readDgenes(Dseqs):
+	# D gene names and sequences of the DB_D_genes_seq file, read once (tuples, so that they can key the caches of dGeneSeeds and bestDgene)
+	names = []
+	seqs = []
+	sqs = open(Dseqs, "r")
+	for sqsLine in sqs:
+		w = sqsLine.rstrip("\n").split("\t")
+		names.append(w[0])
+		seqs.append(w[1])
+	sqs.close()
+	return(tuple(names), tuple(seqs))
+
+@functools.lru_cache(maxsize=None)
+def dGeneSeeds(seqs):
+	# k-mer (dGeneSeed) index of the D gene sequences: {k-mer: [D genes (index in the file)]}
+	seeds = {}
+	for g, seq in enumerate(seqs):
+		for k in range(len(seq)-dGeneSeed+1):
+			if g not in seeds.setdefault(seq[k:k+dGeneSeed], []): seeds[seq[k:k+dGeneSeed]].append(g)
+	return(seeds)
+
+def seedlessScoreBound(x, y, match_score=5, mismatch_cost=4):
+	# maximum Smith-Waterman score of x and y if they share no k-mer (dGeneSeed): matches come in runs of < dGeneSeed bases separated by a mismatch or a gap (>= mismatch_cost),
+	# and a run of r matches uses r-q+1 q-mers shared by x and y, so there are at least (matches - shared q-mers)/(q-1) runs for each q
+	matches = sum([min(x.count(b), y.count(b)) for b in set(x)])
+	runs = -(-matches//(dGeneSeed-1))
+	for q in range(2, dGeneSeed):
+		qx = Counter([x[k:k+q] for k in range(len(x)-q+1)])
+		qy = Counter([y[k:k+q] for k in range(len(y)-q+1)])
+		runs = max(runs, -(-(matches-sum((qx & qy).values()))//(q-1)))
+	return(matches*match_score - max(runs-1, 0)*mismatch_cost)
+
+@functools.lru_cache(maxsize=None)
+def bestDgene(DseqConsensus, dGenes):
+	# D gene with the highest Smith-Waterman score for the consensus (the first one in the file if tied): only D genes sharing k-mers with the consensus are aligned (all of them if none),
+	# plus those without shared k-mers that could still reach the best score (see seedlessScoreBound), so the result is the same as aligning all D genes
+	names, seqs = dGenes # see readDgenes
+	seeds = dGeneSeeds(seqs)
+	shortlist = set()
+	for k in range(len(DseqConsensus)-dGeneSeed+1): shortlist.update(seeds.get(DseqConsensus[k:k+dGeneSeed], []))
+	if len(shortlist) == 0: shortlist = set(range(len(seqs))) # no seed: exhaustive
+	
+	shortlist = sorted(shortlist)
+	scores = dict(zip(shortlist, smithwatermanScores(DseqConsensus, [seqs[g] for g in shortlist])))
+	rest = [g for g in range(len(seqs)) if g not in scores and seedlessScoreBound(DseqConsensus, seqs[g]) >= max(scores.values())]
+	if len(rest) > 0: scores.update(zip(rest, smithwatermanScores(DseqConsensus, [seqs[g] for g in rest])))
+	
+	return(names[max(sorted(scores), key=lambda g: scores[g])]) # max keeps the first D gene in the file among ties
+
+def createConcensusD(DseqTemp, GENE, i, dGenes):
 	
 	geneNames = i[0]
 	
@@ -935,14 +1483,7 @@ def createConcensusD(DseqTemp, GENE, i, Dseqs):
 	
 	# if IGH to check D gene:              
 	if GENE == "IGH":
-		sqs = open(Dseqs, "r")
-		t = []
-		for sqsLine in sqs:
-			w = sqsLine.rstrip("\n").split("\t")
-			score = smithwaterman(DseqConsensus, w[1])
-			t.append([w[0], score])
-		
-		dGeneName = sorted(t, key=operator.itemgetter(1), reverse = True)[0][0]
+		dGeneName = bestDgene(DseqConsensus, dGenes)
 		
 		geneNames = " - ".join([i[0].split(" - ")[0], dGeneName, i[0].split(" - ")[1]]) # update J-V to J-D-V
 
@@ -950,11 +1491,13 @@ def createConcensusD(DseqTemp, GENE, i, Dseqs):
 	return(geneNames, DseqConsensus)			
 
 
-def getDsequence(information, annot_table_JV, GENE, Dseqs):
+def getDsequence(information, evidenceIndex, GENE, dGenes):
 	
 	toAddInInformation = [] # list to append to Information if same D with same length
 	
+	tracing = traceState["enabled"]
 	for i in information:
+		if tracing: traceStart = time.perf_counter() # -trace yes: one span per candidate
 		
 		# Get soft clipped start/end J-V :  
 		if GENE != "IGL":
@@ -971,42 +1514,39 @@ def getDsequence(information, annot_table_JV, GENE, Dseqs):
 			i.append(totseqW)
 			
 		else:
-			reads = open(annot_table_JV, "r")
-			for j in reads:
-				w = j.rstrip("\n").split("\t")
-				if w[11].startswith("split"):
+			splitRows = evidenceIndex["splitBreaks"]
+			for row in sorted(set(splitRows.get((breakJ, breakV), []) + splitRows.get((breakJ, 0), []) + splitRows.get((breakV, 0), []))): # split reads that may match the J and/or V breaks below
+				w = evidenceIndex["rows"][row]
+				if w[evidenceType].startswith("split"):
 					
 					# if information last value J and first value V coincide with w split values
-					if breakJ == int(w[12].replace("NA", "0")) and breakV == int(w[13].replace("NA", "0")):
-						split = re.findall(r'[A-Za-z]|[0-9]+', w[5])
-						cigar1 = [split[x:x+2] for x in range(0, len(split),2)]
-						split = re.findall(r'[A-Za-z]|[0-9]+', w[10].split(",")[3])
-						cigar2 = [split[x:x+2] for x in range(0, len(split),2)]
+					if breakJ == (0 if w[evidenceSplit1] == "NA" else w[evidenceSplit1]) and breakV == (0 if w[evidenceSplit2] == "NA" else w[evidenceSplit2]):
+						cigar1 = parseCigar(w[evidenceCigar])
+						cigar2 = parseCigar(parseSA(w[evidenceSA])["cigar"])
 						# MS cigar
-						if min([count for count, item in enumerate(cigar1) if "M" in item]) < min([count for count, item in enumerate(cigar1) if "S" in item]):
-							mStart = sum([ int(x[0]) if x[1] in ["M", "I"] else 0 for x in cigar1 ]) # we add the numbers previous to M and I
-							mEnd = sum([ int(x[0]) if x[1] == "S" else 0 for x in cigar2 ]) # we add numbers previous to S
+						if cigar1["matchFirst"]:
+							mStart = cigar1["queryAligned"] # we add the numbers previous to M and I
+							mEnd = cigar2["clipped"] # we add numbers previous to S
 						# SM cigar
 						else:
-							mStart = sum([ int(x[0]) if x[1] in ["M", "I"] else 0 for x in cigar2 ]) # we add the numbers previous to M and I
-							mEnd = sum([ int(x[0]) if x[1] == "S" else 0 for x in cigar1 ]) # we add numbers previous to S
+							mStart = cigar2["queryAligned"] # we add the numbers previous to M and I
+							mEnd = cigar1["clipped"] # we add numbers previous to S
 						
-						DseqTemp.append(w[9][mStart:mEnd]) # we analyse from M,I+seq until seq-everything but S
+						DseqTemp.append(w[evidenceSeq][mStart:mEnd]) # we analyse from M,I+seq until seq-everything but S
 						
 					
 					# if information last position J:
-					elif breakJ == int(w[12].replace("NA", "0")) and w[13] == "NA":
+					elif breakJ == (0 if w[evidenceSplit1] == "NA" else w[evidenceSplit1]) and w[evidenceSplit2] == "NA":
 							
-						split = re.findall(r'[A-Za-z]|[0-9]+', w[5])
-						cigar1 = [split[x:x+2] for x in range(0, len(split),2)]
+						cigar1 = parseCigar(w[evidenceCigar])
 						# MS cigar
-						if min([count for count, item in enumerate(cigar1) if "M" in item]) < min([count for count, item in enumerate(cigar1) if "S" in item]):
-							mStart = sum([ int(x[0]) if x[1] == "S" else 0 for x in cigar1 ]) # we add numbers previous to S
-							J = w[9][-mStart:]
+						if cigar1["matchFirst"]:
+							mStart = cigar1["clipped"] # we add numbers previous to S
+							J = w[evidenceSeq][-mStart:]
 						# SM cigar
 						else:
-							mEnd = sum([ int(x[0]) if x[1] == "S" else 0 for x in cigar1 ]) # we add numbers previous to S
-							J = w[9][:mEnd]
+							mEnd = cigar1["clipped"] # we add numbers previous to S
+							J = w[evidenceSeq][:mEnd]
 						
 						# Vseq: remove deleted nucleotides, check insertion at first bases, keep insertions not at first base:
 						if GENE != "IGL": 
@@ -1031,18 +1571,17 @@ def getDsequence(information, annot_table_JV, GENE, Dseqs):
 							j += 1
 					
 					# if information first position V:
-					elif breakV == int(w[12].replace("NA", "0")) and w[13] == "NA":
+					elif breakV == (0 if w[evidenceSplit1] == "NA" else w[evidenceSplit1]) and w[evidenceSplit2] == "NA":
 						
-						split = re.findall(r'[A-Za-z]|[0-9]+', w[5])
-						cigar1 = [split[x:x+2] for x in range(0, len(split),2)]
+						cigar1 = parseCigar(w[evidenceCigar])
 						# MS cigar
-						if min([count for count, item in enumerate(cigar1) if "M" in item]) < min([count for count, item in enumerate(cigar1) if "S" in item]):
-							mStart = sum([ int(x[0]) if x[1] == "S" else 0 for x in cigar1 ]) # we add numbers previous to S
-							V = w[9][-mStart:]
+						if cigar1["matchFirst"]:
+							mStart = cigar1["clipped"] # we add numbers previous to S
+							V = w[evidenceSeq][-mStart:]
 						# SM cigar
 						else:
-							mEnd = sum([ int(x[0]) if x[1] == "S" else 0 for x in cigar1 ]) # we add numbers previous to S
-							V = w[9][:mEnd]
+							mEnd = cigar1["clipped"] # we add numbers previous to S
+							V = w[evidenceSeq][:mEnd]
 						
 						# jSeq: remove deleted nucleotides, check insertion at last bases, keep insertions not at last base:
 						if GENE != "IGL": 
@@ -1065,8 +1604,6 @@ def getDsequence(information, annot_table_JV, GENE, Dseqs):
 								break
 							v -= 1
 			
-			reads.close()
-			
 			# Report Ds:	
 			AorBdone = "no"		
 			if len(DseqTemp) > 0: 
@@ -1076,7 +1613,7 @@ def getDsequence(information, annot_table_JV, GENE, Dseqs):
 					
 					countToAdd = 1
 					for DseqTempSimple in DseqTemp:
-						geneNames, DseqConsensus = createConcensusD([DseqTempSimple], GENE, i, Dseqs)
+						geneNames, DseqConsensus = createConcensusD([DseqTempSimple], GENE, i, dGenes)
 						if countToAdd < len(DseqTemp):
 							iToAddInToAddInInformationlist = i.copy()
 							iToAddInToAddInInformationlist[0] = geneNames
@@ -1112,7 +1649,7 @@ def getDsequence(information, annot_table_JV, GENE, Dseqs):
 						
 						# get first
 						DseqTempSimple = [ss for ss in DseqTemp if len(ss) == Counter([len(s) for s in DseqTemp]).most_common(2)[0][0]] # get Dseqs with the same length	
-						geneNames, DseqConsensus = createConcensusD(DseqTempSimple, GENE, i, Dseqs)
+						geneNames, DseqConsensus = createConcensusD(DseqTempSimple, GENE, i, dGenes)
 						iToAddInToAddInInformationlist = i.copy()
 						iToAddInToAddInInformationlist[0] = geneNames
 						iToAddInToAddInInformationlist[11] = DseqConsensus
@@ -1126,7 +1663,7 @@ def getDsequence(information, annot_table_JV, GENE, Dseqs):
 						
 						# get second
 						DseqTempSimple = [ss for ss in DseqTemp if len(ss) == Counter([len(s) for s in DseqTemp]).most_common(2)[1][0]] # get Dseqs with the same length	
-						geneNames, DseqConsensus = createConcensusD(DseqTempSimple, GENE, i, Dseqs)
+						geneNames, DseqConsensus = createConcensusD(DseqTempSimple, GENE, i, dGenes)
 						i[0] = geneNames
 						i[11] = DseqConsensus
 						if GENE != "IGL":
@@ -1142,7 +1679,7 @@ def getDsequence(information, annot_table_JV, GENE, Dseqs):
 				## C) if not A or B, get Dseqs with the same length
 				if AorBdone == "no":
 					DseqTemp = [ss for ss in DseqTemp if len(ss) == Counter([len(s) for s in DseqTemp]).most_common(1)[0][0]] # get Dseqs with the same length		
-					geneNames, DseqConsensus = createConcensusD(DseqTemp, GENE, i, Dseqs)
+					geneNames, DseqConsensus = createConcensusD(DseqTemp, GENE, i, dGenes)
 					i[0] = geneNames
 					i[11] = DseqConsensus
 					
@@ -1162,6 +1699,8 @@ def getDsequence(information, annot_table_JV, GENE, Dseqs):
 					totseqW = i[12]+i[11]+i[10]
 				totseqW = re.sub("\(.*?\)", "", totseqW.replace("[", "").replace("]", ""))
 				i.append(totseqW)
+		
+		if tracing: traceEvent(i[0], "candidate", traceStart, {"function": "getDsequence", "mechanism": i[1], "J": str(i[4])+"-"+str(i[5]), "V": str(i[7])+"-"+str(i[8])})
 	
 	
 	information.extend(toAddInInformation) # extend information with duplicated entries with different D (from previous A and B)
@@ -1606,7 +2145,10 @@ def predefinedFilter(information, GENE, tumorPurity, seq):
 	
 	return(trip)
 
-def addMapQualAndScore(information, trip, GENE, annot_table_JV):
+def addMapQualAndScore(information, trip, GENE, evidenceIndex):
+	tripByBreaks = {} # first rearrangement in trip for each J and V breaks
+	for t in trip: tripByBreaks.setdefault((trip[t][4], trip[t][5], trip[t][7], trip[t][8]), t)
+	
 	for i in information:
 		if GENE != "IGL":
 			if i[1] == "Deletion":
@@ -1637,13 +2179,7 @@ def addMapQualAndScore(information, trip, GENE, annot_table_JV):
 		
 		
 		spl_ins = int(i[2])*2 + int(i[3]) + int(i[6])*2 + int(i[9])*2
-		quals = []
-		reads = open(annot_table_JV, "r")
-		for read in reads:
-			readList = read.rstrip("\n").split("\t")
-			if ( readList[11].startswith("split") and int(readList[12] if readList[12] != "NA" else 0) == breakJ and int(readList[13] if readList[13] != "NA" else 0) == breakV ) or ( J == readList[18] and V == readList[19] ):
-				quals.append(int(readList[4]))
-		reads.close()
+		quals = [evidenceIndex["rows"][row][evidenceMapq] for row in sorted(set(evidenceIndex["splitBreaks"].get((breakJ, breakV), []) + evidenceIndex["insertPairs"].get((J, V), [])))] # split reads with the same breaks or insertSize reads with the same genes
 		
 		if quals == []: MQ = "NA"
 		else: MQ = str(round(mean(quals),1))+" ("+str(min(quals))+"-"+str(max(quals))+")"
@@ -1651,14 +2187,11 @@ def addMapQualAndScore(information, trip, GENE, annot_table_JV):
 		i.append(spl_ins)
 		i.append(MQ)
 		
-		for t in trip:
-			if i[4] == trip[t][4] and i[5] == trip[t][5] and i[7] == trip[t][7] and i[8] == trip[t][8]:
-				trip[t].append(MQ) 
-				break
+		if (i[4], i[5], i[7], i[8]) in tripByBreaks: trip[tripByBreaks[(i[4], i[5], i[7], i[8])]].append(MQ)
 	
 	return(information, trip)
 
-def classSwitchAnalysis(data, bedFile, baseq, chromGene, bamT, bamN, pathToSamtools, tumorPurity):
+def classSwitchAnalysis(data, bedIndex, baseq, chromGene, bamT, bamN, pathToSamtools, tumorPurity, alignmentEngine, minReductionCSR=30, maxPvalueCSR=1e-10):
 	class_switch = []
 	class_switch_filt = []
 	reductionMeans  = []
@@ -1676,16 +2209,19 @@ def classSwitchAnalysis(data, bedFile, baseq, chromGene, bamT, bamN, pathToSamto
 		# study coverage and soft filter:
 		isotypye = kGenes.split(" - ")[0]
 		
-		VDJ = open(bedFile, "r")
-		for k in VDJ:
-			v = k.rstrip("\n").split("\t")
-			if isotypye == v[3]:
-				startA = int(v[1])-1500
-				endA = int(v[1])
-				startB = int(v[2])
-				endB = int(v[2])+1500
-				break
-		VDJ.close()		
+		if isotypye in bedIndex["genes"]:
+			v = bedIndex["genes"][isotypye]
+			startA = int(v[0])-1500
+			endA = int(v[0])
+			startB = int(v[1])
+			endB = int(v[1])+1500
+		
+		# coverage before (A) and after (B) the break in tumor and normal, all at the same time
+		calls = []
+		for sample in ([bamT] if bamN is None else [bamT, bamN]):
+			for i in ["A", "B"]:
+				calls.append([checkpoint, "pileupRegion_CSR", [bamKey(sample), chromGene, startA if i == "A" else startB, endA if i == "A" else endB, baseq], pileupRegion, sample, chromGene, startA if i == "A" else startB, endA if i == "A" else endB, baseq, None, False, sample.replace(".bam", "_CSR_"+i+"_output_mpileup.tsv"), alignmentEngine, pathToSamtools])
+		pileups = runConcurrently(calls)
 		
 		covs = {}
 		for i in ["A", "B"]:
@@ -1696,19 +2232,14 @@ def classSwitchAnalysis(data, bedFile, baseq, chromGene, bamT, bamN, pathToSamto
 				st = startB
 				en = endB
 			
-			subprocess.call(pathToSamtools+"samtools mpileup -B -Q "+baseq+" -r "+chromGene+":"+str(st)+"-"+str(en)+" "+bamT+ " > "+bamT.replace(".bam", "_output_mpileup.tsv"), shell=True)					
-			
 			pos = st
 			lst = []
-			seq = open(bamT.replace(".bam", "_output_mpileup.tsv"), "r")
-			for sLine in seq:
-				sList = sLine.rstrip("\n").split("\t")
+			for sList in pileups[0 if i == "A" else 1]:
 				while pos < int(sList[1]):
 					lst.append(0)
 					pos += 1
 				lst.append(int(sList[3]))
 				pos += 1
-			seq.close()
 			
 			while pos <= en:
 				lst.append(0)
@@ -1734,13 +2265,9 @@ def classSwitchAnalysis(data, bedFile, baseq, chromGene, bamT, bamN, pathToSamto
 					st = startB
 					en = endB
 				
-				subprocess.call(pathToSamtools+"samtools mpileup -B -Q "+baseq+" -r "+chromGene+":"+str(st)+"-"+str(en)+" "+bamN+ " > "+bamN.replace(".bam", "_output_mpileup.tsv"), shell=True)					
-				
 				pos = st
 				idx = 0
-				seq = open(bamN.replace(".bam", "_output_mpileup.tsv"), "r")
-				for sLine in seq:
-					sList = sLine.rstrip("\n").split("\t")
+				for sList in pileups[2 if i == "A" else 3]:
 					while pos < int(sList[1]):
 						covs[i][idx] = covs[i][idx] - 0
 						forMeanNorm.append(0)
@@ -1750,7 +2277,6 @@ def classSwitchAnalysis(data, bedFile, baseq, chromGene, bamT, bamN, pathToSamto
 					forMeanNorm.append(int(sList[3]))
 					idx += 1
 					pos += 1
-				seq.close()
 				
 				if i == "A":
 					meanNormA = mean(forMeanNorm)
@@ -1772,8 +2298,8 @@ def classSwitchAnalysis(data, bedFile, baseq, chromGene, bamT, bamN, pathToSamto
 			class_switch.append([ kGenes.split(" - ")[0], kReadtype, score, meanA, meanB, pvalue, reductionMean ])
 		
 		# pre-defined soft filer:
-		if meanA > 8 and reductionMean >= 30 and pvalue < 0.0000000001: # 1e-10
-			if (score >= 4 and reductionMean >= 60) or (score >= 7 and reductionMean >= 30):
+		if meanA > 8 and reductionMean >= minReductionCSR and pvalue < maxPvalueCSR: # default 30 and 1e-10
+			if (score >= 4 and reductionMean >= 60) or (score >= 7 and reductionMean >= minReductionCSR):
 				class_switch_filt.append([ kGenes.split(" - ")[0], kReadtype, score, meanA, meanB, pvalue, reductionMean ])
 				reductionMeans.append(reductionMean)
 				#~ pvals.append(pvalue)
@@ -1782,206 +2308,231 @@ def classSwitchAnalysis(data, bedFile, baseq, chromGene, bamT, bamN, pathToSamto
 	
 	return(class_switch, class_switch_filt, reductionMeans)
 
-def getIgTranslocations(genomeVersion, inputsFolder, pathToSamtools, threadsForSamtools, bamT, bamN, chrom, coordsToSubset, tumorPurity, mntonco, mntoncoPass, mnnonco, mapqOnco):
-	
-	chrom14 = coordsToSubset.split(" ")[0].split(":")[1].split("-") # IGH region 
-	chrom22 = coordsToSubset.split(" ")[1].split(":")[1].split("-") # IGL region
-	chrom2 = coordsToSubset.split(" ")[2].split(":")[1].split("-") # IGK region
-	
-	chroms = [chrom+str(i) for i in range(1,22)]+[chrom+"X", chrom+"Y", "="] # chroms considered ("=" to consider deletions/inversions/gains within the same chromosome)
-	
-	samT = bamT.replace(".bam", ".sam")
-	comms = pathToSamtools+"samtools view -@ "+threadsForSamtools+" -q "+mapqOnco+" "+bamT+" > "+samT 
-	subprocess.call(comms, shell=True)
-	
-	if bamN is not None:
-		samN = bamN.replace(".bam", ".sam")
-		comms = pathToSamtools+"samtools view -@ "+threadsForSamtools+" -q "+mapqOnco+" "+bamN+" > "+samN 
-		subprocess.call(comms, shell=True)
-	
-	# 1. annotate potential 1-read translocations
-	dicForTranslocations = {} 
-	dicForTranslocations[chrom+"14"] = {}
-	dicForTranslocations[chrom+"2"] = {}
-	dicForTranslocations[chrom+"22"] = {}
-
-	samfile = open(samT, "r")
-	for i in samfile:
-		
-		w = i.rstrip("\n").split("\t")
-		sa=[]
-		for x in (w[11:]): # get SA:... after qualities
-			if x.startswith("SA:Z"):
-				sa.append(x)
-		if len(sa) != 0: w = w[:10]+[sa[0]]
-		else: w = w[:10]+["NA"]
+def oneReadRearrangements(reads, chrom, chroms, chrom14, chrom22, chrom2, minDistance):
+	# potential 1-read rearrangements [chrom, position, strand, out chrom, out position, out strand] from reads with the mate or the split (SA) out of the IG locus (>minDistance if in the same chromosome)
+	events = []
+	for w in reads: # SAM fields 1-10 and SA:... (or NA), see alignmentRecords
 		
 		if w[5] != "*" and w[6] in chroms:
 			if w[6] == "=":
-				if abs(int(w[3]) - int(w[7])) > 10000: # for inversion, deletions, gains
+				if abs(int(w[3]) - int(w[7])) > minDistance: # for inversion, deletions, gains
 					if w[2] == chrom+"14" and int(w[7]) >= int(chrom14[0]) and int(w[7]) <= int(chrom14[1]): continue
 					elif w[2] == chrom+"22" and int(w[7]) >= int(chrom22[0]) and int(w[7]) <= int(chrom22[1]): continue
 					elif w[2] == chrom+"2" and int(w[7]) >= int(chrom2[0]) and int(w[7]) <= int(chrom2[1]): continue
 				else: continue
 				
-			flgBin = flagToCustomBinary(w[1])
-			split1 = re.findall(r'[A-Za-z]|[0-9]+', w[5])
-			two1 = [split1[x:x+2] for x in range(0, len(split1),2)]
+			flag = int(w[1])
+			sa = parseSA(w[10])
 			
 			inChrom = w[2]
-			posInChrom = w[3]
-			strandInChrom = "-" if "1" == flgBin[4] else "+"
-			if strandInChrom == "+": posInChrom = str(int(posInChrom) + sum([int(i[0]) for i in two1 if "M" in i or "D" in i]) - 1)
+			posInChrom = int(w[3])
+			strandInChrom = "-" if flag & flagReverse else "+"
+			if strandInChrom == "+": posInChrom = posInChrom + parseCigar(w[5])["aligned"] - 1
 			
 			# if split, get second break from split:
-			strandOutChrom = "-" if "1" == flgBin[5] else "+" # strand from insert size to get orientation of the translocation
-			if w[10].startswith("SA:Z") and w[10].split(":")[2].split(",")[0] in chroms:
-				outChrom = w[10].split(":")[2].split(",")[0]
-				posOutChrom = w[10].split(":")[2].split(",")[1]
-				strandOutChromSA = w[10].split(":")[2].split(",")[2]
+			strandOutChrom = "-" if flag & flagMateReverse else "+" # strand from insert size to get orientation of the translocation
+			if sa is not None and sa["chrom"] in chroms:
+				outChrom = sa["chrom"]
+				posOutChrom = sa["pos"]
+				strandOutChromSA = sa["strand"]
 				if strandOutChromSA == "-":
-					split1 = re.findall(r'[A-Za-z]|[0-9]+', w[10].split(":")[2].split(",")[3])
-					two1 = [split1[x:x+2] for x in range(0, len(split1),2)]
-					posOutChrom = str(int(posOutChrom) + sum([int(i[0]) for i in two1 if "M" in i or "D" in i]) - 1)
+					posOutChrom = posOutChrom + parseCigar(sa["cigar"])["aligned"] - 1
 			else: # else, get from insertsize
 				outChrom = w[6].replace("=", inChrom)
-				posOutChrom = w[7]
+				posOutChrom = int(w[7])
 			
-			if outChrom in dicForTranslocations[inChrom]:
-				dicForTranslocations[inChrom][outChrom].append([posInChrom, strandInChrom, posOutChrom, strandOutChrom])
-			else:
-				dicForTranslocations[inChrom][outChrom] = [[posInChrom, strandInChrom, posOutChrom, strandOutChrom]]
-				
-	samfile.close()
-	subprocess.call("rm "+samT, shell=True)	
+			events.append([inChrom, posInChrom, strandInChrom, outChrom, posOutChrom, strandOutChrom])
+	
+	return(events)
+
+def clusterOneReadEvents(posIn, strandIn, posOut, strandOut, mntonco, tolerance=1000):
+	# merge the 1-read rearrangements of one chromosome pair into potential rearrangements [minIn, maxIn, strandIn, minOut, maxOut, strandOut, number of reads] (only if number of reads >= mntonco)
+	# reads are sorted by strand pair and position and swept once: as in the former merge, a read joins the first open cluster of its strand pair with positions < tolerance bp away in both chromosomes, 
+	# and a cluster is closed once the sweep is >= tolerance bp past its last read, so the result does not depend on read order and only the open clusters are kept
+	strands = [(s1 == "-")*2 + (s2 == "-") for s1, s2 in zip(strandIn, strandOut)]
+	order = np.lexsort((np.asarray(posOut, dtype=np.int64), np.asarray(posIn, dtype=np.int64), np.asarray(strands, dtype=np.int8)))
+	
+	clusters = []
+	opened = [] # [strand pair, minIn, maxIn, sorted out positions, first read] of the open clusters, in order of creation
+	for i in order.tolist():
+		p1, p2 = posIn[i], posOut[i]
+		closing = [c for c in opened if c[0] != strands[i] or p1 - c[2] >= tolerance]
+		if closing:
+			clusters.extend(c for c in closing if len(c[3]) >= mntonco)
+			opened = [c for c in opened if c[0] == strands[i] and p1 - c[2] < tolerance]
+		
+		for c in opened:
+			k = bisect.bisect_right(c[3], p2-tolerance) # first out position > p2-tolerance
+			if k < len(c[3]) and c[3][k] < p2+tolerance:
+				c[2] = p1
+				bisect.insort(c[3], p2)
+				break
+		else:
+			opened.append([strands[i], p1, p1, [p2], i])
+	clusters.extend(c for c in opened if len(c[3]) >= mntonco)
+	
+	clusters = [[int(c[1]), int(c[2]), strandIn[c[4]], int(c[3][0]), int(c[3][-1]), strandOut[c[4]], len(c[3])] for c in clusters]
+	return(sorted(clusters, key=lambda c: (c[2], c[5], c[0], c[3])))
+
+def translocationIndex(translocations, window):
+	# potential rearrangements of each chromosome pair sorted by the start of their breakpoint A window (+-window bp, for bisect, see candidatesAt)
+	candidateIndex = {}
+	for key1 in translocations:
+		for key2 in translocations[key1]:
+			candidates = sorted([[int(t[1])-window, int(t[2])+window, t] for t in translocations[key1][key2]], key=operator.itemgetter(0))
+			candidateIndex[(key1, key2)] = {"starts": [c[0] for c in candidates], "candidates": candidates, "maxWidth": max(c[1]-c[0] for c in candidates)}
+	return(candidateIndex)
+
+def candidatesAt(candidateIndex, inChrom, outChrom, pos):
+	# potential rearrangements between inChrom and outChrom whose breakpoint A window includes the position
+	if (inChrom, outChrom) not in candidateIndex: return([])
+	pair = candidateIndex[(inChrom, outChrom)]
+	found = []
+	idx = bisect.bisect_right(pair["starts"], pos) # windows starting after pos can not include it
+	while idx > 0 and pair["starts"][idx-1] >= pos-pair["maxWidth"]: # nor those starting more than the widest window before it
+		idx -= 1
+		if pair["candidates"][idx][1] >= pos: found.append(pair["candidates"][idx][2])
+	return(found)
+
+def annotationIndex(dicti):
+	# GeneID or RepeatMasker dictionary ({chrom: [[start, end, name]]}) converted to arrays per chromosome sorted by lowest coordinate, keeping the order of each element in the dictionary (for bisect, see nearestGene and repeatAt). Names are codes of a string table shared by all chromosomes
+	index = {}
+	strings = []
+	codes = {}
+	for c in dicti:
+		starts = np.array([int(element[0]) for element in dicti[c]], dtype=np.int64)
+		ends = np.array([int(element[1]) for element in dicti[c]], dtype=np.int64)
+		names = np.array([codes.setdefault(element[2], len(codes)) for element in dicti[c]], dtype=np.int32)
+		strings.extend(list(codes)[len(strings):])
+		lows = np.minimum(starts, ends)
+		order = np.argsort(lows, kind="stable")
+		index[c] = {"lows": lows[order], "starts": starts[order], "ends": ends[order], "order": order, "names": names[order], "strings": strings, "maxWidth": int(np.abs(ends-starts).max()) if len(order) > 0 else 0}
+	return(index)
+
+def writeAnnotationStore(index, storeFolder):
+	# columnar store of an annotationIndex: the arrays of all chromosomes concatenated in .npy files (memory-mapped by openAnnotationStore), chroms.tsv (chromosome, first and last row, widest element) and strings.txt (string table)
+	os.makedirs(storeFolder, exist_ok=True)
+	chroms = list(index)
+	for column in ["lows", "starts", "ends", "order", "names"]:
+		np.save(os.path.join(storeFolder, column+".npy"), np.concatenate([index[c][column] for c in chroms]) if chroms else np.array([], dtype=np.int64))
+	
+	first = 0
+	with open(os.path.join(storeFolder, "chroms.tsv"), "w") as out:
+		for c in chroms:
+			out.write("\t".join([c, str(first), str(first+len(index[c]["lows"])), str(index[c]["maxWidth"])])+"\n")
+			first += len(index[c]["lows"])
+	with open(os.path.join(storeFolder, "strings.txt"), "w") as out:
+		for string in (index[chroms[0]]["strings"] if chroms else []):
+			out.write(string+"\n")
+
+def openAnnotationStore(storeFolder):
+	# annotationIndex read from a columnar store: arrays are memory-mapped (read only, so pages are shared by the IgCaller processes of a node) and sliced per chromosome without being loaded
+	columns = {column: np.load(os.path.join(storeFolder, column+".npy"), mmap_mode="r") for column in ["lows", "starts", "ends", "order", "names"]}
+	with open(os.path.join(storeFolder, "strings.txt"), "r") as strings:
+		strings = [string.rstrip("\n") for string in strings]
+	
+	index = {}
+	with open(os.path.join(storeFolder, "chroms.tsv"), "r") as chroms:
+		for line in chroms:
+			c, first, last, maxWidth = line.rstrip("\n").split("\t")
+			index[c] = {column: columns[column][int(first):int(last)] for column in columns}
+			index[c]["strings"] = strings
+			index[c]["maxWidth"] = int(maxWidth)
+	return(index)
+
+def annotationStoreFolder(dictFile):
+	# columnar store of a GeneID/RepeatMasker dictionary, next to its gzipped pickle
+	return(dictFile.replace(".pkl.gz", "_arrays"))
+
+@functools.lru_cache(maxsize=None)
+def loadAnnotation(dictFile):
+	# annotationIndex of a GeneID/RepeatMasker dictionary: from its columnar store if converted (see IgCaller_convert_dictionaries.py), else from the gzipped pickle. Loaded once per process (IgCaller batch loads them before forking)
+	if os.path.isfile(os.path.join(annotationStoreFolder(dictFile), "chroms.tsv")):
+		return(openAnnotationStore(annotationStoreFolder(dictFile)))
+	return(annotationIndex(pickle.load(gzip.open(dictFile, 'rb'))))
+
+def nearestGene(geneIndex, pos, maxDistance):
+	# gene including the position (distance 0) or, if none, closest to it by its start or end (< maxDistance): the first one in the dictionary if several, ["", maxDistance] if none
+	lo = np.searchsorted(geneIndex["lows"], pos-maxDistance-geneIndex["maxWidth"], side="right") # genes ending (or starting) maxDistance before pos or earlier are too far
+	hi = np.searchsorted(geneIndex["lows"], pos+maxDistance, side="left") # as are those starting maxDistance after pos or later
+	starts, ends, order = geneIndex["starts"][lo:hi], geneIndex["ends"][lo:hi], geneIndex["order"][lo:hi]
+	
+	candidates = np.flatnonzero((starts <= pos) & (ends >= pos))
+	if len(candidates) > 0:
+		return([geneIndex["strings"][geneIndex["names"][lo+candidates[np.argmin(order[candidates])]]], 0])
 	
-	# 2. Merge individual one-read translocations into potential translocations (kep only if number of reads (ie score) > mntonco)
+	distances = np.minimum(np.abs(pos-starts), np.abs(pos-ends))
+	candidates = np.flatnonzero(distances < maxDistance)
+	if len(candidates) == 0: return(["", maxDistance])
+	candidates = candidates[distances[candidates] == distances[candidates].min()]
+	best = candidates[np.argmin(order[candidates])]
+	return([geneIndex["strings"][geneIndex["names"][lo+best]], int(distances[best])])
+
+def repeatAt(repeatIndex, pos, expand, default):
+	# repeat including the position (start and end expanded by expand bp): the first one in the dictionary if several, default if none
+	lo = np.searchsorted(repeatIndex["lows"], pos-expand-repeatIndex["maxWidth"], side="left")
+	hi = np.searchsorted(repeatIndex["lows"], pos+expand, side="right")
+	candidates = np.flatnonzero((repeatIndex["starts"][lo:hi]-expand <= pos) & (repeatIndex["ends"][lo:hi]+expand >= pos))
+	if len(candidates) == 0: return(default)
+	return(repeatIndex["strings"][repeatIndex["names"][lo+candidates[np.argmin(repeatIndex["order"][lo:hi][candidates])]]])
+
+def getIgTranslocations(genomeVersion, inputsFolder, readsT, readsN, chrom, coordsToSubset, tumorPurity, mntonco, mntoncoPass, mnnonco, readsKeys=[None, None]):
+	
+	chrom14 = coordsToSubset.split(" ")[0].split(":")[1].split("-") # IGH region 
+	chrom22 = coordsToSubset.split(" ")[1].split(":")[1].split("-") # IGL region
+	chrom2 = coordsToSubset.split(" ")[2].split(":")[1].split("-") # IGK region
+	
+	chroms = [chrom+str(i) for i in range(1,22)]+[chrom+"X", chrom+"Y", "="] # chroms considered ("=" to consider deletions/inversions/gains within the same chromosome)
+	
+	# 1. annotate potential 1-read translocations
+	dicForTranslocations = {} 
+	dicForTranslocations[chrom+"14"] = {}
+	dicForTranslocations[chrom+"2"] = {}
+	dicForTranslocations[chrom+"22"] = {}
+
+	calls = [[checkpoint, "oneReadRearrangements_T", [readsKeys[0], chrom, coordsToSubset, 10000], oneReadRearrangements, readsT, chrom, chroms, chrom14, chrom22, chrom2, 10000]] # readsKeys: checkpoint keys of the tumor and normal reads
+	if readsN is not None: calls.append([checkpoint, "oneReadRearrangements_N", [readsKeys[1], chrom, coordsToSubset, 8000], oneReadRearrangements, readsN, chrom, chroms, chrom14, chrom22, chrom2, 8000]) # 8000 instead of 10000 just to be more permessive in the normal...
+	events = runConcurrently(calls) # tumor and normal reads are scanned at the same time
+	
+	for inChrom, posInChrom, strandInChrom, outChrom, posOutChrom, strandOutChrom in events[0]:
+		if outChrom not in dicForTranslocations[inChrom]:
+			dicForTranslocations[inChrom][outChrom] = [[], [], [], []] # positions and strands in and out
+		for column, value in zip(dicForTranslocations[inChrom][outChrom], [posInChrom, strandInChrom, posOutChrom, strandOutChrom]):
+			column.append(value)
+
+	# 2. Merge individual one-read translocations into potential translocations (kep only if number of reads (ie score) >= mntonco), one chromosome pair at a time
 	translocations = {}
 	translocations[chrom+"14"] = {}
 	translocations[chrom+"2"] = {}
 	translocations[chrom+"22"] = {}
-	
-	position1 = list()
-	strand1 = ""
-	position2 = list()
-	strand2 = ""
+
 	for key1 in dicForTranslocations:
-		for key2 in dicForTranslocations[key1]:
-			for item in dicForTranslocations[key1][key2]:
-				alreadyConsidered = "no"
-				
-				# check if new one-read translocation could be added to an already merged potential translocation;
-				if key2 in translocations[key1]:
-					for item2 in translocations[key1][key2]:
-						if ( abs(int(item[0]) - int(item2[1])) < 1000 or abs(int(item[0]) - int(item2[2])) < 1000 ) and item[1] == item2[3] and ( abs(int(item[2]) - int(item2[5])) < 1000 or abs(int(item[2]) - int(item2[6])) < 1000 )  and item[3] == item2[7]:
-							item2[1] = str(min([int(item2[1]), int(item[0])]))
-							item2[2] = str(max([int(item2[2]), int(item[0])]))
-							item2[5] = str(min([int(item2[5]), int(item[2])]))
-							item2[6] = str(min([int(item2[6]), int(item[2])]))
-							item2[8] = item2[8]+1
-							alreadyConsidered = "yes"
-							break
-				
-				# if not added before, initialize new potential translocation:
-				if alreadyConsidered == "no":
-					if position1 == list():
-						position1.append(int(item[0]))
-						strand1 = item[1]
-						position2.append(int(item[2]))
-						strand2 = item[3]
-						alreadyConsidered = "yes"
-					
-					elif  min(abs(p1 - int(item[0])) for p1 in position1) < 1000 and strand1 == item[1] and min(abs(p2 - int(item[2])) for p2 in position2) < 1000 and strand2 == item[3]:
-						position1.append(int(item[0]))
-						position2.append(int(item[2]))
-				
-					else:
-						if len(position1) >= mntonco:
-							if key2 in translocations[key1]: translocations[key1][key2].append([key1, str(min(position1)), str(max(position1)), strand1, key2, str(min(position2)), str(max(position2)), strand2, len(position1), 0 if bamN is not None else "NA"]) # 0 will be the count in normal
-							else: translocations[key1][key2] = [ [key1, str(min(position1)), str(max(position1)), strand1, key2, str(min(position2)), str(max(position2)), strand2, len(position1), 0 if bamN is not None else "NA"] ]
-					
-						position1 = [int(item[0])]
-						strand1 = item[1]
-						position2 = [int(item[2])]
-						strand2 = item[3]
-						
-			# if no more positions in second chrom, end iteration and reset:
-			if len(position1) >= mntonco:
-				if key2 in translocations[key1]: translocations[key1][key2].append([key1, str(min(position1)), str(max(position1)), strand1, key2, str(min(position2)), str(max(position2)), strand2, len(position1), 0 if bamN is not None else "NA"])
-				else: translocations[key1][key2] = [ [key1, str(min(position1)), str(max(position1)), strand1, key2, str(min(position2)), str(max(position2)), strand2, len(position1), 0 if bamN is not None else "NA"] ]
-				
-				position1 = list()
-				strand1 = ""
-				position2 = list()
-				strand2 = ""
-	
+		for key2 in sorted(dicForTranslocations[key1], key=chroms.index):
+			clusters = clusterOneReadEvents(*dicForTranslocations[key1].pop(key2), mntonco) # one-read events of each pair released once merged
+			if clusters:
+				translocations[key1][key2] = [[key1, str(minIn), str(maxIn), strandIn, key2, str(minOut), str(maxOut), strandOut, score, 0 if readsN is not None else "NA"] for minIn, maxIn, strandIn, minOut, maxOut, strandOut, score in clusters] # 0 will be the count in normal
+
 	# 3. Annotate in normal
-	if bamN is not None:
-		samfile = open(samN, "r")
-		for i in samfile:
-			
-			w = i.rstrip("\n").split("\t")
-			sa=[]
-			for x in (w[11:]): # get SA:... after qualities
-				if x.startswith("SA:Z"):
-					sa.append(x)
-			if len(sa) != 0: w = w[:10]+[sa[0]]
-			else: w = w[:10]+["NA"]
-			
-			if w[5] != "*" and w[6] in chroms: 
-				if w[6] == "=":
-					if abs(int(w[3]) - int(w[7])) > 8000: # 8000 instead of 10000 just to be more permessive in the normal...
-						if w[2] == chrom+"14" and int(w[7]) >= int(chrom14[0]) and int(w[7]) <= int(chrom14[1]): continue
-						elif w[2] == chrom+"22" and int(w[7]) >= int(chrom22[0]) and int(w[7]) <= int(chrom22[1]): continue
-						elif w[2] == chrom+"2" and int(w[7]) >= int(chrom2[0]) and int(w[7]) <= int(chrom2[1]): continue
-					else: continue
-				
-				flgBin = flagToCustomBinary(w[1])
-				split1 = re.findall(r'[A-Za-z]|[0-9]+', w[5])
-				two1 = [split1[x:x+2] for x in range(0, len(split1),2)]
-				
-				inChrom =  w[2]
-				posInChrom = int(w[3])
-				strandInChrom = "-" if "1" == flgBin[4] else "+"
-				if strandInChrom == "+": posInChrom = posInChrom + sum([int(i[0]) for i in two1 if "M" in i or "D" in i]) - 1
-				
-				# if split, get second break from split:
-				strandOutChrom = "-" if "1" == flgBin[5] else "+"
-				if w[10].startswith("SA:Z") and w[10].split(":")[2].split(",")[0] in chroms:
-					outChrom = w[10].split(":")[2].split(",")[0]
-					posOutChrom = int(w[10].split(":")[2].split(",")[1])
-					strandOutChromSA = w[10].split(":")[2].split(",")[2]
-					if strandOutChromSA == "-":
-						split1 = re.findall(r'[A-Za-z]|[0-9]+', w[10].split(":")[2].split(",")[3])
-						two1 = [split1[x:x+2] for x in range(0, len(split1),2)]
-						posOutChrom = posOutChrom + sum([int(i[0]) for i in two1 if "M" in i or "D" in i]) - 1
-				else: # else, get from insertsize
-					outChrom = w[6].replace("=", inChrom)
-					posOutChrom = int(w[7])
-				
-				if outChrom not in translocations[inChrom]: continue
-				for trans in translocations[inChrom][outChrom]:
-					if trans[0] == inChrom and int(trans[1])-1000 <= posInChrom and int(trans[2])+1000 >= posInChrom and trans[3] == strandInChrom and trans[4] == outChrom and int(trans[5])-1000 <= posOutChrom and int(trans[6])+1000 >= posOutChrom and trans[7] == strandOutChrom:
-						trans[9] = trans[9]+1
-		
-		samfile.close()
-		subprocess.call("rm "+samN, shell=True)	
+	if readsN is not None:
+		candidateIndex = translocationIndex(translocations, 1000)
+		for inChrom, posInChrom, strandInChrom, outChrom, posOutChrom, strandOutChrom in events[1]:
+			for trans in candidatesAt(candidateIndex, inChrom, outChrom, posInChrom):
+				if trans[3] == strandInChrom and int(trans[5])-1000 <= posOutChrom and int(trans[6])+1000 >= posOutChrom and trans[7] == strandOutChrom:
+					trans[9] = trans[9]+1
+
 	
 	# 4. Prepare output, annotate RepeatMasker and GeneID, and return
 	mask_expand = 20
-	if genomeVersion == "hg19":
-		RepeatMasker_dicti = pickle.load(gzip.open(inputsFolder+'/hg19/dicts/RepeatMasker_rmsk_hg19_dictionary.pkl.gz', 'rb'))
-		GeneID_dicti = pickle.load(gzip.open(inputsFolder+'/hg19/dicts/NCBI_RefSeq_All_hg19_dictionary.pkl.gz', 'rb'))
-	else:
-		RepeatMasker_dicti = pickle.load(gzip.open(inputsFolder+'/hg38/dicts/RepeatMasker_rmsk_hg38_dictionary.pkl.gz', 'rb'))
-		GeneID_dicti = pickle.load(gzip.open(inputsFolder+'/hg38/dicts/NCBI_RefSeq_All_hg38_dictionary.pkl.gz', 'rb'))
-
 	translocationsList = []
 	for key1 in translocations:
 		for key2 in translocations[key1]:
 			for item in translocations[key1][key2]: 
 				translocationsList.append(item)
 	
+	if len(translocationsList) > 0: # annotations only opened if needed
+		RepeatMasker_index = loadAnnotation(annotationFiles(inputsFolder, genomeVersion)["RepeatMasker"])
+		GeneID_index = loadAnnotation(annotationFiles(inputsFolder, genomeVersion)["GeneID"])
+	
 	translocationsList = sorted(translocationsList, key=operator.itemgetter(8), reverse=True)
 	translocationsALL = list()
 	translocationsPASS = list()
@@ -2043,50 +2594,26 @@ def getIgTranslocations(genomeVersion, inputsFolder, pathToSamtools, threadsForS
 		elif chrA == chrom+"22" and int(positionA) >= int(chrom22[0]) and int(positionA) <= int(chrom22[1]): geneID = "IGL"
 		elif chrA == chrom+"2" and int(positionA) >= int(chrom2[0]) and int(positionA) <= int(chrom2[1]): geneID = "IGK"
 		else:
-			gene = ""
-			minDistance = 250000
-			for element in GeneID_dicti[chrA.replace("chr","")]:
-				if ( int(positionA) >= int(element[0]) and int(positionA) <= int(element[1]) ) or abs(int(positionA) - int(element[0])) < minDistance or abs(int(positionA) - int(element[1])) < minDistance:
-					gene = element[2]
-					if int(positionA) >= int(element[0]) and int(positionA) <= int(element[1]): 
-						minDistance = 0
-						break
-					else: 
-						minDistance = abs(int(positionA) - int(element[0])) if abs(int(positionA) - int(element[0])) < abs(int(positionA) - int(element[1])) else abs(int(positionA) - int(element[1]))
+			gene, minDistance = nearestGene(GeneID_index[chrA.replace("chr","")], int(positionA), 250000)
 			if gene.startswith("IGHV"): repeatMasker = "IGHV_pseudogene"
 			if gene.startswith("IGHD"): repeatMasker = "IGHD_pseudogene"
 			geneID = gene if gene != "" else "none"
 			minDistance = minDistance if minDistance < 250000 else "NA"
 			
-			for element in RepeatMasker_dicti[chrA.replace("chr","")]:
-				if int(positionA) >= int(element[0]) - mask_expand and int(positionA) <= int(element[1]) + mask_expand:
-					repeatMasker = element[2]
-					break
+			repeatMasker = repeatAt(RepeatMasker_index[chrA.replace("chr","")], int(positionA), mask_expand, repeatMasker)
 		
 		if chrB == chrom+"14" and int(positionB) >= int(chrom14[0]) and int(positionB) <= int(chrom14[1]): geneID = geneID+" - IGH"
 		elif chrB == chrom+"22" and int(positionB) >= int(chrom22[0]) and int(positionB) <= int(chrom22[1]): geneID = geneID+" - IGL"
 		elif chrB == chrom+"2" and int(positionB) >= int(chrom2[0]) and int(positionB) <= int(chrom2[1]): geneID = geneID+" - IGK"
 		else:
-			gene = ""
-			minDistance = 250000
-			for element in GeneID_dicti[chrB.replace("chr","")]:
-				if ( int(positionB) >= int(element[0]) and int(positionB) <= int(element[1]) ) or abs(int(positionB) - int(element[0])) < minDistance or abs(int(positionB) - int(element[1])) < minDistance:
-					gene = element[2]
-					if int(positionB) >= int(element[0]) and int(positionB) <= int(element[1]):
-						minDistance = 0
-						break
-					else:
-						minDistance = abs(int(positionB) - int(element[0])) if abs(int(positionB) - int(element[0])) < abs(int(positionB) - int(element[1])) else abs(int(positionB) - int(element[1]))
+			gene, minDistance = nearestGene(GeneID_index[chrB.replace("chr","")], int(positionB), 250000)
 			gene = gene if gene != "" else "none"
 			if gene.startswith("IGHV"): repeatMasker = "IGHV_pseudogene"
 			if gene.startswith("IGHD"): repeatMasker = "IGHD_pseudogene"
 			geneID = geneID+" - "+gene
 			minDistance = minDistance if minDistance < 250000 else "NA"
 			
-			for element in RepeatMasker_dicti[chrB.replace("chr","")]:
-				if int(positionB) >= int(element[0]) - mask_expand and int(positionB) <= int(element[1]) + mask_expand:
-					repeatMasker = element[2]
-					break
+			repeatMasker = repeatAt(RepeatMasker_index[chrB.replace("chr","")], int(positionB), mask_expand, repeatMasker)
 		
 		translocationsALL.append("\t".join([traAnnot, mechanism, str(score), str(scoreNormal), repeatMasker, chrA, positionA, strandA, chrB, positionB, strandB, geneID, str(minDistance)]))
 	
@@ -2097,3 +2624,427 @@ def getIgTranslocations(genomeVersion, inputsFolder, pathToSamtools, threadsForS
 			translocationsPASS.append("\t".join(["Oncogenic IG rearrangement", traAnnot, mechanism, str(score)+" ("+str(scoreNormal)+") ["+repeatMasker+"]"]+["NA"]*6))
 	
 	return(translocationsALL, translocationsPASS)
+
+def analyseIgLocus(GENE, chromGene, bedIndex, dGenes, bamT, bamN, miniBamT, miniBamN, refGenome, baseq, depth, altDepth, tumorPurity, vafCutoff, vafCutoffNormal, seq, alignmentEngine, pathToSamtools, threadsForSamtools, dumpEvidenceTables, minReductionCSR, maxPvalueCSR, outputPrefix):
+	# steps 3-14 for one IG locus: intermediate files are named after the locus mini BAM so that loci can be analysed simultaneously (-j). 
+	# Writes the output table of the locus (outputPrefix_output_GENE.tsv, none if outputPrefix is None) and returns its lines for the summary file
+	print("IgCaller: %s..." %GENE)
+	mark = metricsMark() # -met yes: resources and counts of each step (see metricsStep)
+	
+	# 3) Convert reads to annotated table (kept in memory, shared by steps 4-12):
+	## Stream reads from the mini BAM, get columns of interest and anotate read with large insert size (insertSize) and split/soft clipped (split) reads 
+	store = checkpoint("convertSamToAnnotatedTable_"+GENE, [bamKey(miniBamT), chromGene, GENE], convertSamToAnnotatedTable, alignmentRecords(miniBamT, alignmentEngine, pathToSamtools, threadsForSamtools), chromGene, GENE)
+	annot_table = list(store.values())
+	if dumpEvidenceTables == "yes": writeEvidenceTable(annot_table, miniBamT.replace("_miniBam.bam", "_splitinsert.tsv"))
+	mark = metricsStep(GENE, "3", "read evidence table", mark, {"evidence_rows": len(annot_table)})
+	
+	# 4) Find the J and V genes corresponding to each split/insert size position:
+	annot_table_JV = findJandVgenes(annot_table, bedIndex, GENE)
+	if dumpEvidenceTables == "yes": writeEvidenceTable(annot_table_JV, miniBamT.replace("_miniBam.bam", "_splitinsert_VJ.tsv"))
+	mark = metricsStep(GENE, "4", "J and V genes", mark, {"evidence_rows": len(annot_table_JV)})
+	
+	# 5) Find combinations of J-V:
+	l = findCombinationsJandV(annot_table_JV, GENE)
+	mark = metricsStep(GENE, "5", "J-V combinations", mark, {"candidates": len(l)})
+	
+	# 6) Assign positions/breaks to each J and V pairs:
+	evidenceIndex = indexEvidenceTable(annot_table_JV) # one pass, for the lookups of steps 6, 9 and 12
+	VJ_positions, data, pos = assignPositionsToJandV(l, evidenceIndex)
+	mark = metricsStep(GENE, "6", "J-V breaks", mark, {"evidence_rows": len(annot_table_JV), "candidates": len(data)})
+	
+	if GENE != "CSR":
+		# 7) Append to list V,J positions and number of occurrences:
+		information = addPositionsAndOccurrences(pos, bedIndex, data)
+		mark = metricsStep(GENE, "7", "positions and occurrences", mark, {"candidates": len(information)})
+		
+		# 8) Get J and V sequences:
+		information = getJandVsequences(information, GENE, refGenome, baseq, chromGene, bamN, miniBamT, miniBamN, depth, altDepth, tumorPurity, vafCutoff, vafCutoffNormal, pathToSamtools, alignmentEngine)
+		mark = metricsStep(GENE, "8", "J and V sequences", mark, {"candidates": len(information)})
+		
+		# 9) Get D sequences (IGH = N-D-N, IGK/IGL = N):
+		information = getDsequence(information, evidenceIndex, GENE, dGenes)
+		mark = metricsStep(GENE, "9", "D sequences", mark, {"candidates": len(information)})
+		
+		# 10) Check homology and functionality (productive/unproductive):
+		information = checkHomologyAndFunctionality(information, GENE)
+		mark = metricsStep(GENE, "10", "homology and functionality", mark, {"candidates": len(information)})
+		
+		# 11) Pre-defined filter:
+		trip = predefinedFilter(information, GENE, tumorPurity, seq)
+		mark = metricsStep(GENE, "11", "pre-defined filter", mark, {"candidates": len(information), "passing": len(trip)})
+		
+		# 12) Add mapping quality and calculate score in information:
+		information, trip = addMapQualAndScore(information, trip, GENE, evidenceIndex)
+		mark = metricsStep(GENE, "12", "mapping quality and score", mark, {"candidates": len(information), "passing": len(trip)})
+
+		# 13) Save output:
+		if outputPrefix is not None:
+			Vseq = open(outputPrefix+"_output_"+GENE+".tsv", "w")
+			Vseq.write("Genes\tMechanisms\tN_split\tN_insertSize\tStart_J\tEnd_J\tN_split_rescued_J\tStart_V\tEnd_V\tN_split_rescued_V\tSeq_J\tSeq_D\tSeq_V\tSeq_V_normal\tSeq\tV-gene_pct_identity_to_germline\tLength_considered_identity\tFunctionality\tJunction_amino_acid_sequence\tScore\tMQ\n")
+			Vseq.write("\n".join(['\t'.join(map(str, item)) for item in information]))		
+			Vseq.close()
+		metricsStep(GENE, "13", "output", mark)
+		
+		if len(trip) != 0:
+			return("\n".join([GENE+"\t"+item+"\t"+'\t'.join(map(str, map(trip[item].__getitem__, [0,1,19,15,16,17,18,14]))) for item in trip])+"\n")
+		else:
+			return(GENE+"\tNo rearrangement found"+"\tNA"*8+"\n")
+	
+	else:
+		# 14) Study coverage around CSR and return info
+		class_switch, class_switch_filt, reductionMeans = classSwitchAnalysis(data, bedIndex, baseq, chromGene, bamT, bamN, pathToSamtools, tumorPurity, alignmentEngine, minReductionCSR, maxPvalueCSR)
+		
+		if outputPrefix is not None:
+			Vseq = open(outputPrefix+"_output_"+GENE+".tsv", "w")
+			Vseq.write("Genes\tClass\tScore\tAdjusted_mean_pre_break\tAdjusted_mean_post_break\tPvalue\tPct_reduction_adjusted_means\n")
+			if len(class_switch) > 0:
+				Vseq.write("\n".join(['\t'.join(map(str, item)) for item in class_switch])+"\n")					
+			Vseq.close()
+		metricsStep(GENE, "14", "class switch coverage", mark, {"candidates": len(data), "passing": len(class_switch_filt)})
+		
+		if len(class_switch_filt) == 0:
+			return("CSR\tIGHM\tNo CSR found"+"\tNA"*7+"\n")
+		else:
+			class_switch_filt = class_switch_filt[reductionMeans.index(max(reductionMeans))] # keep only the one with highest reduction
+			#class_switch_filt = class_switch_filt[pvals.index(min(pvals))]
+			return("\t".join(["CSR", class_switch_filt[0], class_switch_filt[1], str(class_switch_filt[2])]+["NA"]*6)+"\n")
+
+def analyseOncogenicIgRearrangements(genomeVersion, inputsFolder, bamT, bamN, chrom, coordsToSubset, tumorPurity, mntonco, mntoncoPass, mnnonco, mapqOnco, alignmentEngine, pathToSamtools, threadsForSamtools, outputPrefix):
+	# step 15: writes the oncogenic IG rearrangements table (none if outputPrefix is None) and returns the lines for the summary file
+	print("IgCaller: genome-wide IG rearrangements...")
+	mark = metricsMark()
+	readsT = alignmentRecords(bamT, alignmentEngine, pathToSamtools, threadsForSamtools, mapqOnco)
+	readsN = None if bamN is None else alignmentRecords(bamN, alignmentEngine, pathToSamtools, threadsForSamtools, mapqOnco)
+	translocationsALL, translocationsPASS = getIgTranslocations(genomeVersion, inputsFolder, readsT, readsN, chrom, coordsToSubset, tumorPurity, mntonco, mntoncoPass, mnnonco, [[bamKey(bamT), mapqOnco], None if bamN is None else [bamKey(bamN), mapqOnco]])
+	
+	if outputPrefix is not None:
+		Vseq = open(outputPrefix+"_output_oncogenic_IG_rearrangements.tsv", "w")
+		Vseq.write("\n".join(translocationsALL))		
+		Vseq.close()
+	metricsStep("oncogenic IG rearrangements", "15", "genome-wide IG rearrangements", mark, {"candidates": len(translocationsALL), "passing": len(translocationsPASS)})
+	
+	if len(translocationsPASS) > 0: return("\n".join(translocationsPASS))
+	else: return("Oncogenic IG rearrangement\tNo rearrangements found"+"\tNA"*8+"\n")
+
+def prepareSample(reference, settings, originalBamT, originalBamN, outputPath):
+	# steps 1-2 for one tumor (and normal) sample: output folder ("tumorSample"_IgCaller inside outputPath, current directory if None), stage checkpoints (-ckp yes) and IG and mini IG-locus-specific BAM files. 
+	# Returns [output folder, IG BAM files (tumor, normal or None), {GENE: [BED intervals, mini BAM]} (tumor, normal) and start of the run (see cleanSample)]
+	
+	## check normal BAM or reference is available
+	if originalBamN is None and settings["refGenome"] is None:
+		sys.exit("IgCaller: error message... Normal BAM file and/or reference genome must be supplied using -N and -R, resepctively.")
+	
+	## Performance metrics (-met yes), see writeMetrics:
+	metricsState["enabled"] = settings["metrics"] == "yes"
+	metricsState["steps"] = []
+	metricsState["start"] = metricsMark()
+	if settings["trace"] == "yes": enableTracing() # Chrome trace events, see writeTrace
+	
+	## Output folder:
+	if outputPath is None:  wkDir = originalBamT.split("/")[-1].replace(".bam", "_IgCaller")
+	else: wkDir = outputPath+"/"+originalBamT.split("/")[-1].replace(".bam", "_IgCaller")
+	if not os.path.exists(wkDir): os.mkdir(wkDir)
+	
+	## Stage checkpoints (-ckp yes), inside the output folder:
+	runStart = None
+	checkpointState["folder"] = None
+	checkpointState["keys"] = {}
+	if settings["checkpoints"] == "yes":
+		checkpointState["folder"] = wkDir+"/checkpoints"
+		if not os.path.exists(checkpointState["folder"]): os.mkdir(checkpointState["folder"])
+		open(checkpointState["folder"]+"/run.start", "w").close()
+		runStart = os.path.getmtime(checkpointState["folder"]+"/run.start") # file system clock, as the checkpoint modification times (see cleanCheckpoints)
+	
+	## IG loci info and mini IG-locus-specific files:
+	GENES = ["IGH", "IGK", "IGL", "CSR"]
+	bamT = wkDir+"/"+originalBamT.split("/")[-1]
+	bamN = None if originalBamN is None else wkDir+"/"+originalBamN.split("/")[-1]
+	lociT = {}
+	lociN = {}
+	for GENE in GENES:
+		lociT[GENE] = [reference["loci"][GENE]["intervals"], bamT.replace(".bam", "_"+GENE+"_miniBam.bam")]
+		if bamN is not None: lociN[GENE] = [reference["loci"][GENE]["intervals"], bamN.replace(".bam", "_"+GENE+"_miniBam.bam")]
+	
+	## Create IG-bam and mini IG-locus-specific-BAMs for tumor and normal (if available) in a single pass over each input BAM, both samples at the same time:
+	## (kept from a previous run if extracted from the same input BAM with the same parameters, -ckp yes)
+	calls = []
+	extracted = []
+	for originalBam, bam, loci in [[originalBamT, bamT, lociT]]+([] if bamN is None else [[originalBamN, bamN, lociN]]):
+		key = checkpointKey("extractIgLoci", fileIdentity(originalBam), reference["coordsToSubset"], settings["mapq"], [[GENE, loci[GENE][0]] for GENE in GENES])
+		checkpointState["keys"][bam] = key
+		for GENE in GENES: checkpointState["keys"][loci[GENE][1]] = checkpointKey(key, GENE)
+		if extractionCurrent(bam, loci, key): continue
+		if checkpointState["folder"] is not None and os.path.isfile(checkpointState["folder"]+"/"+os.path.basename(bam)+".key"): os.remove(checkpointState["folder"]+"/"+os.path.basename(bam)+".key")
+		calls.append([extractIgLoci, originalBam, bam, loci, reference["coordsToSubset"], settings["mapq"], settings["alignmentEngine"], settings["pathToSamtools"], settings["threadsForSamtools"]]) #-F 3328 (not primary alignment, supplementary alignment, read is PCR or optical duplicate)
+		extracted.append([bam, key])
+	mark = metricsMark()
+	if len(calls) > 0:
+		print("IgCaller: creating IG BAM files...")
+		runConcurrently(calls)
+	else: print("IgCaller: IG BAM files up to date (checkpoints)...")
+	metricsStep("sample", "1-2", "IG and mini BAM files", mark, {"samples_extracted": len(calls)})
+	if checkpointState["folder"] is not None:
+		for bam, key in extracted:
+			KEY = open(checkpointState["folder"]+"/"+os.path.basename(bam)+".key", "w")
+			KEY.write(key+"\n")
+			KEY.close()
+	
+	return(wkDir, bamT, bamN, lociT, lociN, runStart)
+
+def sampleStages(reference, settings, bamT, bamN, lociT, lociN, tumorPurity, seq, outputPrefix):
+	# steps 3-15 of a prepared sample (see prepareSample) as {stage: [function, arg1, arg2...]}, stages named as in stageParameters (IGH, IGK, IGL, CSR, oncogenic IG rearrangements, in this order)
+	stages = {}
+	for GENE in ["IGH", "IGK", "IGL", "CSR"]:
+		locus = reference["loci"][GENE]
+		stages[GENE] = [analyseIgLocus, GENE, locus["chromGene"], locus["bedIndex"], locus["dGenes"], bamT, bamN, lociT[GENE][1], lociN[GENE][1] if bamN is not None else None, settings["refGenome"], settings["baseq"], settings["depth"], settings["altDepth"], tumorPurity, settings["vafCutoff"], settings["vafCutoffNormal"], seq, settings["alignmentEngine"], settings["pathToSamtools"], settings["threadsForSamtools"], settings["dumpEvidenceTables"], settings["minReductionCSR"], settings["maxPvalueCSR"], outputPrefix]
+	stages["oncogenic"] = [analyseOncogenicIgRearrangements, reference["genomeVersion"], settings["inputsFolder"], bamT, bamN, "" if reference["chrAnnot"] == "ensembl" else "chr", reference["coordsToSubset"], tumorPurity, settings["mntonco"], settings["mntoncoPass"], settings["mnnonco"], settings["mapqOnco"], settings["alignmentEngine"], settings["pathToSamtools"], settings["threadsForSamtools"], outputPrefix]
+	return(stages)
+
+def runStages(stages, jobs):
+	# run [function, arg1, arg2...] stages in a pool of jobs processes (in this process if jobs = 1) and return their results in the same order
+	if jobs > 1 and len(stages) > 1:
+		POOL = multiprocessing.get_context("fork").Pool(min(jobs, len(stages))) # fork: workers inherit the IgCaller functions imported from inputsFolder
+		running = [POOL.apply_async(stage[0], stage[1:]) for stage in stages]
+		results = [r.get() for r in running]
+		POOL.close()
+		POOL.join()
+	else:
+		results = [stage[0](*stage[1:]) for stage in stages]
+	return(results)
+
+def cleanSample(settings, wkDir, runStart):
+	# 16) Clean intermediate files (IG and mini BAM files are kept with the checkpoints, -ckp yes)
+	mark = metricsMark()
+	if checkpointState["folder"] is None: comms = "rm -f "+wkDir+"/*miniBam.bam "+wkDir+"/*miniBam.bam.bai "+wkDir+"/*_output_mpileup.tsv "+wkDir+"/*_output_mpileup.bed"
+	else: comms = "rm -f "+wkDir+"/*_output_mpileup.tsv "+wkDir+"/*_output_mpileup.bed"
+	subprocess.call(comms, shell=True)
+	if checkpointState["folder"] is not None: cleanCheckpoints(checkpointState["folder"], runStart)
+	elif settings["keepMiniIgBams"] != "yes":
+		comms = "rm "+wkDir+"/*.bam "+wkDir+"/*.bam.bai"  
+		subprocess.call(comms, shell=True)
+	metricsStep("sample", "16", "clean intermediate files", mark)
+
+def analyseSample(reference, settings, originalBamT, originalBamN, tumorPurity, seq, outputPath):
+	# steps 1-16 for one tumor (and normal) sample with the compiled reference (see loadReference) and the analysis settings of the command line (see IgCaller_v1.1.py): 
+	# writes the output files to the "tumorSample"_IgCaller folder inside outputPath (current directory if None) and returns this folder
+	wkDir, bamT, bamN, lociT, lociN, runStart = prepareSample(reference, settings, originalBamT, originalBamN, outputPath)
+	
+	# Analyse each IG locus (steps 3-14) and the genome-wide IG rearrangements (step 15), in parallel if -j > 1:
+	stages = sampleStages(reference, settings, bamT, bamN, lociT, lociN, tumorPurity, seq, bamT.replace(".bam", ""))
+	if metricsState["enabled"] or traceState["enabled"]:
+		results = runStages([[measuredStage, name]+stage for name, stage in stages.items()], settings["jobs"])
+		summary = [result[0] for result in results]
+		for result in results:
+			metricsState["steps"].extend(result[1])
+			traceState["events"].extend(result[2])
+	else: summary = runStages(list(stages.values()), settings["jobs"])
+	
+	## Main output file, in canonical order (IGH, IGK, IGL, CSR, oncogenic IG rearrangements):
+	SUMM = open(wkDir+"/"+originalBamT.split("/")[-1].replace(".bam", "_output_filtered.tsv"), "w")
+	SUMM.write(summaryHeader)
+	SUMM.write("".join(summary))
+	SUMM.close()
+	
+	cleanSample(settings, wkDir, runStart)
+	if metricsState["enabled"]: writeMetrics(wkDir+"/"+originalBamT.split("/")[-1].replace(".bam", "_output_metrics.json"), originalBamT, originalBamN, settings, metricsState["steps"])
+	if traceState["enabled"]: writeTrace(wkDir+"/"+originalBamT.split("/")[-1].replace(".bam", "_output_trace.json"), traceState["events"])
+	return(wkDir)
+
+def sweepSample(reference, settings, grid, originalBamT, originalBamN, seq, outputPath):
+	# IgCaller sweep: steps 1-16 for one sample and every combination of the grid values {setting: [values]} (see sweepParameters). IG BAM files, read evidence and pileups are computed once 
+	# and shared through the checkpoints (see checkpoint), then each stage is run once per distinct combination of the settings it depends on (see stageParameters), in parallel if -j > 1. 
+	# Writes the calls of every combination to "tumorSample"_output_sweep.tsv (one line per combination and summary line) and returns the output folder
+	wkDir, bamT, bamN, lociT, lociN, runStart = prepareSample(reference, settings, originalBamT, originalBamN, outputPath)
+	
+	points = []
+	for values in itertools.product(*[grid[setting] for setting in sweepParameters]):
+		points.append(dict(zip(sweepParameters, values)))
+	
+	## distinct stage runs: the first combination first (it computes the shared evidence and pileups), then all other runs at the same time
+	runs = {}
+	for point in points:
+		stages = sampleStages(reference, dict(settings, **point), bamT, bamN, lociT, lociN, point["tumorPurity"], seq, None)
+		for stage in stages:
+			key = (stage,)+tuple(point[setting] for setting in stageParameters[stage])
+			if key not in runs: runs[key] = stages[stage]
+	first = list(runs)[:len(stageParameters)]
+	others = list(runs)[len(stageParameters):]
+	print("IgCaller: %s settings, %s stage runs..." %(len(points), len(runs)))
+	results = {}
+	for keys in [first, others]:
+		for key, result in zip(keys, runStages([[measuredStage, " ".join(map(str, key))]+runs[key] for key in keys], settings["jobs"])):
+			results[key] = result[0]
+			for step in result[1]: step["settings"] = dict(zip(stageParameters[key[0]], key[1:])) # -met yes: steps of each stage run
+			metricsState["steps"].extend(result[1])
+			traceState["events"].extend(result[2])
+	
+	## Sweep output file: settings of each combination followed by its summary lines (see analyseSample)
+	SWEEP = open(wkDir+"/"+originalBamT.split("/")[-1].replace(".bam", "_output_sweep.tsv"), "w")
+	SWEEP.write("Setting\t"+"\t".join(sweepParameters)+"\t"+summaryHeader)
+	for n, point in enumerate(points):
+		for stage in stageParameters:
+			for line in results[(stage,)+tuple(point[setting] for setting in stageParameters[stage])].rstrip("\n").split("\n"):
+				SWEEP.write("\t".join([str(n+1)]+[str(point[setting]) for setting in sweepParameters]+[line])+"\n")
+	SWEEP.close()
+	
+	cleanSample(settings, wkDir, runStart)
+	if metricsState["enabled"]: writeMetrics(wkDir+"/"+originalBamT.split("/")[-1].replace(".bam", "_output_metrics.json"), originalBamT, originalBamN, settings, metricsState["steps"])
+	if traceState["enabled"]: writeTrace(wkDir+"/"+originalBamT.split("/")[-1].replace(".bam", "_output_trace.json"), traceState["events"])
+	return(wkDir)
+
+def readBatchManifest(manifestFile):
+	# samples of IgCaller batch: tab-separated sample name, tumor BAM and, optionally, normal BAM, tumor purity and sequencing technique (NA or empty = none/command line values). Empty lines, lines starting with # and a header line starting with "sample" are skipped
+	samples = []
+	MANIFEST = open(manifestFile, "r")
+	for n, line in enumerate(MANIFEST):
+		w = line.rstrip("\n").split("\t")
+		if line.strip() == "" or w[0].startswith("#") or (n == 0 and w[0].lower() == "sample"): continue
+		w = [None if x in ["", "NA"] else x for x in (w+[""]*5)[:5]]
+		if w[0] is None or w[1] is None: sys.exit("IgCaller: error message... line "+str(n+1)+" of "+manifestFile+" has no sample name and/or tumor BAM file.")
+		samples.append(w)
+	MANIFEST.close()
+	
+	names = [s[0] for s in samples]
+	if len(set(names)) < len(names): sys.exit("IgCaller: error message... sample names in "+manifestFile+" must be unique (they name the output folders).")
+	return(samples)
+
+def highConfidenceCalls(summaryLines):
+	# number of rearrangements in the lines of a main output file (see analyseSample): header and no-call lines ("No rearrangement found", "No CSR found" in the mechanism column, "No rearrangements found") are not counted
+	return(len([line for line in summaryLines if not line.startswith("Analysis\t") and line.strip() != "" and not any(column.startswith("No ") for column in line.split("\t")[1:3])]))
+
+def analyseBatchSample(reference, settings, sample, outputPath):
+	# one sample of IgCaller batch, in its own output folder (outputPath/sample): failures (including IgCaller errors) are reported instead of raised, so that they do not stop the other samples. 
+	# Returns [sample, status, number of high confidence rearrangements, runtime (seconds), output folder, error]
+	name, originalBamT, originalBamN, tumorPurity, seq = sample
+	print("IgCaller: sample %s..." %name)
+	start = time.time()
+	try:
+		tumorPurity = settings["tumorPurity"] if tumorPurity is None else float(tumorPurity)
+		seq = settings["seq"] if seq is None else seq
+		if not os.path.exists(outputPath+"/"+name): os.mkdir(outputPath+"/"+name)
+		wkDir = analyseSample(reference, settings, originalBamT, originalBamN, tumorPurity, seq, outputPath+"/"+name)
+		
+		SUMM = open(wkDir+"/"+originalBamT.split("/")[-1].replace(".bam", "_output_filtered.tsv"), "r")
+		rearrangements = highConfidenceCalls(SUMM)
+		SUMM.close()
+		result = [name, "done", str(rearrangements), "%.1f" %(time.time()-start), wkDir, "NA"]
+	except (Exception, SystemExit) as e:
+		result = [name, "failed", "NA", "%.1f" %(time.time()-start), outputPath+"/"+name, (str(e) or type(e).__name__).replace("\t", " ").replace("\n", " ")]
+	
+	print("IgCaller: sample %s %s" %(name, result[1]))
+	sys.stdout.flush()
+	return(result)
+
+def analyseBatch(reference, settings, samples, outputPath, jobs):
+	# IgCaller batch: samples analysed by a pool of jobs processes forked once the reference and the GeneID/RepeatMasker annotations are loaded, so that they are shared by all samples.
+	# Writes IgCaller_batch_summary.tsv (one line per sample, in manifest order) to outputPath and returns the number of failed samples
+	for dictFile in annotationFiles(settings["inputsFolder"], reference["genomeVersion"]).values():
+		if os.path.isfile(dictFile) or os.path.isfile(os.path.join(annotationStoreFolder(dictFile), "chroms.tsv")): loadAnnotation(dictFile)
+	
+	sys.stdout.flush() # not to be repeated by the forked processes
+	if jobs > 1:
+		POOL = multiprocessing.get_context("fork").Pool(min(jobs, len(samples)))
+		running = [POOL.apply_async(analyseBatchSample, [reference, settings, sample, outputPath]) for sample in samples]
+		results = [r.get() for r in running]
+		POOL.close()
+		POOL.join()
+	else:
+		results = [analyseBatchSample(reference, settings, sample, outputPath) for sample in samples]
+	
+	SUMM = open(outputPath+"/IgCaller_batch_summary.tsv", "w")
+	SUMM.write("Sample\tStatus\tHigh_confidence_rearrangements\tRuntime_seconds\tOutput_folder\tError\n")
+	for result in results: SUMM.write("\t".join(result)+"\n")
+	SUMM.close()
+	return(len([result for result in results if result[1] != "done"]))
+
+def loadServedReferences(inputsFolder):
+	# IgCaller serve: compiled references of every genome version and chromosome annotation, and their GeneID/RepeatMasker annotations, loaded once (see loadReference and loadAnnotation) so that the jobs inherit them
+	for genomeVersion in igLociRegions:
+		for chrAnnot in ["ensembl", "ucsc"]:
+			try:
+				loadReference(inputsFolder, genomeVersion, chrAnnot)
+				print("IgCaller: %s %s reference loaded" %(genomeVersion, chrAnnot))
+			except (Exception, SystemExit) as e:
+				print("IgCaller: %s %s reference not loaded (%s)" %(genomeVersion, chrAnnot, e))
+		for dictFile in annotationFiles(inputsFolder, genomeVersion).values():
+			if os.path.isfile(dictFile) or os.path.isfile(os.path.join(annotationStoreFolder(dictFile), "chroms.tsv")):
+				loadAnnotation(dictFile)
+				print("IgCaller: %s loaded" %os.path.basename(dictFile))
+	sys.stdout.flush()
+
+def reapSupervisors(running, maxJobs):
+	# IgCaller serve: remove the finished job supervisors from running (set of pids), waiting for them while maxJobs or more are running
+	while running:
+		try:
+			pid = os.waitpid(-1, 0 if len(running) >= maxJobs else os.WNOHANG)[0]
+		except ChildProcessError: # no supervisors left
+			running.clear()
+			break
+		if pid == 0: break
+		running.discard(pid)
+
+def serveJobs(socketPath, maxJobs):
+	# IgCaller serve: accepts jobs (IgCaller arguments and working directory, as a JSON line sent by IgCaller submit) on a Unix socket. Each job is run by a process forked from the service, so that it starts with everything already loaded,
+	# while a supervisor process streams its output (stdout and stderr) back to the client followed by its exit status. At most maxJobs jobs run at the same time, the next ones wait for one of them to finish.
+	# Returns the arguments of the job, only in the process forked to run it
+	if os.path.exists(socketPath): os.remove(socketPath) # left by a previous service
+	SERVER = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+	umask = os.umask(0o177) # socket only accessible by the user from its creation
+	try:
+		SERVER.bind(socketPath)
+	finally:
+		os.umask(umask)
+	SERVER.listen(16)
+	SERVER.settimeout(5) # finished supervisors are also reaped while no job is submitted
+	print("IgCaller: serving on %s (up to %s jobs at the same time)" %(socketPath, maxJobs))
+	sys.stdout.flush()
+	
+	running = set() # supervisors of the running jobs
+	while True:
+		try:
+			CONN = SERVER.accept()[0]
+			CONN.setblocking(True)
+		except socket.timeout:
+			CONN = None
+		reapSupervisors(running, maxJobs+1) # finished ones
+		if CONN is None: continue
+		if len(running) >= maxJobs:
+			try:
+				CONN.sendall(("IgCaller: waiting for one of the %s running jobs to finish...\n" %len(running)).encode())
+			except OSError:
+				pass # client gone, the job fails when reading its request
+			reapSupervisors(running, maxJobs)
+		
+		pid = os.fork()
+		if pid != 0: # service: next job
+			running.add(pid)
+			CONN.close()
+			continue
+		
+		# supervisor of the job
+		SERVER.close()
+		try:
+			request = json.loads(CONN.makefile("r").readline())
+			jobArgs, jobDir = [str(x) for x in request["argv"]], request["cwd"]
+			if len(jobArgs) > 0 and jobArgs[0] in ["serve", "submit"]: raise ValueError("IgCaller "+jobArgs[0]+" can not be submitted")
+		except (ValueError, KeyError, TypeError) as e:
+			CONN.sendall(("IgCaller: error message... invalid job (%s)\n\0IgCaller-exit-status\t2\n" %e).encode())
+			os._exit(0)
+		
+		pid = os.fork()
+		if pid == 0: # job: output to the client, then back to IgCaller_v1.1.py
+			os.dup2(CONN.fileno(), 1)
+			os.dup2(CONN.fileno(), 2)
+			CONN.close()
+			sys.stdout = os.fdopen(1, "w", buffering=1)
+			sys.stderr = os.fdopen(2, "w", buffering=1)
+			os.chdir(jobDir)
+			return(jobArgs)
+		
+		status = os.waitpid(pid, 0)[1]
+		exitStatus = os.WEXITSTATUS(status) if os.WIFEXITED(status) else 128+os.WTERMSIG(status)
+		try:
+			CONN.sendall(("\0IgCaller-exit-status\t%s\n" %exitStatus).encode())
+		except OSError:
+			pass # client gone
+		os._exit(0)
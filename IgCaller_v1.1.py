@@ -1,10 +1,112 @@
 # Modules
 import argparse
-import subprocess
 import sys
-
-# Manage inputs
-parser  = argparse.ArgumentParser(prog='IgCaller', description='''IgCaller v1.1 (https://github.com/ferrannadeu/IgCaller)''')
+import os
+import tempfile
+
+defaultSocket = os.path.join(tempfile.gettempdir(), "IgCaller_"+str(os.getuid())+".sock") # Unix socket of IgCaller serve and submit
+
+# IgCaller submit: thin client sending the rest of the command line (as for IgCaller, IgCaller batch, IgCaller sweep or IgCaller index) to the IgCaller service and streaming its output back
+if len(sys.argv) > 1 and sys.argv[1] == "submit":
+	import socket
+	import json
+	jobArgs = sys.argv[2:]
+	socketPath = defaultSocket
+	if len(jobArgs) > 1 and jobArgs[0] in ["-s", "--socket"]:
+		socketPath = jobArgs[1]
+		jobArgs = jobArgs[2:]
+	
+	CLIENT = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+	try:
+		CLIENT.connect(socketPath)
+	except OSError:
+		sys.exit("IgCaller: error message... no IgCaller service found at "+socketPath+", start it with IgCaller serve.")
+	CLIENT.sendall((json.dumps({"argv": jobArgs, "cwd": os.getcwd()})+"\n").encode())
+	
+	exitStatus = 1 # if the service stops before the end of the job
+	for line in CLIENT.makefile("rb"):
+		if b"\0IgCaller-exit-status\t" in line:
+			line, status = line.split(b"\0IgCaller-exit-status\t")
+			exitStatus = int(status)
+		sys.stdout.buffer.write(line)
+		sys.stdout.flush()
+	CLIENT.close()
+	sys.exit(exitStatus)
+
+# IgCaller serve: long-running service keeping the interpreter, modules, compiled references and GeneID/RepeatMasker annotations loaded; each job submitted (IgCaller submit) runs the rest of this script in a forked process
+servedInputsFolder = None
+def jobInputsFolder(inputsFolder):
+	# -I of a job run by IgCaller serve: must be the service's inputsFolder, whose IgCaller functions and references are already loaded (returned as loaded by the service)
+	if servedInputsFolder is None: return(inputsFolder)
+	if os.path.abspath(inputsFolder) != servedInputsFolder: sys.exit("IgCaller: error message... this IgCaller service runs the IgCaller functions and references of "+servedInputsFolder+", jobs with -I "+os.path.abspath(inputsFolder)+" must be submitted to another service (IgCaller serve -I "+os.path.abspath(inputsFolder)+" -s other.sock).")
+	return(servedInputsFolder)
+
+if len(sys.argv) > 1 and sys.argv[1] == "serve":
+	serveParser = argparse.ArgumentParser(prog='IgCaller serve', description='''Keeps IgCaller and its references (hg19 and hg38, ensembl and ucsc) loaded and runs the jobs submitted with IgCaller submit, which take the same arguments as IgCaller''')
+	
+	serveParser.add_argument('-I', '--inputsFolder',
+						dest = "inputsFolder",
+						action = "store",
+						required=True,
+						help = "Path to folder containing IgCaller reference files") 
+	
+	serveParser.add_argument('-s', '--socket',
+						dest = "socket",
+						action = "store",
+						default = defaultSocket,
+						help = "Unix socket the service listens on [default=%s]" %defaultSocket) 
+	
+	serveParser.add_argument('-j', '--jobs',
+						dest = "jobs",
+						action = "store",
+						default = str(os.cpu_count() or 1),
+						help = "Maximum number of submitted jobs running at the same time, the next ones wait for one of them to finish [default=number of CPUs]") 
+	
+	serveOptions = serveParser.parse_args(sys.argv[2:])
+	if not serveOptions.jobs.isdigit() or int(serveOptions.jobs) < 1: sys.exit("IgCaller: error message... -j/--jobs of IgCaller serve must be a positive integer.")
+	servedInputsFolder = os.path.abspath(serveOptions.inputsFolder)
+	sys.path.insert(0, servedInputsFolder)
+	from IgCaller_functions_v1_1 import *
+	loadServedReferences(servedInputsFolder)
+	sys.argv = [sys.argv[0]]+serveJobs(serveOptions.socket, int(serveOptions.jobs)) # returns in the process forked for each job
+
+# IgCaller index: validate the reference files of a genome version and chromosome annotation once and compile them into a bundle loaded by every run
+if len(sys.argv) > 1 and sys.argv[1] == "index":
+	indexParser = argparse.ArgumentParser(prog='IgCaller index', description='''Validates the IgCaller reference files of a genome version and chromosome annotation and compiles them (IG regions, BED indexes, D genes and GeneID/RepeatMasker arrays) into a bundle loaded by every run''')
+	
+	indexParser.add_argument('-I', '--inputsFolder',
+						dest = "inputsFolder",
+						action = "store",
+						required=True,
+						help = "Path to folder containing IgCaller reference files") 
+	
+	indexParser.add_argument('-V', '--genomeVersion',
+						dest = "genomeVersion",
+						action = "store",
+						choices=['hg19', 'hg38'],
+						required=True,
+						help = "Reference genome version [hg19, hg38]") 
+	
+	indexParser.add_argument('-C', '--chromosomeAnnotation',
+						dest = "chrAnnot",
+						action = "store",
+						choices=['ensembl', 'ucsc'],
+						required=True,
+						help = "Chromosome annotation [ensembl = without 'chr' (i.e. 1); ucsc = with 'chr' (i.e. chr1)]") 
+	
+	indexOptions = indexParser.parse_args(sys.argv[2:])
+	indexOptions.inputsFolder = jobInputsFolder(indexOptions.inputsFolder)
+	sys.path.insert(0, indexOptions.inputsFolder)
+	from IgCaller_functions_v1_1 import buildReferenceBundle
+	print("IgCaller: validating and compiling %s %s reference files..." %(indexOptions.genomeVersion, indexOptions.chrAnnot))
+	print("IgCaller: reference bundle written to %s" %buildReferenceBundle(indexOptions.inputsFolder, indexOptions.genomeVersion, indexOptions.chrAnnot))
+	sys.exit(0)
+
+# Manage inputs (IgCaller batch: the samples of a manifest instead of -T/-N/-p/-seq; IgCaller sweep: several values of -vaf/-p/-mntoncoPass/-mnnonco/-mrcsr/-mpcsr)
+batchMode = len(sys.argv) > 1 and sys.argv[1] == "batch"
+sweepMode = len(sys.argv) > 1 and sys.argv[1] == "sweep"
+gridNargs = "+" if sweepMode else None
+parser  = argparse.ArgumentParser(prog='IgCaller batch' if batchMode else 'IgCaller sweep' if sweepMode else 'IgCaller', description='''IgCaller v1.1 (https://github.com/ferrannadeu/IgCaller)''')
 
 parser.add_argument('-I', '--inputsFolder',
 					dest = "inputsFolder",
@@ -31,7 +133,7 @@ parser.add_argument('-C', '--chromosomeAnnotation',
 parser.add_argument('-T', '--bamT',
 					dest = "bamT",
 					action = "store",
-					required=True,
+					required=not batchMode,
 					help = "Tumor bam file") 
 
 parser.add_argument('-N', '--bamN',
@@ -91,12 +193,14 @@ parser.add_argument('-vafN', '--vafCutoffNormal',
 parser.add_argument('-vaf', '--vafCutoff',
 					dest = "vafCutoff",
 					action = "store",
+					nargs = gridNargs,
 					default = "0.10",
 					help = "VAF cut off to consider a mutation [0-1, default=0.10]")	
 
 parser.add_argument('-p', '--tumorPurity', 
 					dest = "tumorPurity",
 					action = "store",
+					nargs = gridNargs,
 					default = "1",
 					help = "Purity of the tumor sample (tumor cell contect) [0-1, default=1]") 
 
@@ -109,15 +213,31 @@ parser.add_argument('-mntonco', '--minNumberReadsTumorOncoIg',
 parser.add_argument('-mntoncoPass', '--minNumberReadsTumorOncoIgPass', 
 					dest = "mntoncoPass",
 					action = "store",
+					nargs = gridNargs,
 					default = "10",
 					help = "Minimum score supporting an oncogenic IG rearrangement in order to be considered as high confidence [default=10]")
 
 parser.add_argument('-mnnonco', '--maxNumberReadsNormalOncoIg', 
 					dest = "mnnonco",
 					action = "store",
+					nargs = gridNargs,
 					default = "2",
 					help = "Maximum number of reads supporting an oncogenic IG rearrangement in the normal sample in order to be considered as high confidence [default=2]")
 
+parser.add_argument('-mrcsr', '--minReductionCSR', 
+					dest = "minReductionCSR",
+					action = "store",
+					nargs = gridNargs,
+					default = "30",
+					help = "Minimum reduction of the read depth after the break (%%, adjusted by purity) of a class switch recombination in order to be considered as high confidence [default=30]")
+
+parser.add_argument('-mpcsr', '--maxPvalueCSR', 
+					dest = "maxPvalueCSR",
+					action = "store",
+					nargs = gridNargs,
+					default = "1e-10",
+					help = "Maximum p-value (Wilcoxon test of the read depth before and after the break) of a class switch recombination in order to be considered as high confidence [default=1e-10]")
+
 parser.add_argument('-mqOnco', '--mappingQualityOncoIg',
 					dest = "mapqOnco",
 					action = "store",
@@ -130,12 +250,49 @@ parser.add_argument('-@', '--threadsForSamtools',
 					default = "1",
 					help = "Maximum number of threads used for samtools [default=1]")
 
+parser.add_argument('-ae', '--alignmentEngine', 
+					dest = "alignmentEngine",
+					action = "store",
+					choices=['pysam', 'samtools'],
+					default = None,
+					help = "Engine used to read, subset and pileup BAM files [pysam = in-process (requires the pysam module), samtools = samtools subprocesses; default = pysam if installed, otherwise samtools]")
+
+parser.add_argument('-j', '--jobs', 
+					dest = "jobs",
+					action = "store",
+					default = "1",
+					help = "Number of IG loci (IGH, IGK, IGL, CSR) and genome-wide IG rearrangement analyses run in parallel (IgCaller batch: number of samples analysed in parallel) [default=1]")
+
 parser.add_argument('-kmb', '--keepMiniIgBams', 
 					dest = "keepMiniIgBams",
 					action = "store",
 					default = "no",
 					help = "Should IgCaller keep (ie no remove) mini IG BAM files used in the analysis? [yes/no, default=no]")
 
+parser.add_argument('-det', '--dumpEvidenceTables', 
+					dest = "dumpEvidenceTables",
+					action = "store",
+					default = "no",
+					help = "Should IgCaller write the read evidence tables of each IG locus (_splitinsert.tsv and _splitinsert_VJ.tsv) for debugging? [yes/no, default=no]")
+
+parser.add_argument('-ckp', '--checkpoints', 
+					dest = "checkpoints",
+					action = "store",
+					default = "no",
+					help = "Should IgCaller save the output of each stage (IG BAM files, read evidence, pileups, genome-wide read scan) in the output folder, so that a rerun with other parameters only repeats the stages they affect? [yes/no, default=no]")
+
+parser.add_argument('-met', '--metrics', 
+					dest = "metrics",
+					action = "store",
+					default = "no",
+					help = "Should IgCaller write a JSON report with the wall and CPU time, peak memory, reads, candidates, samtools processes and disk I/O of each step (_output_metrics.json)? [yes/no, default=no]")
+
+parser.add_argument('-trace', '--trace', 
+					dest = "trace",
+					action = "store",
+					default = "no",
+					help = "Should IgCaller write a timeline of the run in Chrome trace-event format, with one span per stage, function, samtools call and candidate rearrangement (_output_trace.json)? [yes/no, default=no]")
+
 parser.add_argument('-seq', '--sequencing', 
 					dest = "seq",
 					action = "store",
@@ -143,9 +300,24 @@ parser.add_argument('-seq', '--sequencing',
 					help = "Sequencing technique [wgs/wes, default=wgs]")
 
 
-options = parser.parse_args()
+if batchMode:
+	parser.add_argument('-M', '--manifest',
+						dest = "manifest",
+						action = "store",
+						required=True,
+						help = "Tab-separated file with one sample per line: sample name, tumor bam file and, optionally, normal bam file, tumor purity and sequencing technique [NA or empty = no normal, -p and -seq values]. A folder named after each sample is created inside the output directory")
+
+options = parser.parse_args(sys.argv[2:] if batchMode or sweepMode else sys.argv[1:])
+
+## IgCaller sweep: grid of values, the first ones as the options of the run
+grid = {}
+if sweepMode:
+	for setting, convert in [["vafCutoff", float], ["tumorPurity", float], ["mntoncoPass", int], ["mnnonco", int], ["minReductionCSR", float], ["maxPvalueCSR", float]]:
+		values = getattr(options, setting)
+		grid[setting] = [convert(x) for x in (values if isinstance(values, list) else [values])]
+		setattr(options, setting, values[0] if isinstance(values, list) else values)
 
-inputsFolder = options.inputsFolder
+inputsFolder = jobInputsFolder(options.inputsFolder) # IgCaller serve: same paths as the references loaded by the service
 genomeVersion = options.genomeVersion
 chrAnnot = options.chrAnnot
 originalBamT = options.bamT
@@ -163,9 +335,17 @@ tumorPurity = float(options.tumorPurity)
 mntonco = int(options.mntonco)
 mntoncoPass = int(options.mntoncoPass)
 mnnonco = int(options.mnnonco)
+minReductionCSR = float(options.minReductionCSR)
+maxPvalueCSR = float(options.maxPvalueCSR)
 mapqOnco = options.mapqOnco
 threadsForSamtools = options.threadsForSamtools
+alignmentEngine = options.alignmentEngine
+jobs = int(options.jobs)
 keepMiniIgBams = options.keepMiniIgBams
+dumpEvidenceTables = options.dumpEvidenceTables
+checkpoints = options.checkpoints
+metrics = options.metrics
+trace = options.trace
 seq = options.seq
 
 # 0) Prepare some variables and files:
@@ -174,151 +354,36 @@ print("IgCaller: checking inputs and outputs...")
 sys.path.insert(0, inputsFolder)
 from IgCaller_functions_v1_1 import *
 
-## hg19 or hg38 regions of the IG loci:
-if chrAnnot == "ensembl": chrom = ""
-else: chrom = "chr"
-if genomeVersion == "hg19": coordsToSubset = chrom+"14:106052774-107288051 "+chrom+"22:22380000-23264000 "+chrom+"2:89131589-90274600"
-elif genomeVersion == "hg38": coordsToSubset = chrom+"14:105583730-106879900 "+chrom+"22:22025700-22921700 "+chrom+"2:88832000-90235600"
-
-## check normal BAM or reference is available
-if originalBamN is None and refGenome is None:
-	sys.exit("IgCaller: error message... Normal BAM file and/or reference genome must be supplied using -N and -R, resepctively.")
-
-## Output folder and main output file:
-if outputPath is None:  wkDir = originalBamT.split("/")[-1].replace(".bam", "_IgCaller")
-else: wkDir = outputPath+"/"+originalBamT.split("/")[-1].replace(".bam", "_IgCaller")
-if not os.path.exists(wkDir): os.mkdir(wkDir)
-SUMM = open(wkDir+"/"+originalBamT.split("/")[-1].replace(".bam", "_output_filtered.tsv"), "w")
-SUMM.write("Analysis\tAnnotation\tMechanism\tScore\tMQ\tV-gene_pct_identity_to_germline\tLength_considered_identity\tFunctionality\tJunction_amino_acid_sequence\tSequence\n")
-
-## Create mini IG-bam for tumor and normal (if available):
-print("IgCaller: creating IG BAM files...")
-bamT = wkDir+"/"+originalBamT.split("/")[-1]
-comms = pathToSamtools+"samtools view -@ "+threadsForSamtools+" -h -F 3328 -q "+mapq+" -b "+originalBamT+" "+coordsToSubset+" > "+bamT  #-F 3328 (not primary alignment, supplementary alignment, read is PCR or optical duplicate)
-subprocess.call(comms, shell=True)
-comms = pathToSamtools+"samtools index -@ "+threadsForSamtools+" "+bamT 
-subprocess.call(comms, shell=True)
-bamN = None
-miniBamN = None
-if originalBamN is not None:
-	bamN = wkDir+"/"+originalBamN.split("/")[-1]
-	comms = pathToSamtools+"samtools view -@ "+threadsForSamtools+" -h -F 3328  -q "+mapq+" -b "+originalBamN+" "+coordsToSubset+" > "+bamN 
-	subprocess.call(comms, shell=True)
-	comms = pathToSamtools+"samtools index -@ "+threadsForSamtools+" "+bamN 
-	subprocess.call(comms, shell=True)
-
-
-# 1) Iterate over each IG locus:
-for GENE in ["IGH", "IGK", "IGL", "CSR"]: 
-	
-	print("IgCaller: %s..." %GENE)
-	
-	chromGene, bedFile, Dseqs = getGeneralInfo(GENE, chrom, genomeVersion, inputsFolder, chrAnnot)
-	
-	# 2) Create mini IG-locus-specific-BAM:
-	miniBamT = bamT.replace(".bam", "_miniBam.bam")
-	comms = pathToSamtools+"samtools view -@ "+threadsForSamtools+" -h -b "+bamT+" -L "+bedFile+" > "+miniBamT 
-	subprocess.call(comms, shell=True)
-	comms = pathToSamtools+"samtools index -@ "+threadsForSamtools+" "+miniBamT 
-	subprocess.call(comms, shell=True)
-	
-	miniSamT = bamT.replace(".bam", "_miniSam.sam")
-	comms = pathToSamtools+"samtools view -@ "+threadsForSamtools+" "+bamT+" -L "+bedFile+" > "+miniSamT 
-	subprocess.call(comms, shell=True)
-	
-	if bamN is not None:
-		miniBamN = wkDir+"/"+bamN.split("/")[-1].replace(".bam", "_miniBam.bam")
-		comms = pathToSamtools+"samtools view -@ "+threadsForSamtools+" -h -b "+bamN+" -L "+bedFile+" > "+ miniBamN 
-		subprocess.call(comms, shell=True)
-		comms = pathToSamtools+"samtools index -@ "+threadsForSamtools+" "+miniBamN 
-		subprocess.call(comms, shell=True)
-
-	# 3) Convert SAM file to annotated table and write to disc:
-	## Take samfile, get columns of interest and anotate read with large insert size (insertSize) and split/soft clipped (split) reads 
-	annot_table = miniSamT.replace(".sam", "_splitinsert.tsv")
-	store = convertSamToAnnotatedTable(miniSamT, chromGene, GENE)
-	ANNOT_TABLE = open(annot_table, "w")
-	for read, data in store.items(): ANNOT_TABLE.write("%s\n" %"\t".join([str(x) for x in data]))
-	ANNOT_TABLE.close()
-	
-	# 4) Find the J and V genes corresponding to each split/insert size position:
-	JV_list = findJandVgenes(annot_table, bedFile, GENE)
-	annot_table_JV = miniSamT.replace(".sam", "_splitinsert_VJ.tsv")
-	ANNOT_TABLE_JV = open(annot_table_JV, "w")
-	for i in JV_list: ANNOT_TABLE_JV.write(i)
-	ANNOT_TABLE_JV.close()
-	
-	# 5) Find combinations of J-V:
-	l = findCombinationsJandV(annot_table_JV, GENE)
-	
-	# 6) Assign positions/breaks to each J and V pairs:
-	VJ_positions, data, pos = assignPositionsToJandV(l, annot_table_JV)
-	
-	if GENE != "CSR":
-		# 7) Append to list V,J positions and number of occurrences:
-		information = addPositionsAndOccurrences(pos, bedFile, data)
-		
-		# 8) Get J and V sequences:
-		information = getJandVsequences(information, GENE, refGenome, baseq, chromGene, bamN, miniBamT, miniBamN, depth, altDepth, tumorPurity, vafCutoff, vafCutoffNormal, pathToSamtools)
-		
-		# 9) Get D sequences (IGH = N-D-N, IGK/IGL = N):
-		information = getDsequence(information, annot_table_JV, GENE, Dseqs)
-		
-		# 10) Check homology and functionality (productive/unproductive):
-		information = checkHomologyAndFunctionality(information, GENE)
-		
-		# 11) Pre-defined filter:
-		trip = predefinedFilter(information, GENE, tumorPurity, seq)
-		
-		# 12) Add mapping quality and calculate score in information:
-		information, trip = addMapQualAndScore(information, trip, GENE, annot_table_JV)
-
-		# 13) Save output:
-		Vseq = open(miniSamT.replace("_miniSam.sam", "_output_"+GENE+".tsv"), "w")
-		Vseq.write("Genes\tMechanisms\tN_split\tN_insertSize\tStart_J\tEnd_J\tN_split_rescued_J\tStart_V\tEnd_V\tN_split_rescued_V\tSeq_J\tSeq_D\tSeq_V\tSeq_V_normal\tSeq\tV-gene_pct_identity_to_germline\tLength_considered_identity\tFunctionality\tJunction_amino_acid_sequence\tScore\tMQ\n")
-		Vseq.write("\n".join(['\t'.join(map(str, item)) for item in information]))		
-		Vseq.close()
-		
-		if len(trip) != 0:
-			SUMM.write("\n".join([GENE+"\t"+item+"\t"+'\t'.join(map(str, map(trip[item].__getitem__, [0,1,19,15,16,17,18,14]))) for item in trip])+"\n")					
-		else:
-			SUMM.write(GENE+"\tNo rearrangement found"+"\tNA"*8+"\n")
-	
-	elif GENE == "CSR":
-		# 14) Study coverage around CSR and return info
-		class_switch, class_switch_filt, reductionMeans = classSwitchAnalysis(data, bedFile, baseq, chromGene, bamT, bamN, pathToSamtools, tumorPurity)
-		
-		Vseq = open(miniSamT.replace("_miniSam.sam", "_output_"+GENE+".tsv"), "w")
-		Vseq.write("Genes\tClass\tScore\tAdjusted_mean_pre_break\tAdjusted_mean_post_break\tPvalue\tPct_reduction_adjusted_means\n")
-		if len(class_switch) > 0:
-			Vseq.write("\n".join(['\t'.join(map(str, item)) for item in class_switch])+"\n")					
-		Vseq.close()
-		
-		if len(class_switch_filt) == 0:
-			SUMM.write("CSR\tIGHM\tNo CSR found"+"\tNA"*7+"\n")
-		else:
-			class_switch_filt = class_switch_filt[reductionMeans.index(max(reductionMeans))] # keep only the one with highest reduction
-			#class_switch_filt = class_switch_filt[pvals.index(min(pvals))]
-			SUMM.write("\t".join(["CSR", class_switch_filt[0], class_switch_filt[1], str(class_switch_filt[2])]+["NA"]*6)+"\n")
-
-# 15) Genome-wide IG translocations
-print("IgCaller: genome-wide IG rearrangements...")
-translocationsALL, translocationsPASS = getIgTranslocations(genomeVersion, inputsFolder, pathToSamtools, threadsForSamtools, bamT, bamN, chrom, coordsToSubset, tumorPurity, mntonco, mntoncoPass, mnnonco, mapqOnco)
-
-Vseq = open(miniSamT.replace("_miniSam.sam", "_output_oncogenic_IG_rearrangements.tsv"), "w")
-Vseq.write("\n".join(translocationsALL))		
-Vseq.close()
-
-if len(translocationsPASS) > 0: SUMM.write("\n".join(translocationsPASS))
-else: SUMM.write("Oncogenic IG rearrangement\tNo rearrangements found"+"\tNA"*8+"\n")
-
-
-# 16) Clean intermediate files and close
-comms = "rm "+wkDir+"/*miniBam.bam "+wkDir+"/*miniBam.bam.bai "+wkDir+"/*_output_mpileup.tsv "+wkDir+"/*_miniSam_splitinsert.tsv "+wkDir+"/*_miniSam_splitinsert_VJ.tsv "+wkDir+"/*_miniSam.sam"  
-subprocess.call(comms, shell=True)
-if keepMiniIgBams != "yes":
-	comms = "rm "+wkDir+"/*.bam "+wkDir+"/*.bam.bai"  
-	subprocess.call(comms, shell=True)
-
-SUMM.close()
+## Reference (hg19 or hg38 regions of the IG loci, BED indexes and D genes), from the bundle written by "IgCaller index" if available:
+reference = loadReference(inputsFolder, genomeVersion, chrAnnot)
+
+## BAM engine: pysam (in-process) if available, otherwise samtools
+if alignmentEngine is None: alignmentEngine = "samtools" if pysam is None else "pysam"
+if alignmentEngine == "pysam" and pysam is None:
+	sys.exit("IgCaller: error message... pysam module not found, install it or use -ae samtools.")
+
+## Analysis settings shared by all samples:
+settings = {"inputsFolder": inputsFolder, "refGenome": refGenome, "pathToSamtools": pathToSamtools, "mapq": mapq, "baseq": baseq, "depth": depth, "altDepth": altDepth, "vafCutoffNormal": vafCutoffNormal, "vafCutoff": vafCutoff, "tumorPurity": tumorPurity, 
+			"mntonco": mntonco, "mntoncoPass": mntoncoPass, "mnnonco": mnnonco, "minReductionCSR": minReductionCSR, "maxPvalueCSR": maxPvalueCSR, "mapqOnco": mapqOnco, "threadsForSamtools": threadsForSamtools, "alignmentEngine": alignmentEngine, "jobs": jobs, "keepMiniIgBams": keepMiniIgBams, "dumpEvidenceTables": dumpEvidenceTables, "checkpoints": checkpoints, "metrics": metrics, "trace": trace, "seq": seq}
+
+## IgCaller batch: samples of the manifest spread over -j processes (each sample analysed by a single process), one output folder per sample and a summary table:
+if batchMode:
+	samples = readBatchManifest(options.manifest)
+	if outputPath is None: outputPath = "."
+	if not os.path.exists(outputPath): os.mkdir(outputPath)
+	settings["jobs"] = 1
+	failed = analyseBatch(reference, settings, samples, outputPath, jobs)
+	print("IgCaller: %s of %s samples done (see %s/IgCaller_batch_summary.tsv)!" %(len(samples)-failed, len(samples), outputPath))
+	sys.exit(0)
+
+## IgCaller sweep: all combinations of the grid values on the same IG BAM files, read evidence and pileups (shared through the checkpoints), one table with the calls of each combination:
+if sweepMode:
+	settings["checkpoints"] = "yes"
+	wkDir = sweepSample(reference, settings, grid, originalBamT, originalBamN, seq, outputPath)
+	print("IgCaller: done (see %s)!" %(wkDir+"/"+originalBamT.split("/")[-1].replace(".bam", "_output_sweep.tsv")))
+	sys.exit(0)
+
+# 1-16) Analyse the sample:
+analyseSample(reference, settings, originalBamT, originalBamN, tumorPurity, seq, outputPath)
+
 print("IgCaller: done!")
@@ -0,0 +1,108 @@
+# Benchmark of pileupAlleles (mpileup base string tokenizer) against the former character by character loop
+# python3 benchmarks/benchmark_pileupAlleles.py [-d 30,100] [-c 20000] [-r 3]
+
+# Modules
+import argparse
+import os
+import platform
+import random
+import sys
+import time
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "IgCaller_reference_files"))
+from IgCaller_functions_v1_1 import pileupAlleles
+
+# functions
+def pileupAllelesLoop(bases, ref):
+	# former parser of getJandVsequences (one step per character), kept as reference
+	dna = {}
+	bases = bases.replace(",", ref).replace(".", ref)
+	bases = bases.upper()
+	g = 0
+	while g < len(bases):
+		if bases[g].isdigit():
+			if bases[g+1].isdigit(): s = 2
+			else: s = 1
+			prev = bases[g-1]
+			now = int(bases[g:g+s])
+			indels = (bases[g+s:g+s+now])
+			if prev == "+":
+				ins = bases[g-2]+"["+indels+"]"
+				if ins not in dna:
+					dna[ins] = 1
+					dna[bases[g-2]] -= 1
+				else:
+					dna[ins] += 1
+					dna[bases[g-2]] -= 1
+				g += now + 1
+			elif prev == "-":
+				dele = bases[g-2]+"("+indels+")"
+				if dele not in dna:
+					dna[dele] = 1
+					dna[bases[g-2]] -= 1
+				else:
+					dna[dele] += 1
+					dna[bases[g-2]] -= 1
+				g += now + 1
+			else:
+				g += 2
+		elif bases[g] in ("A", "C", "G", "T"):
+			if bases[g] not in dna:
+				dna[bases[g]] = 1
+			else:
+				dna[bases[g]] += 1
+			g += 1
+		else:
+			g += 1
+	return(dna)
+
+def simulateColumns(depth, columns, seed):
+	# mpileup columns [base string, ref] of a heterozygous/clonal locus: read starts (^ and mapping quality, some of them digits), read ends ($), mismatches, small indels and a few > 9 bases
+	rand = random.Random(seed)
+	data = []
+	for i in range(columns):
+		ref = rand.choice("ACGT")
+		alt = rand.choice([x for x in "ACGT" if x != ref])
+		vaf = rand.choice([0, 0, 0, 0.02, 0.5])
+		reads = []
+		for k in range(max(1, int(rand.gauss(depth, depth**0.5)))):
+			rev = rand.random() < 0.5
+			read = ""
+			if rand.random() < 0.01: read += "^"+chr(rand.choice([60, 60, 60, 20, 0])+33)
+			b = alt if rand.random() < vaf else rand.choice("ACGT") if rand.random() < 0.005 else ("," if rev else ".")
+			read += b.lower() if rev and b != "," else b
+			if rand.random() < 0.004:
+				L = rand.choice([1, 1, 2, 3, 12])
+				seq = "".join(rand.choice("ACGT") for _ in range(L))
+				read += rand.choice("+-")+str(L)+(seq.lower() if rev else seq)
+			if rand.random() < 0.01: read += "$"
+			reads.append(read)
+		data.append(["".join(reads), ref])
+	return(data)
+
+def timeParser(parser, data, repeats):
+	# best wall time of repeats runs over all columns
+	best = None
+	for r in range(repeats):
+		t = time.perf_counter()
+		for bases, ref in data: parser(bases, ref)
+		t = time.perf_counter() - t
+		if best is None or t < best: best = t
+	return(best)
+
+# options
+parser = argparse.ArgumentParser(description="Benchmark of the mpileup base string tokenizer (pileupAlleles)")
+parser.add_argument("-d", "--depths", default="30,100", help="Comma-separated read depths of the simulated columns (30 as in the Demo WGS BAMs, 100 for 100x). Default: 30,100", dest="depths")
+parser.add_argument("-c", "--columns", default="20000", help="Number of pileup columns per depth (about the J/V positions piled up for the three IG loci of one sample). Default: 20000", dest="columns")
+parser.add_argument("-r", "--repeats", default="3", help="Timed runs per parser (the best one is reported). Default: 3", dest="repeats")
+options = parser.parse_args()
+
+print("# python "+platform.python_version()+", "+platform.machine()+" "+(platform.processor() or platform.platform())+", "+str(os.cpu_count())+" CPUs, best of "+options.repeats+" runs")
+print("depth\tcolumns\tloop_s\ttokenizer_s\tspeedup")
+for depth in [int(x) for x in options.depths.split(",")]:
+	data = simulateColumns(depth, int(options.columns), depth)
+	for bases, ref in data:
+		if list(pileupAllelesLoop(bases, ref).items()) != list(pileupAlleles(bases, ref).items()):
+			sys.exit("IgCaller: error... different allele counts for "+bases)
+	loop = timeParser(pileupAllelesLoop, data, int(options.repeats))
+	tokenizer = timeParser(pileupAlleles, data, int(options.repeats))
+	print(str(depth)+"\t"+options.columns+"\t"+str(round(loop, 3))+"\t"+str(round(tokenizer, 3))+"\t"+str(round(loop/tokenizer, 1))+"x")
@@ -0,0 +1,57 @@
+# Tests of clusterOneReadEvents (sort-and-sweep merge of one-read IG rearrangements, step 2 of getIgTranslocations) on crafted breakpoints
+# python3 -m pytest tests
+
+# Modules
+import os
+import random
+import sys
+import pytest
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "IgCaller_reference_files"))
+from IgCaller_functions_v1_1 import clusterOneReadEvents
+
+# crafted one-read events [posIn, strandIn, posOut, strandOut] of one chromosome pair (in file order), mntonco and the expected clusters [minIn, maxIn, strandIn, minOut, maxOut, strandOut, number of reads]
+fixtures = {
+	"one breakpoint": [3,
+		[[1000, "+", 5000, "+"], [1200, "+", 5100, "+"], [1500, "+", 5400, "+"]],
+		[[1000, 1500, "+", 5000, 5400, "+", 3]]],
+	"below mntonco": [4,
+		[[1000, "+", 5000, "+"], [1200, "+", 5100, "+"], [1500, "+", 5400, "+"]],
+		[]],
+	"chained positions": [3, # each read < 1000 bp from the previous one in both chromosomes
+		[[0, "+", 0, "+"], [900, "+", 900, "+"], [1800, "+", 1800, "+"]],
+		[[0, 1800, "+", 0, 1800, "+", 3]]],
+	"tolerance": [2, # 1000 bp apart in the IG chromosome: another cluster
+		[[0, "+", 0, "+"], [1000, "+", 0, "+"], [1999, "+", 999, "+"]],
+		[[1000, 1999, "+", 0, 999, "+", 2]]],
+	"two breakpoints, reads interleaved": [3, # former merge: each read closed the window of the other breakpoint, nothing reached mntonco
+		[[1000, "+", 5000, "+"], [60000, "+", 90000, "+"], [1100, "+", 5100, "+"], [60100, "+", 90100, "+"], [1200, "+", 5200, "+"], [60200, "+", 90200, "+"]],
+		[[1000, 1200, "+", 5000, 5200, "+", 3], [60000, 60200, "+", 90000, 90200, "+", 3]]],
+	"upper partner position": [3, # former merge: a read added to a closed cluster kept the minimum as upper partner position (5200)
+		[[1000, "+", 5000, "+"], [1100, "+", 5100, "+"], [1200, "+", 5200, "+"], [80000, "+", 90000, "+"], [1300, "+", 5900, "+"]],
+		[[1000, 1300, "+", 5000, 5900, "+", 4]]],
+	"two partner breakpoints": [3, # chained IG positions, reads of two partner breakpoints alternating (former merge: none)
+		[[0, "+", 0, "+"], [300, "+", 9000, "+"], [600, "+", 50, "+"], [900, "+", 9050, "+"], [1200, "+", 100, "+"], [1500, "+", 9100, "+"]],
+		[[0, 1200, "+", 0, 100, "+", 3], [300, 1500, "+", 9000, 9100, "+", 3]]],
+	"cluster closed by the sweep": [2, # the 1st partner breakpoint reappears >= 1000 bp after its last read: new cluster (former merge: only the last one)
+		[[0, "+", 0, "+"], [500, "+", 9000, "+"], [400, "+", 100, "+"], [1000, "+", 9100, "+"], [1600, "+", 200, "+"], [1900, "+", 300, "+"]],
+		[[0, 400, "+", 0, 100, "+", 2], [500, 1000, "+", 9000, 9100, "+", 2], [1600, 1900, "+", 200, 300, "+", 2]]],
+	"strand pairs": [2, # former merge: none, reads alternate between strand pairs
+		[[1000, "+", 5000, "+"], [1100, "-", 5100, "+"], [1200, "+", 5200, "+"], [1300, "-", 5300, "+"]],
+		[[1000, 1200, "+", 5000, 5200, "+", 2], [1100, 1300, "-", 5100, 5300, "+", 2]]]}
+
+@pytest.mark.parametrize("name", list(fixtures))
+def test_clusters(name):
+	mntonco, reads, expected = fixtures[name]
+	assert clusterOneReadEvents(*[list(column) for column in zip(*reads)], mntonco) == expected
+
+@pytest.mark.parametrize("name", list(fixtures))
+def test_read_order(name):
+	# same clusters whatever the order of the reads in the BAM file
+	mntonco, reads, expected = fixtures[name]
+	rand = random.Random(name)
+	for k in range(10):
+		shuffled = rand.sample(reads, len(reads))
+		assert clusterOneReadEvents(*[list(column) for column in zip(*shuffled)], mntonco) == expected
+
+def test_no_events():
+	assert clusterOneReadEvents([], [], [], [], 4) == []
@@ -0,0 +1,24 @@
+# Tests of highConfidenceCalls (High_confidence_rearrangements column of IgCaller_batch_summary.tsv) on main output files with and without calls
+# python3 -m pytest tests
+
+# Modules
+import os
+import sys
+import pytest
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "IgCaller_reference_files"))
+from IgCaller_functions_v1_1 import highConfidenceCalls, summaryHeader
+
+# main output files (see analyseSample): no-call lines as written by analyseIgLocus and analyseOncogenicIgRearrangements
+noCalls = ["IGH\tNo rearrangement found"+"\tNA"*8+"\n", "IGK\tNo rearrangement found"+"\tNA"*8+"\n", "IGL\tNo rearrangement found"+"\tNA"*8+"\n",
+		"CSR\tIGHM\tNo CSR found"+"\tNA"*7+"\n", "Oncogenic IG rearrangement\tNo rearrangements found"+"\tNA"*8+"\n"]
+calls = ["IGH\tIGHJ4 - IGHD6-19 - IGHV3-23\tDeletion\t55.0\t52.1 (0-60)\t99.291\t280/282\tProductive\tCARDSSGWYFDYW\tACGT\n",
+		"IGK\tIGKJ1 - IGKV1-33\tDeletion\t13.0\t50 (0-60)\t99.251\t265/267\tProductive\tCQQYDNLPRTF\tACGT\n",
+		"CSR\tIGHG3\tDeletion\t26.0\tNA\tNA\tNA\tNA\tNA\tNA\n",
+		"Oncogenic IG rearrangement\tt(14;18) [14:106329000:-;18:60793000:+] [IGH - BCL2]\tTranslocation\t25.0 (0)\tNA\tNA\tNA\tNA\tNA\tNA\n"]
+
+@pytest.mark.parametrize("lines, expected", [
+	[[summaryHeader]+noCalls, 0], # sample without calls (the CSR no-call line was counted before)
+	[[summaryHeader, calls[0], calls[1], noCalls[2], noCalls[3], noCalls[4]], 2], # sample without CSR
+	[[summaryHeader]+calls, 4]]) # calls in every analysis
+def test_high_confidence_calls(lines, expected):
+	assert highConfidenceCalls(lines) == expected
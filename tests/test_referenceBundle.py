@@ -0,0 +1,59 @@
+# Tests of the reference bundle (IgCaller index, see buildReferenceBundle and loadReference) on a copy of the hg19 ensembl reference files
+# python3 -m pytest tests
+
+# Modules
+import gzip
+import os
+import pickle
+import shutil
+import sys
+import pytest
+referenceFiles = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "IgCaller_reference_files")
+sys.path.insert(0, referenceFiles)
+from IgCaller_functions_v1_1 import buildReferenceBundle, loadReference, annotationFiles
+
+@pytest.fixture
+def inputsFolder(tmp_path):
+	# hg19 ensembl BED files and D genes, and small GeneID/RepeatMasker dictionaries ({chrom: [[start, end, name]]}), indexed by IgCaller index
+	shutil.copytree(os.path.join(referenceFiles, "hg19", "ensembl"), str(tmp_path/"hg19"/"ensembl"))
+	os.mkdir(str(tmp_path/"hg19"/"dicts"))
+	for dictFile in annotationFiles(str(tmp_path), "hg19").values():
+		DICT = gzip.open(dictFile, "wb")
+		pickle.dump({"14": [["106000000", "106100000", "GENE1"]], "18": [["60700000", "60900000", "BCL2"]]}, DICT)
+		DICT.close()
+	buildReferenceBundle(str(tmp_path), "hg19", "ensembl")
+	loadReference.cache_clear()
+	yield str(tmp_path)
+	loadReference.cache_clear()
+
+def test_bundle_loaded(inputsFolder):
+	assert sorted(loadReference(inputsFolder, "hg19", "ensembl")["loci"]) == ["CSR", "IGH", "IGK", "IGL"]
+
+def test_unchanged_source_touched(inputsFolder):
+	# new modification time, same content: checksummed again and still valid
+	bedFile = os.path.join(inputsFolder, "hg19", "ensembl", "wgEncodeGencodeBasicV19_hg19_IGH_genes_VJ.bed")
+	os.utime(bedFile, ns=(os.stat(bedFile).st_atime_ns, os.stat(bedFile).st_mtime_ns+10**9))
+	assert "IGH" in loadReference(inputsFolder, "hg19", "ensembl")["loci"]
+
+@pytest.mark.parametrize("source", [os.path.join("hg19", "ensembl", "wgEncodeGencodeBasicV19_hg19_IGH_genes_VJ.bed"), os.path.join("hg19", "ensembl", "DB_D_genes_seq_wgEncodeGencodeBasicV19_hg19.txt")])
+def test_edited_source(inputsFolder, source):
+	# same size, one base changed after IgCaller index: the run stops
+	path = os.path.join(inputsFolder, source)
+	content = open(path).read()
+	k = content.index("\t")-1 if source.endswith(".bed") else content.rindex("A")
+	open(path, "w").write(content[:k]+("C" if source.endswith(".txt") else str((int(content[k])+1) % 10))+content[k+1:])
+	with pytest.raises(SystemExit, match="run IgCaller index again"):
+		loadReference(inputsFolder, "hg19", "ensembl")
+
+def test_edited_annotation(inputsFolder):
+	dictFile = annotationFiles(inputsFolder, "hg19")["GeneID"]
+	DICT = gzip.open(dictFile, "wb")
+	pickle.dump({"14": [["106000000", "106200000", "GENE2"]]}, DICT)
+	DICT.close()
+	with pytest.raises(SystemExit, match="run IgCaller index again"):
+		loadReference(inputsFolder, "hg19", "ensembl")
+
+def test_removed_source(inputsFolder):
+	os.remove(os.path.join(inputsFolder, "hg19", "ensembl", "hg19_Huebschmann_et_al_switch_regions.bed"))
+	with pytest.raises(SystemExit, match="run IgCaller index again"):
+		loadReference(inputsFolder, "hg19", "ensembl")